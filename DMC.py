@@ -11,7 +11,6 @@ The connection can be made with USB or over IP
 Written by Ville Tiukuvaara
 """
 
-import gclib
 import util
 from enum import Enum
 import math
@@ -19,7 +18,21 @@ import threading
 import time
 import queue
 import traceback
+import json
+import os
+import random
 import numpy as np
+from events import Event
+
+gclib = None  # Imported when first connecting (see load_gclib)
+
+
+class GclibError(Exception):
+    """Stands in for gclib.GclibError until gclib is imported (a dummy DMC
+    never imports it)."""
+
+    pass
+
 
 """Some constants for configuration."""
 CNT_PER_CM = [4385, 4385, 12710]  # Stepper motor counts per cm for each axis
@@ -33,6 +46,25 @@ LOOP_SLEEP = 0.02  # Update every 20 ms
 RETRY_SLEEP = 0.25  # If something fails, sleep this long before retrying
 MIN_Z = -25  # Minimum position on Z axis
 MAX_Y = 120  # Maximum position on Y axis
+HOME_APPROACH_MARGIN = 0.3  # Fast approach stops this far short of home in cm
+HOME_SEARCH_DISTANCE = 1  # How far past the stored home to search in cm
+HOME_SLOW_SPEED = 0.5  # Speed for the final approach to home in cm/sec
+HOME_VERIFY_TOLERANCE = 10  # Counts the registers may differ from stored ones
+RECOVER_ATTEMPTS = 5  # Reconnection attempts after a gclib error
+# Variable set in the DMC on connecting; if it is lost, the DMC was reset
+SESSION_VARIABLE = "nfsess"
+# File where the home geometry is stored between connections
+HOME_FILE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "home.json")
+BACKLASH_CM = [0, 0, 0]  # Backlash for each axis if it was not calibrated
+BACKLASH_STEP = 4  # Step size in counts when calibrating backlash
+BACKLASH_SEARCH = 1  # How far to search for the limit switch in cm
+BACKLASH_REPEATS = 3  # Backlash is averaged over this many measurements
+# Hysteresis of the limit switches in cm (subtracted from measured backlash)
+LIMIT_HYSTERESIS_CM = [0, 0, 0]
+# File where the calibrated backlash is stored
+BACKLASH_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)), "backlash.json"
+)
 # DEFAULT_IP = 'COM4'
 
 # Set which DMC axes are connected to the physical CNC machine motors
@@ -86,6 +118,12 @@ class DMCRequest:
         self.coord = coord
         return self
 
+    def home_params(self, full):
+        """Set up request to home, either with the full sequence (full=True)
+        or with a fast re-home using the stored geometry, if possible."""
+        self.full = full
+        return self
+
     def connect_params(self, ip):
         """Set up request to connect to IP (can be IP address or COM port).
 
@@ -112,6 +150,7 @@ class Status(Enum):
     HOMING = 4  # Performing calibration/homing
     STOP = 5  # Motors are stopped but enabled (drawing current)
     MOTORS_DISABLED = 6  # Connected but motors are disabled (no current)
+    CALIBRATING = 7  # Measuring the backlash of the axes
 
 
 class ErrorType(Enum):
@@ -164,6 +203,9 @@ HOMING_STOP_CODE = [
     StopCode.DECEL_STOP_REV_LIM,
     StopCode.DECEL_STOP_FWD_LIM,
 ]
+# Which limit switch input is used at the origin for each axis
+# (both X inputs are connected to the same sensor)
+HOMING_LIMIT_INPUT = ["LF", "LR", "LF"]
 
 
 class SpatialSweepParams:
@@ -218,6 +260,35 @@ class SpatialSweepParams:
         """
         return [pos[n] for pos in self.grid]
 
+    def get_shape(self):
+        """Returns the number of points along each axis."""
+        return [p[2] for p in self.params]
+
+    def get_axes(self):
+        """Returns a list with a numpy array of the coordinates along each axis."""
+        return [np.linspace(p[0], p[1], p[2]) for p in self.params]
+
+    def get_index(self, n):
+        """Returns the grid index [ix, iy, iz] of the nth coordinate."""
+        nx, ny, nz = self.get_shape()
+        ix = n % nx
+        iy = (n // nx) % ny
+        iz = n // (nx * ny)
+        if iy % 2 == 1:
+            ix = nx - 1 - ix  # X is swept backwards on every other row
+        return [ix, iy, iz]
+
+
+def load_gclib():
+    """Imports gclib, which is only needed once a DMC is connected."""
+    global gclib, GclibError
+    if gclib is None:
+        import gclib as g
+
+        gclib = g
+        GclibError = g.GclibError
+    return gclib
+
 
 class DMC(object):
     """DMC class that acts as a state machine for interfacing with the DMC4163.
@@ -228,13 +299,18 @@ class DMC(object):
         d.home() # Start homing/calibration
     """
 
-    def __init__(self, dummy):
+    def __init__(self, dummy, events=None):
         """Init the DMC (does not actually connect).
 
         Passing True causes the DMC to act as a "dummy" interface that doesn't
         actually connect to a DMC but can be used for debugging.
+
+        If events (EventBus) is given, changes of the status and position, and
+        errors, are published to it.
         """
         self.dummy = dummy
+        self.events = events
+        self.published_position = None  # Last position published
         self.status = Status.DISCONNECTED
 
         # Since it supports multithreading, these locks prevent mutliple access
@@ -244,6 +320,7 @@ class DMC(object):
         self.block = False
 
         self.speed = [0, 0, 0]  # Current set speed
+        self.speed_before_homing = None  # Speed to restore when homing ends
         self.position_cnt = None  # Do not have position count until homing is done
         # Keep track of if the axes are at the limits
         # 1 -> forward limit
@@ -263,8 +340,42 @@ class DMC(object):
         self.g = None
         self.ip_address = DEFAULT_IP
 
+        # The position registers are referenced to home (i.e. a fast re-home
+        # can be done) if this is true
+        self.home_valid = False
+        self.fast_homing = False  # Is the current homing a fast re-home?
+        # Where home was found relative to the stored position, in counts
+        self.home_offset = None
+        # Identifies this connection, to check if the DMC was reset
+        self.session_id = None
+        self.recoveries = 0  # Number of times the connection was recovered
+
+        # Backlash for each axis in counts, and the direction each axis last
+        # moved in (+1 or -1), which determines if backlash is taken up
+        self.backlash_cnt = self.load_backlash()
+        self.lash_direction = [1 if d else -1 for d in HOMING_DIRECTION]
+
         self.request_queue = queue.Queue()
 
+    @property
+    def status(self):
+        """Current Status of the DMC."""
+        return self._status
+
+    @status.setter
+    def status(self, status):
+        changed = getattr(self, "_status", None) != status
+        self._status = status
+        if changed:
+            self.publish(Event.DMC_STATUS, status)
+            if len(getattr(self, "errors", {})) > 0:
+                self.publish(Event.DMC_ERROR)
+
+    def publish(self, event, payload=None):
+        """Publishes an event, if there is an EventBus."""
+        if self.events is not None:
+            self.events.publish(event, payload)
+
     def clean_up(self):
         """Makes sure DMC is disconnected when exiting."""
         if self.task != None:
@@ -316,7 +427,7 @@ class DMC(object):
             try:
                 self.send_command("MO")
                 util.dprint("Motors disabled")
-            except gclib.GclibError as e:
+            except GclibError as e:
                 if i == 3:
                     raise e
                 else:
@@ -358,14 +469,149 @@ class DMC(object):
     #            self.send_command('DC{}={}'.format(m.value, acc))
 
     def get_position(self):
-        """Returns the current position in cm."""
+        """Returns the current position in cm (corrected for backlash)."""
         if self.status == Status.DISCONNECTED or self.status == Status.MOTORS_DISABLED:
             return None
         pos = []
         for mi, m in enumerate(self.position_cnt):
-            pos.append(m / CNT_PER_CM[mi])
+            comp = self.backlash_compensation(mi, self.lash_direction[mi])
+            pos.append((m - comp) / CNT_PER_CM[mi])
         return pos
 
+    def backlash_compensation(self, mi, direction):
+        """Returns the counts to add to the commanded position of axis mi when
+        moving in direction (+1 or -1).
+
+        The origin is found while moving in the homing direction, so there is
+        no compensation in that direction. In the other direction, the backlash
+        has to be taken up before the stage moves.
+        """
+        if direction == (1 if HOMING_DIRECTION[mi] else -1):
+            return 0
+        return direction * self.backlash_cnt[mi]
+
+    def load_backlash(self):
+        """Returns the calibrated backlash in counts, or the default from
+        BACKLASH_CM if there is no calibration."""
+        try:
+            with open(BACKLASH_FILE) as f:
+                return json.load(f)["backlash_cnt"]
+        except (OSError, ValueError, KeyError):
+            return [math.floor(b * cnt) for b, cnt in zip(BACKLASH_CM, CNT_PER_CM)]
+
+    def save_backlash(self):
+        """Stores the calibrated backlash."""
+        try:
+            with open(BACKLASH_FILE, "w") as f:
+                json.dump({"backlash_cnt": self.backlash_cnt}, f)
+        except OSError:
+            util.dprint("Could not store backlash calibration")
+
+    def load_home_geometry(self):
+        """Returns the position counts and session id stored when last
+        disconnected, or None if they were not referenced to home."""
+        try:
+            with open(HOME_FILE) as f:
+                geometry = json.load(f)
+            if geometry["referenced"] and geometry.get("session") is not None:
+                return geometry["position_cnt"], geometry["session"]
+        except (OSError, ValueError, KeyError):
+            pass
+        return None
+
+    def save_home_geometry(self):
+        """Stores the current position counts so that a reconnect can verify
+        the position with a short search instead of a full homing sequence."""
+        if self.dummy:
+            return
+        geometry = {
+            "referenced": self.home_valid and self.position_cnt is not None,
+            "position_cnt": self.position_cnt,
+            "home_offset": self.home_offset,
+            "session": self.session_id,
+        }
+        try:
+            with open(HOME_FILE, "w") as f:
+                json.dump(geometry, f)
+        except OSError:
+            util.dprint("Could not store home geometry")
+
+    def registers_referenced(self):
+        """Checks if the position registers in the DMC still match the stored
+        geometry (i.e. no reset or power cycle since the last disconnect).
+
+        The registers read 0 after a power cycle, which matches a stage that
+        was parked at home, so the session variable must also have survived.
+
+        This is blocking!
+        """
+        stored = self.load_home_geometry()
+        if self.dummy or stored is None:
+            return False
+        position_cnt, session = stored
+        try:
+            if int(float(self.send_command("MG{}".format(SESSION_VARIABLE)))) != session:
+                return False
+        except (GclibError, ValueError):
+            return False  # The variable is not defined since a power cycle
+        for mi, m in enumerate(AXES_MOTORS):
+            cnt = math.floor(float(self.send_command("MG_TD{}".format(m.value))))
+            if abs(cnt - position_cnt[mi]) > HOME_VERIFY_TOLERANCE:
+                return False
+        return True
+
+    def _recover(self):
+        """Tries to re-establish the connection after a gclib error.
+
+        Reconnects with exponential backoff, then checks that the DMC was not
+        reset or power cycled (the session variable survived) and that the
+        motors are still enabled, so the position is still referenced to home.
+        Returns True if the connection was recovered.
+
+        This is blocking!
+        """
+        if self.dummy or self.status in [
+            Status.DISCONNECTED,
+            Status.MOTORS_DISABLED,
+            Status.HOMING,
+        ]:
+            return False
+
+        with self.comm_lock:
+            sleep = RETRY_SLEEP
+            for i in range(RECOVER_ATTEMPTS):
+                time.sleep(sleep)
+                sleep *= 2
+                try:
+                    try:
+                        self.g.GClose()
+                    except GclibError:
+                        pass
+                    self.g = gclib.py()
+                    self.g.GOpen(self.ip_address)
+                    if "COM" in self.ip_address:
+                        self.send_command("EO0")
+                except GclibError:
+                    util.dprint("DMC reconnection attempt {} failed".format(i + 1))
+                    continue
+
+                try:
+                    session = self.send_command("MG{}".format(SESSION_VARIABLE))
+                    if int(float(session)) != self.session_id:
+                        raise ValueError
+                    for m in AXES_MOTORS:
+                        if float(self.send_command("MG_MO{}".format(m.value))) != 0:
+                            raise ValueError
+                    self.update_position()
+                except (GclibError, ValueError):
+                    util.dprint("DMC was reset, so position is lost")
+                    return False
+
+                self.recoveries += 1
+                util.dprint("Recovered connection to DMC")
+                return True
+        return False
+
     def update_errors(self):
         """Updates the internal list of errors.
 
@@ -453,6 +699,7 @@ class DMC(object):
 
     def process_request(self):
         """This responds to a single request in the queue, if there is one present."""
+        r = None
         try:
             # Try to get a single request
             r = self.request_queue.get(True, LOOP_SLEEP)
@@ -472,7 +719,7 @@ class DMC(object):
                         connected = True
                         print("Connected to:" + self.g.GInfo())
 
-                    except gclib.GclibError:
+                    except GclibError:
                         # self.errors[ErrorType.GCLIB] = "Failed to connect"
                         self.errors[ErrorType.OTHER] = "DMC Connection Failed"
                         self.status = Status.DISCONNECTED
@@ -483,8 +730,18 @@ class DMC(object):
                 # Do initialization if connection successful
                 if connected:
                     self.ip_address = r.ip
-                    self.send_command("RS")  # Perform reset to power on condition
-                    time.sleep(RETRY_SLEEP)
+                    if "COM" in self.ip_address:
+                        self.send_command("EO0")
+
+                    # If the DMC kept its position registers (e.g. after a
+                    # brief comms drop), keep them so that a fast re-home can
+                    # be done. Otherwise, reset to power on condition.
+                    self.home_valid = self.registers_referenced()
+                    if self.home_valid:
+                        util.dprint("Position registers still referenced")
+                    else:
+                        self.send_command("RS")
+                        time.sleep(RETRY_SLEEP)
                     if "COM" in self.ip_address:
                         self.send_command(
                             "EO0"
@@ -503,7 +760,7 @@ class DMC(object):
                         self.send_command("MO")
                         try:
                             self.send_command("WT2")
-                        except gclib.GclibError:
+                        except GclibError:
                             pass
 
                     # Set axis A,B,C,D to be stepper motors
@@ -534,6 +791,11 @@ class DMC(object):
                     # self.send_command("TM 1000")
 
                     self.set_speed(MIN_SPEED)
+
+                    self.session_id = random.randint(1, 999999)
+                    self.send_command(
+                        "{}={}".format(SESSION_VARIABLE, self.session_id)
+                    )
                     # self.set_acceleration(5)
                     # self.set_decceleration(5)
 
@@ -596,6 +858,7 @@ class DMC(object):
                         "JG{}={}".format(motor, sign * self.speed[r.axis])
                     )
                     self.send_command("BG{}".format(motor))
+                    self.lash_direction[r.axis] = sign
 
                     if self.dummy:
                         self.stop_code = [
@@ -608,6 +871,7 @@ class DMC(object):
             if r.type == Status.MOVING_RELATIVE and self.status == Status.STOP:
                 status = Status.MOVING_RELATIVE
                 dir = []
+                lash_dir = self.lash_direction[:]
 
                 for mi, m in enumerate(AXES_MOTORS):
                     # If limit is active, check we are moving in the opposite
@@ -617,16 +881,23 @@ class DMC(object):
                     ):
                         status = Status.STOP
                         break
+                    if r.coord[mi] != 0:
+                        lash_dir[mi] = 1 if r.coord[mi] > 0 else -1
+                    # Take up backlash if the direction changes
+                    comp = self.backlash_compensation(
+                        mi, lash_dir[mi]
+                    ) - self.backlash_compensation(mi, self.lash_direction[mi])
                     self.send_command("SP{}={}".format(m.value, self.speed[mi]))
                     self.send_command(
                         "PR{}={}".format(
-                            m.value, math.floor(r.coord[mi] * CNT_PER_CM[mi])
+                            m.value, math.floor(r.coord[mi] * CNT_PER_CM[mi]) + comp
                         )
                     )
                     dir.append(r.coord[mi] >= 0)
 
                 if status == Status.MOVING_RELATIVE:
                     self.movement_direction = dir
+                    self.lash_direction = lash_dir
                     self.configure_limits()
                     for mi, m in enumerate(AXES_MOTORS):
                         if r.coord[mi] != 0:
@@ -641,8 +912,15 @@ class DMC(object):
                 pos = [
                     math.floor(coord * cnt) for coord, cnt in zip(r.coord, CNT_PER_CM)
                 ]
-                delta = [stop - start for stop, start in zip(pos, self.position_cnt)]
+                # Position of the stage, i.e. without the backlash that is
+                # currently taken up
+                actual = [
+                    cnt - self.backlash_compensation(mi, self.lash_direction[mi])
+                    for mi, cnt in enumerate(self.position_cnt)
+                ]
+                delta = [stop - start for stop, start in zip(pos, actual)]
                 dir = []
+                lash_dir = self.lash_direction[:]
 
                 for mi, m in enumerate(AXES_MOTORS):
                     # If limit is active, check we are moving in the opposite direction
@@ -651,13 +929,17 @@ class DMC(object):
                     ):
                         status = Status.STOP
                         break
+                    if delta[mi] != 0:
+                        lash_dir[mi] = 1 if delta[mi] > 0 else -1
+                    comp = self.backlash_compensation(mi, lash_dir[mi])
                     self.send_command("SP{}={}".format(m.value, self.speed[mi]))
-                    self.send_command("PA{}={}".format(m.value, pos[mi]))
+                    self.send_command("PA{}={}".format(m.value, pos[mi] + comp))
 
                     dir.append(delta[mi] >= 0)
 
                 if status == Status.MOVING_ABSOLUTE:
                     self.movement_direction = dir
+                    self.lash_direction = lash_dir
                     self.configure_limits()
                     for mi, m in enumerate(AXES_MOTORS):
                         if r.coord[mi] != 0:
@@ -665,13 +947,28 @@ class DMC(object):
 
                 self.status = status
 
+            # Request to calibrate the backlash while stopped
+            if r.type == Status.CALIBRATING and self.status == Status.STOP:
+                self.status = Status.CALIBRATING
+                self._calibrate_backlash()
+                self.status = Status.STOP
+
             # Starting homing sequence while not disconnected
             if r.type == Status.HOMING and self.status != Status.DISCONNECTED:
                 self.send_command("MO")  # Disable motors
                 time.sleep(RETRY_SLEEP)  # Wait a moment
                 self.send_command("SH")  # Enable motors
+                self.speed_before_homing = self.speed[:]
                 self.set_speed(CAL_SPEED)
 
+                self.fast_homing = (
+                    not r.full and self.home_valid and self.position_cnt is not None
+                )
+                if self.fast_homing:
+                    self._start_fast_homing()
+                    self.status = Status.HOMING
+                    return
+
                 # For x axis, need to check which limit we are at
                 if (
                     float(self.send_command("MG_LF{}".format(Motor.X.value))) == 0
@@ -707,7 +1004,7 @@ class DMC(object):
                             )
                         )
                         self.send_command("BG{}".format(m.value))
-                    except gclib.GclibError:
+                    except GclibError:
                         pass
 
                 if not self.dummy:
@@ -735,10 +1032,18 @@ class DMC(object):
 
         except queue.Empty as e:
             pass
-        except gclib.GclibError as e:
+        except GclibError as e:
             msg = traceback.format_exc()
-            self.errors[ErrorType.GCLIB] = msg
             util.dprint(msg)
+            if self._recover():
+                # Absolute moves can safely be redone after stopping any
+                # motion that might have partially started
+                if r is not None and r.type == Status.MOVING_ABSOLUTE:
+                    self.send_command("ST")
+                    self.g.GMotionComplete("".join([m.value for m in AXES_MOTORS]))
+                    self.request_queue.put(r, False)
+                return
+            self.errors[ErrorType.GCLIB] = msg
             try:
                 self._disconnect()
                 self.status = Status.DISCONNECTED
@@ -754,6 +1059,187 @@ class DMC(object):
             self._disconnect()
             self.status = Status.DISCONNECTED
 
+    def _start_fast_homing(self):
+        """Starts the fast re-home using the stored home geometry.
+
+        X and Y first move quickly to HOME_APPROACH_MARGIN short of the stored
+        home (i.e. position 0), and then they slowly move towards the limit
+        switches. If the limits are not found within HOME_SEARCH_DISTANCE past
+        the stored home, the full homing sequence is done instead.
+
+        This is blocking!
+        """
+        sign = [1 if forward else -1 for forward in HOMING_DIRECTION]
+        motors = [Motor.X, Motor.Y1]
+
+        # Phase 1: fast approach to just short of home
+        target = [-sign[mi] * math.floor(HOME_APPROACH_MARGIN * CNT_PER_CM[mi])
+                  for mi in range(len(motors))]
+        self.movement_direction = [
+            target[mi] >= self.position_cnt[mi] for mi in range(len(motors))
+        ] + [0]
+        # Since the position is known, so is the X limit (if it is active)
+        self.current_limits[0] = -1 if self.position_cnt[0] <= target[0] else 0
+        self.configure_limits()
+
+        for mi, m in enumerate(motors):
+            self.send_command("SP{}={}".format(m.value, self.speed[mi]))
+            self.send_command("PA{}={}".format(m.value, target[mi]))
+            self.send_command("BG{}".format(m.value))
+
+        if not self.dummy:
+            self.g.GMotionComplete("".join([m.value for m in motors]))
+
+        # Phase 2: slow final approach to the limits, for repeatability
+        self.set_speed(HOME_SLOW_SPEED)
+        self.movement_direction = HOMING_DIRECTION[:]
+        self.current_limits[0] = 0
+        self.configure_limits()
+
+        for mi, m in enumerate(motors):
+            search = math.floor(
+                (HOME_APPROACH_MARGIN + HOME_SEARCH_DISTANCE) * CNT_PER_CM[mi]
+            )
+            self.send_command("SP{}={}".format(m.value, self.speed[mi]))
+            self.send_command("PR{}={}".format(m.value, sign[mi] * search))
+            self.send_command("BG{}".format(m.value))
+
+        if self.dummy:
+            self.stop_code = HOMING_STOP_CODE[:]
+
+    def _finish_homing(self):
+        """Checks the stop codes at the end of homing and sets the origin.
+
+        Returns False if a fast re-home did not find the limits, in which case
+        the full homing sequence is requested. The speed from before homing is
+        restored either way (also if the stop codes are unexpected).
+        """
+        try:
+            return self._check_homing()
+        finally:
+            self._restore_homing_speed()
+
+    def _restore_homing_speed(self):
+        """Restores the speed that was set before homing started."""
+        if self.speed_before_homing is not None:
+            self.speed = self.speed_before_homing
+            self.speed_before_homing = None
+
+    def _check_homing(self):
+        """Checks the stop codes at the end of homing and sets the origin (see
+        _finish_homing)."""
+        self.status = Status.STOP
+        for mi, m in enumerate([Motor.X, Motor.Y1]):
+            if self.stop_code[mi] == HOMING_STOP_CODE[mi]:
+                self.current_limits[mi] = 1 if HOMING_DIRECTION[mi] else -1
+            elif self.fast_homing:
+                util.dprint("Home not found near stored position")
+                self.fast_homing = False
+                self.home_valid = False
+                self.request_queue.put(DMCRequest(Status.HOMING).home_params(True))
+                return False
+            else:
+                raise Exception("Unexpected stop code during homing")
+
+        if len(self.errors) == 0:
+            # Set this point as the origin
+            time.sleep(RETRY_SLEEP)
+            if self.fast_homing and self.position_cnt is not None:
+                self.home_offset = self.position_cnt[:]
+                util.dprint("Home found at offset {}".format(self.home_offset))
+            for mi, m in enumerate(AXES_MOTORS):
+                self.send_command("DP{}=0".format(m.value))
+            self.position_cnt = [0 for m in AXES_MOTORS]
+            self.lash_direction = [1 if d else -1 for d in HOMING_DIRECTION]
+            self.home_valid = True
+            self.save_home_geometry()
+        self.fast_homing = False
+        return True
+
+    def _calibrate_backlash(self):
+        """Measures the backlash of the X and Y axes with the homing limit
+        switches.
+
+        Each axis is stepped towards its limit switch until the switch is
+        triggered, and then stepped away until it is released. The motion lost
+        in between, less the switch hysteresis, is the backlash. This is
+        averaged over BACKLASH_REPEATS measurements and stored.
+
+        This is blocking!
+        """
+        if self.dummy:
+            return
+
+        self.set_speed(HOME_SLOW_SPEED)
+        for mi, m in enumerate([Motor.X, Motor.Y1]):
+            sign = 1 if HOMING_DIRECTION[mi] else -1
+            start = -sign * math.floor(HOME_APPROACH_MARGIN * CNT_PER_CM[mi])
+            samples = []
+
+            for i in range(BACKLASH_REPEATS):
+                # Start away from the limit, with backlash taken up away from it
+                self._step_axis(mi, start - self._read_count(mi))
+                triggered = self._step_until_limit(mi, sign, True)
+                released = self._step_until_limit(mi, -sign, False)
+                if triggered is None or released is None:
+                    raise Exception("Limit switch not found calibrating backlash")
+                samples.append(
+                    abs(released - triggered)
+                    - LIMIT_HYSTERESIS_CM[mi] * CNT_PER_CM[mi]
+                )
+
+            self.backlash_cnt[mi] = max(0, round(sum(samples) / len(samples)))
+            util.dprint(
+                "Backlash of axis {} is {} counts".format(mi, self.backlash_cnt[mi])
+            )
+            # The last movement was away from the limit
+            self.lash_direction[mi] = -sign
+
+        self.save_backlash()
+        self.set_speed(MIN_SPEED)
+
+    def _read_count(self, mi):
+        """Reads the position of axis mi in counts. This is blocking!"""
+        m = AXES_MOTORS[mi]
+        return math.floor(float(self.send_command("MG_TD{}".format(m.value))))
+
+    def _limit_active(self, mi):
+        """Checks if the homing limit switch of axis mi is active. This is
+        blocking!"""
+        m = AXES_MOTORS[mi]
+        cmd = "MG_{}{}".format(HOMING_LIMIT_INPUT[mi], m.value)
+        return float(self.send_command(cmd)) == 0
+
+    def _step_axis(self, mi, cnt):
+        """Moves axis mi by cnt counts and waits until it stops. This is
+        blocking!"""
+        if cnt == 0:
+            return
+        m = AXES_MOTORS[mi]
+        sign = 1 if HOMING_DIRECTION[mi] else -1
+        self.movement_direction = [0, 0, 0]
+        self.movement_direction[mi] = cnt > 0
+        self.current_limits[mi] = sign if self._limit_active(mi) else 0
+        self.configure_limits()
+        self.send_command("SP{}={}".format(m.value, self.speed[mi]))
+        self.send_command("PR{}={}".format(m.value, cnt))
+        self.send_command("BG{}".format(m.value))
+        self.g.GMotionComplete(m.value)
+
+    def _step_until_limit(self, mi, direction, active):
+        """Steps axis mi in direction (+1 or -1) until its homing limit
+        switch becomes active (or inactive if active is False).
+
+        Returns the position in counts where the switch changed, or None if it
+        did not change within BACKLASH_SEARCH. This is blocking!
+        """
+        steps = math.ceil(BACKLASH_SEARCH * CNT_PER_CM[mi] / BACKLASH_STEP)
+        for i in range(steps):
+            if self._limit_active(mi) == active:
+                return self._read_count(mi)
+            self._step_axis(mi, direction * BACKLASH_STEP)
+        return None
+
     def background_task(self):
         """Task that runs on another thread and takes care of requests."""
         util.dprint("Started DMC task {}".format(threading.current_thread()))
@@ -776,6 +1262,11 @@ class DMC(object):
                     self.update_stop_code()
                     self.update_limits()
 
+                    position = self.get_position()
+                    if position != self.published_position:
+                        self.published_position = position
+                        self.publish(Event.DMC_POSITION, position)
+
                 # If moving (jogging, homing, etc.) check if limit has been reached or movement stopped otherwise
                 if (
                     self.status == Status.JOGGING
@@ -805,37 +1296,30 @@ class DMC(object):
                     if not any(
                         [s is StopCode.RUNNING_INDEPENDENT for s in self.stop_code]
                     ):
-                        self.status = Status.STOP
-                        for mi, m in enumerate([Motor.X, Motor.Y1]):
-                            if self.stop_code[mi] == HOMING_STOP_CODE[mi]:
-                                self.current_limits[mi] = (
-                                    1 if HOMING_DIRECTION[mi] else -1
-                                )
-                            else:
-                                raise Exception("Unexpected stop code during homing")
-                        if len(self.errors) == 0:
-                            # Set this point as the origin
-                            time.sleep(RETRY_SLEEP)
-                            for mi, m in enumerate(AXES_MOTORS):
-                                self.send_command("DP{}=0".format(m.value))
+                        self._finish_homing()
                         self.block = False
 
                 if self.status != Status.DISCONNECTED:
                     self.update_errors()
                     if len(self.errors) > 0:
+                        self._restore_homing_speed()
                         self._disconnect()
                         self.status = Status.DISCONNECTED
 
-            except gclib.GclibError as e:
+            except GclibError as e:
                 msg = traceback.format_exc()
-                self.errors[ErrorType.GCLIB] = msg
                 util.dprint(msg)
+                if not self._recover():
+                    self.errors[ErrorType.GCLIB] = msg
             except Exception as e:
                 msg = traceback.format_exc()
                 self.errors[ErrorType.OTHER] = msg
                 util.dprint(msg)
                 self.status = Status.ERROR
 
+            if len(self.errors) > 0:
+                self.publish(Event.DMC_ERROR)
+
             # Run the loop forever, unless it is no longer referenced
             # (via self.task) or the DMC becomes not configured
             if (
@@ -884,6 +1368,8 @@ class DMC(object):
 
     def connect(self, ip_address=DEFAULT_IP):
         """Connects to DMC using either serial (com port) or IP."""
+        if not self.dummy:
+            load_gclib()
         self.request_queue.put(
             DMCRequest(Status.MOTORS_DISABLED).connect_params(ip_address), False
         )  # False makes it not blocking
@@ -895,6 +1381,7 @@ class DMC(object):
         """Private method that handles disconnecting.
 
         This should not be called outside the DMC class."""
+        self.save_home_geometry()
         self.disable_motors()
         if self.g is not None:
             # self.send_command('DH1') # Enable DHCP
@@ -919,13 +1406,26 @@ class DMC(object):
             DMCRequest(Status.JOGGING).jog_params(axis, forward), False
         )  # False makes it not blocking
 
-    def home(self):
+    def home(self, full=False):
         """Request starting calibration/homing sequence.
 
+        If the position registers are still referenced to home (e.g. after
+        reconnecting), a fast re-home is done unless full is True.
+
         Typical usage example:
             d.home()
         """
-        self.request_queue.put(DMCRequest(Status.HOMING), False)
+        self.request_queue.put(DMCRequest(Status.HOMING).home_params(full), False)
+
+    def calibrate_backlash(self):
+        """Request measuring the backlash of the axes.
+
+        Must begin from stopped position after homing, or nothing happens.
+
+        Typical usage example:
+            d.calibrate_backlash()
+        """
+        self.request_queue.put(DMCRequest(Status.CALIBRATING), False)
 
     def stop(self):
         """Request stopping motion.
@@ -962,6 +1462,8 @@ class DMC(object):
         )  # False makes it not blocking
         sleep = 0
         while self.block:
+            if self.status == Status.DISCONNECTED:
+                return False  # The connection was lost and not recovered
             time.sleep(RETRY_SLEEP)
             sleep += 0.1
             if sleep > wait:
@@ -15,6 +15,12 @@ Some main dependencies of the code:
 Written by Ville Tiukuvaara
 """
 
+import time
+
+START_TIME = time.perf_counter()  # When the GUI was launched
+STARTUP_TARGET = 1.0  # Start up should take less than this many seconds
+
+import argparse
 import tkinter as tk
 from tkinter import ttk
 from enum import Enum
@@ -24,8 +30,10 @@ from DMC import *
 from motiontab import MotionTab
 from vnatab import VNATab
 from measuretab import MeasureTab
-import time
 import vna
+from events import EventBus
+from scan import ScanEngine
+from remote import RemoteInstruments
 
 
 class NearFieldGUI:
@@ -35,12 +43,16 @@ class NearFieldGUI:
     win.mainloop() starts the GUI and will not return until the user chooses
     to exit (exit click x button).
 
+    By default, the instruments and the scan run in a separate process (see
+    remote.py), which keeps running a scan if the GUI exits. With local=True,
+    they run in the same process as the GUI.
+
     Typical usage example:
         n = NearFieldGUI()
         n.win.mainloop()
     """
 
-    def __init__(self, parent=None):
+    def __init__(self, parent=None, local=False):
         """Construct GUI - this does not actually start it."""
         self.gui_ready = False
         self.win = tk.Tk()
@@ -48,18 +60,39 @@ class NearFieldGUI:
         self.win.protocol("WM_DELETE_WINDOW", self.clean_up)
         self.win.title("Near-Field Measurement System")
         self.win.resizable(False, False)
-        self.dmc = DMC(False)
-        self.vna = vna.VNA(False)
+        # Changes in the instruments and scan are delivered to the tabs
+        self.events = EventBus()
+        if local:
+            self.remote = None
+            self.dmc = DMC(False, events=self.events)
+            self.vna = vna.VNA(False)
+            self.engine = ScanEngine(self.dmc, self.vna, events=self.events)
+        else:
+            self.remote = RemoteInstruments(self.events)
+            self.dmc = self.remote.dmc
+            self.vna = self.remote.vna
+            self.engine = self.remote.engine
         self.make_widgets()
+        self.events.start(self.win)
         self.gui_ready = True
+        self.win.after_idle(self.report_startup)
+
+    def report_startup(self):
+        """Reports how long it took from launching until the window was
+        ready to use."""
+        elapsed = time.perf_counter() - START_TIME
+        msg = "Started up in {:.2f} s".format(elapsed)
+        if elapsed > STARTUP_TARGET:
+            msg += " (more than the target of {:.1f} s)".format(STARTUP_TARGET)
+        util.dprint(msg)
 
     def make_widgets(self):
         """Add widgets to the GUI."""
         self.tabs = ttk.Notebook(self.win)
-        self.motion_tab = MotionTab(self.tabs, self.dmc)
+        self.motion_tab = MotionTab(self.tabs, self.dmc, self.events)
         self.vna_tab = VNATab(self.tabs, self.vna, self)
         self.measure_tab = MeasureTab(
-            self.tabs, self.dmc, self.vna, self.motion_tab, self.vna_tab, self
+            self.tabs, self.dmc, self.vna, self.engine, self.motion_tab, self.vna_tab, self
         )
         self.tabs.add(self.motion_tab, text="Spatial Configuration")
         self.tabs.add(self.vna_tab, text="VNA Configuration")
@@ -70,9 +103,12 @@ class NearFieldGUI:
         """Closes resources."""
         util.dprint("Cleaning up after GUI")
         self.win.config(cursor="wait")
+        self.events.stop()
         self.measure_tab.clean_up()
         self.motion_tab.clean_up()
         self.dmc.clean_up()
+        if self.remote is not None:
+            self.remote.close()
         self.win.destroy()
 
     def enable_tabs(self, enabled=True):
@@ -82,6 +118,11 @@ class NearFieldGUI:
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Near-field measurement system GUI.")
+    parser.add_argument(
+        "--local", action="store_true", help="run the instruments in the GUI process"
+    )
+    args = parser.parse_args()
     util.debug_messages = True  # Show debugging info on console
-    n = NearFieldGUI()
+    n = NearFieldGUI(local=args.local)
     n.win.mainloop()  # Start up GUI
@@ -0,0 +1,143 @@
+"""Columnar (Apache Parquet) output of a scan, streamed while the scan runs.
+
+Each measured value is a row of (x, y, z, sparam, freq, re, im). The points of
+one scan line (along X, at the same Y and Z) are written together as a row
+group, so readers such as pandas or Polars can use the row group statistics to
+read a single plane or line without scanning the whole file, e.g.:
+
+    pd.read_parquet('scan.parquet', filters=[('z', '==', 0.0)])
+
+The coordinate and S-parameter columns repeat for every frequency, so they are
+dictionary encoded. pyarrow is optional; it is only needed to write a Parquet
+file, and it is imported when it is first needed.
+"""
+
+import numpy as np
+
+from store import to_complex
+
+pa = None  # pyarrow, imported by available()
+pq = None
+
+EXTENSION = ".parquet"  # File extension for columnar scan files
+COMPRESSION = "zstd"
+DICTIONARY_COLUMNS = ["x", "y", "z", "sparam"]  # Columns with dictionary encoding
+
+
+def available():
+    """Returns True if Parquet files can be written (pyarrow is installed)."""
+    global pa, pq
+    if pa is None:
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            return False
+        pa, pq = pyarrow, pyarrow.parquet
+    return True
+
+
+def schema():
+    """Returns the Arrow schema of a scan table."""
+    return pa.schema(
+        [
+            ("x", pa.float64()),
+            ("y", pa.float64()),
+            ("z", pa.float64()),
+            ("sparam", pa.dictionary(pa.int8(), pa.string())),
+            ("freq", pa.float64()),
+            ("re", pa.float32()),
+            ("im", pa.float32()),
+        ]
+    )
+
+
+class ScanTable:
+    """Streams the points of a scan into a Parquet file, one row group per
+    scan line.
+
+    Typical usage example:
+        t = ScanTable('scan.parquet', spatial_sweep)
+        t.append(n, p, meas_data)
+        t.close()
+    """
+
+    def __init__(self, filename, spatial_sweep):
+        """Creates a new Parquet file for a scan over spatial_sweep
+        (SpatialSweepParams). An existing file is overwritten."""
+        if not available():
+            raise ImportError("pyarrow is needed to write Parquet files")
+        self.filename = filename
+        self.line_points = spatial_sweep.get_shape()[0]
+        self.line = None  # Index of the scan line being collected
+        self.pending = []  # Columns of each point on the current scan line
+        self.sparams = []  # Dictionary of the sparam column
+        self.writer = pq.ParquetWriter(
+            filename,
+            schema(),
+            compression=COMPRESSION,
+            use_dictionary=DICTIONARY_COLUMNS,
+        )
+
+    def append(self, n, coord, meas):
+        """Adds the nth point at coord (in cm), with a list of MeasData.
+
+        The row group is written once the scan line is complete (or when a
+        point on another line is added).
+        """
+        line = n // self.line_points
+        if line != self.line:
+            self.flush()
+            self.line = line
+
+        columns = []
+        for m in meas:
+            sp = m.sweep_params.sparams[0].value
+            if sp not in self.sparams:
+                self.sparams.append(sp)
+            values = to_complex(m.mag, m.phase)
+            columns.append(
+                (
+                    coord,
+                    self.sparams.index(sp),
+                    np.asarray(m.freq, dtype=np.float64),
+                    values.real.astype(np.float32),
+                    values.imag.astype(np.float32),
+                )
+            )
+        self.pending.extend(columns)
+
+        if (n + 1) % self.line_points == 0:
+            self.flush()
+
+    def flush(self):
+        """Writes the points collected so far as a row group."""
+        if len(self.pending) == 0:
+            return
+
+        lengths = [len(c[2]) for c in self.pending]
+        coord = [np.repeat([c[0][i] for c in self.pending], lengths) for i in range(3)]
+        sparam = np.repeat([c[1] for c in self.pending], lengths).astype(np.int8)
+        table = pa.Table.from_arrays(
+            [
+                pa.array(coord[0]),
+                pa.array(coord[1]),
+                pa.array(coord[2]),
+                pa.DictionaryArray.from_arrays(
+                    pa.array(sparam), pa.array(self.sparams, pa.string())
+                ),
+                pa.array(np.concatenate([c[2] for c in self.pending])),
+                pa.array(np.concatenate([c[3] for c in self.pending])),
+                pa.array(np.concatenate([c[4] for c in self.pending])),
+            ],
+            schema=schema(),
+        )
+        self.writer.write_table(table, row_group_size=len(table))
+        self.pending = []
+
+    def close(self):
+        """Writes any remaining points and closes the file."""
+        if self.writer is not None:
+            self.flush()
+            self.writer.close()
+            self.writer = None
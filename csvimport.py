@@ -0,0 +1,183 @@
+"""Importing scans from the CSV files exported by older versions of the GUI.
+
+The CSV files have a row for every frequency of every S-parameter of every
+point (X, Y, Z, S-parameter, Frequency, Magnitude, Phase; see export.py). They
+are imported into a scan store (see store.py), so they can be queried with the
+same tools as new scans.
+
+The file is read in large chunks, and each chunk is parsed with a single NumPy
+call, without building any Python objects per row or per point. It is read
+twice: first to find the grid and the frequency axis, then to fill the data
+cube. The data cube can then be packed, e.g.:
+
+    python csvimport.py scan.csv scan.nfs --compress zstd
+"""
+
+import argparse
+import os
+import shutil
+
+import numpy as np
+
+import DMC as dmc
+import vna
+import store
+from store import ScanCube, to_complex
+
+CHUNK_BYTES = 1 << 26  # Size of the chunks the file is read in
+COLUMNS = 7  # X, Y, Z, S-parameter, Frequency, Magnitude, Phase
+GRID_TOLERANCE = 1e-6  # Largest distance in cm from a regular grid
+# S-parameters are parsed as numbers (e.g. "S21" as 21)
+SPARAM_CODES = {int(sp.value[1:]): sp for sp in vna.SParam}
+
+
+def read_chunks(filename, cancel=None):
+    """Reads a CSV file exported by export.write_csv in chunks.
+
+    Yields a numpy array with a row for each row of the file and the columns
+    X, Y, Z, S-parameter (as a number, e.g. 21), Frequency, Magnitude, Phase,
+    and the fraction of the file that has been read.
+    """
+    size = os.path.getsize(filename)
+    with open(filename, "rb") as f:
+        header = f.readline()
+        if not header.startswith(b"X,Y,Z"):
+            raise ValueError("Not a CSV file exported from a scan")
+
+        tail = b""
+        while True:
+            if cancel is not None and cancel():
+                return
+            block = f.read(CHUNK_BYTES)
+            text = tail + block
+            if len(block) > 0:
+                # Keep the last (partial) line for the next chunk
+                end = text.rfind(b"\n") + 1
+                text, tail = text[:end], text[end:]
+            if len(text.strip()) > 0:
+                # One row per line, and the S-parameter as a number
+                text = text.replace(b"\r\n", b",").replace(b"\n", b",")
+                text = text.replace(b",S", b",")
+                values = np.fromstring(text.decode(), dtype=np.float64, sep=",")
+                if len(values) % COLUMNS != 0:
+                    raise ValueError("Unexpected number of columns in CSV file")
+                yield values.reshape(-1, COLUMNS), f.tell() / size
+            if len(block) == 0:
+                return
+
+
+def regular_axis(values, name):
+    """Returns (start, stop, points) of a regular grid axis through the
+    (unique, sorted) values.
+
+    Raises ValueError if the values are not on a regular grid.
+    """
+    axis = [float(values[0]), float(values[-1]), len(values)]
+    if not np.allclose(np.linspace(*axis), values, rtol=0, atol=GRID_TOLERANCE):
+        raise ValueError("The {} coordinates are not on a regular grid".format(name))
+    return axis
+
+
+def grid_index(values, axis):
+    """Returns the index of each of the values on a regular axis (start,
+    stop, points)."""
+    start, stop, points = axis
+    if points == 1:
+        return np.zeros(len(values), dtype=np.intp)
+    step = (stop - start) / (points - 1)
+    return np.rint((values - start) / step).astype(np.intp)
+
+
+def scan_csv(filename, progress=None, cancel=None):
+    """Reads a CSV file to find the grid and frequency axis of the scan.
+
+    Returns the SpatialSweepParams, FreqSweepParams and frequency axis, or
+    None if cancelled.
+    """
+    coords = [np.empty(0)] * 3
+    freq = np.empty(0)
+    codes = np.empty(0)
+    for rows, fraction in read_chunks(filename, cancel):
+        coords = [np.union1d(c, rows[:, i]) for i, c in enumerate(coords)]
+        freq = np.union1d(freq, rows[:, 4])
+        codes = np.union1d(codes, rows[:, 3])
+        if progress is not None:
+            progress(fraction)
+    if cancel is not None and cancel():
+        return None
+    if len(freq) == 0:
+        raise ValueError("No data in CSV file")
+
+    spatial_sweep = dmc.SpatialSweepParams(
+        [regular_axis(c, name) for c, name in zip(coords, ["X", "Y", "Z"])]
+    )
+    sparams = [SPARAM_CODES[int(c)] for c in codes]
+    # The power and averaging are not in the file, so the defaults are used
+    freq_sweep = vna.FreqSweepParams(
+        freq[0], freq[-1], len(freq), vna.POWER_MIN, vna.AVERAGING_MIN, sparams
+    )
+    return spatial_sweep, freq_sweep, freq
+
+
+def import_csv(filename, path, progress=None, cancel=None):
+    """Imports a CSV file exported by export.write_csv into a new scan store.
+    This is blocking!
+
+    Args:
+        filename (str): CSV file to import
+        path (str): directory of the new store
+        progress (callable): called with the fraction (0 to 1) that is done
+        cancel (callable): returns True if the import should be cancelled
+
+    Returns the ScanCube (opened for writing), or None if cancelled (in which
+    case the partial store is removed).
+    """
+    first_half = None if progress is None else lambda f: progress(f / 2)
+    scanned = scan_csv(filename, first_half, cancel)
+    if scanned is None:
+        return None
+    spatial_sweep, freq_sweep, freq = scanned
+
+    cube = ScanCube.create(path, spatial_sweep, freq_sweep, freq)
+    codes = np.zeros(max(SPARAM_CODES) + 1, dtype=np.intp)
+    for sp in freq_sweep.sparams:
+        codes[int(sp.value[1:])] = cube.sparam_index(sp)
+
+    for rows, fraction in read_chunks(filename, cancel):
+        ix, iy, iz = [grid_index(rows[:, i], spatial_sweep.params[i]) for i in range(3)]
+        isp = codes[rows[:, 3].astype(np.intp)]
+        ifreq = np.searchsorted(freq, rows[:, 4])
+        cube.set_values(iz, iy, ix, isp, ifreq, to_complex(rows[:, 5], rows[:, 6]))
+        if progress is not None:
+            progress(0.5 + fraction / 2)
+
+    if cancel is not None and cancel():
+        cube.close()
+        shutil.rmtree(path)
+        return None
+    cube.flush()
+    return cube
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Import a CSV scan into a scan store.")
+    parser.add_argument("csv", help="CSV file exported from a scan")
+    parser.add_argument("store", nargs="?", help="directory of the new store")
+    parser.add_argument(
+        "--compress", choices=store.COMPRESSORS, help="pack the store after importing"
+    )
+    args = parser.parse_args()
+
+    path = args.store
+    if path is None:
+        path = os.path.splitext(args.csv)[0] + store.EXTENSION
+    cube = import_csv(args.csv, path)
+    print("Imported {} points into {}".format(int(np.sum(cube.filled)), path))
+    if args.compress is not None:
+        print("Packed to {:.1%} of its size".format(cube.pack(args.compress)))
+    cube.close()
+
+
+if __name__ == "__main__":
+    main()
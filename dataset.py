@@ -0,0 +1,218 @@
+"""Lazy queries of the data of a stored scan.
+
+A ScanDataset opens the data cube of a scan store (see store.py) and selects
+parts of it by coordinate, frequency and S-parameter, e.g.:
+
+    scan = ScanDataset('scan.nfs')
+    s21 = scan.plane(z=0).freq(25e9).sparam('S21').values  # 2D array [y, x]
+    line = scan.line(y=10, z=0).sparam('S21').values  # 2D array [x, freq]
+
+Selections are only read when their values are used. The cube is memory
+mapped (or split into compressed chunks, if the store is packed), so only the
+parts of it that are selected are read from disk, and the values of the most
+recently used selections are kept in an LRU cache.
+
+A scan that is still running can be followed from another process, without
+copying its points, by polling for new points:
+
+    scan = ScanDataset('scan.nfs')
+    for ix, iy, iz in scan.poll():
+        ...
+"""
+
+from collections import OrderedDict
+
+import numpy as np
+
+import vna
+from store import ScanCube, to_mag_phase
+
+CACHE_SIZE = 32  # Number of selections to keep in the cache
+DIMS = ["z", "y", "x", "sparam", "freq"]  # Dimensions of the data cube
+
+
+class ScanDataset:
+    """A stored scan that can be queried without reading all of it.
+
+    Typical usage example:
+        scan = ScanDataset('scan.nfs')
+        s21 = scan.plane(z=0).freq(25e9).sparam('S21').values
+    """
+
+    def __init__(self, path, cache_size=CACHE_SIZE):
+        """Opens the scan store at path (read only)."""
+        self.cube = ScanCube(path, "r")
+        self.cache_size = cache_size
+        self.cache = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.polled = 0  # Number of measured points returned by poll
+        self.sequence = None  # Sequence of the store when last polled
+
+    @property
+    def axes(self):
+        """Dict with a numpy array of the coordinates along x, y, and z."""
+        return dict(zip(["x", "y", "z"], self.cube.axes))
+
+    @property
+    def freq(self):
+        """Frequency axis in Hz."""
+        return self.cube.freq
+
+    @property
+    def sparams(self):
+        """List of the S-parameters (SParam) in the scan."""
+        return self.cube.sparams
+
+    def select(self, **coords):
+        """Returns a Selection of the points at the given coordinates in cm
+        (any of x, y, and z). The nearest point along each axis is used."""
+        return Selection(self, {}).at(**coords)
+
+    def plane(self, **coord):
+        """Returns a Selection of the plane at one coordinate, e.g. z=0."""
+        assert len(coord) == 1
+        return self.select(**coord)
+
+    def line(self, **coords):
+        """Returns a Selection of the line at two coordinates, e.g. y=1, z=0."""
+        assert len(coords) == 2
+        return self.select(**coords)
+
+    def point(self, x, y, z):
+        """Returns a Selection of a single point."""
+        return self.select(x=x, y=y, z=z)
+
+    def read(self, index):
+        """Returns the values of the cube at index (a tuple of ints and
+        slices, one for each of DIMS), using the cache if possible."""
+        key = tuple((i.start, i.stop) if isinstance(i, slice) else i for i in index)
+        if key in self.cache:
+            self.hits += 1
+            self.cache.move_to_end(key)
+            return self.cache[key]
+
+        self.misses += 1
+        values = np.array(self.cube.read_consistent(index))
+        values.flags.writeable = False  # Shared by everyone using the cache
+        self.cache[key] = values
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last=False)
+        return values
+
+    def poll(self):
+        """Returns the grid indices [ix, iy, iz] (an array of rows) of the
+        points measured since the last poll, while the scan is still being
+        written. The cache is cleared if anything changed."""
+        progress = self.cube.progress()
+        if progress is None or progress[0] == self.sequence:
+            return np.empty((0, 3), dtype=np.intp)
+        self.sequence = progress[0]
+        self.clear_cache()
+        points = self.cube.new_points(self.polled)
+        self.polled += len(points)
+        return points
+
+    def clear_cache(self):
+        """Empties the cache (e.g. if the scan is still being written)."""
+        self.cache.clear()
+
+    def close(self):
+        """Closes the store."""
+        self.clear_cache()
+        self.cube.close()
+
+
+class Selection:
+    """A selection of part of a ScanDataset.
+
+    Each method narrows down the selection and returns a new Selection. Nothing
+    is read until the values are used. The dimensions that have not been
+    selected remain, in the order z, y, x, sparam, freq.
+    """
+
+    def __init__(self, dataset, index):
+        """Init with a dict of the index (int or slice) along each dimension
+        that has been selected."""
+        self.dataset = dataset
+        self.index = index
+
+    def _with(self, **index):
+        """Returns a new Selection with the given indices added."""
+        new_index = dict(self.index)
+        new_index.update(index)
+        return Selection(self.dataset, new_index)
+
+    @staticmethod
+    def nearest(axis, value, name):
+        """Returns the index of the nearest value along axis.
+
+        Raises ValueError if value is outside of the axis.
+        """
+        axis = np.asarray(axis)
+        i = int(np.argmin(np.abs(axis - value)))
+        step = np.min(np.abs(np.diff(axis))) if len(axis) > 1 else 0
+        if abs(axis[i] - value) > step / 2 + 1e-9:
+            raise ValueError("{} = {} is not in the scan".format(name, value))
+        return i
+
+    def at(self, **coords):
+        """Selects the nearest points at the given coordinates in cm."""
+        axes = self.dataset.axes
+        index = {}
+        for k, v in coords.items():
+            index[k] = Selection.nearest(axes[k], v, k)
+        return self._with(**index)
+
+    def freq(self, start, stop=None):
+        """Selects the frequency (in Hz) nearest to start, or the range of
+        frequencies from start to stop (inclusive)."""
+        freq = np.asarray(self.dataset.freq)
+        if stop is None:
+            return self._with(freq=Selection.nearest(freq, start, "freq"))
+        i = int(np.searchsorted(freq, start, side="left"))
+        j = int(np.searchsorted(freq, stop, side="right"))
+        return self._with(freq=slice(i, j))
+
+    def sparam(self, sparam):
+        """Selects an S-parameter (SParam or a string like 'S21')."""
+        return self._with(sparam=self.dataset.cube.sparam_index(vna.SParam(sparam)))
+
+    def _cube_index(self):
+        """Returns the index into the data cube."""
+        return tuple(self.index.get(d, slice(None)) for d in DIMS)
+
+    @property
+    def dims(self):
+        """Names of the dimensions of the values."""
+        return [d for d in DIMS if not isinstance(self.index.get(d, slice(None)), int)]
+
+    @property
+    def coords(self):
+        """Dict with the coordinates along each dimension of the values."""
+        axes = dict(self.dataset.axes)
+        axes["sparam"] = np.array([sp.value for sp in self.dataset.sparams])
+        axes["freq"] = np.asarray(self.dataset.freq)
+        return {d: axes[d][self.index.get(d, slice(None))] for d in self.dims}
+
+    def view(self):
+        """Returns a read only view of the memory mapped cube. Nothing is read
+        from disk until the view is used, and it is not cached. The values are
+        as stored, i.e. int16 I/Q for stores with the int16 encoding, and
+        packed stores are read (not viewed)."""
+        return self.dataset.cube.data[self._cube_index()]
+
+    @property
+    def values(self):
+        """Complex values of the selection (read only, cached)."""
+        return self.dataset.read(self._cube_index())
+
+    @property
+    def filled(self):
+        """Bool array of which points of the selection have been measured."""
+        index = self._cube_index()[:3]
+        return np.asarray(self.dataset.cube.filled[index])
+
+    def mag_phase(self):
+        """Returns the magnitude in dB and phase in degrees of the values."""
+        return to_mag_phase(self.values)
@@ -0,0 +1,100 @@
+"""Thread-safe events from the instruments and the scan to the GUI.
+
+The DMC, the scan engine and other background threads publish events when
+something changes (e.g. the DMC status, or a new point was measured), and the
+GUI subscribes to the events it needs. Publishing never blocks or touches Tk,
+so it is safe from any thread. The events are delivered on the Tk thread by a
+single pump, which only calls the subscribers when something has happened:
+
+    bus = EventBus()
+    bus.subscribe(Event.DMC_STATUS, lambda status: print(status))
+    bus.start(root)
+
+Bursts of the same event are coalesced, so the subscribers are called once per
+pump with the latest payload, however many times the event was published.
+Publishing from another thread cannot wake up Tk directly (a call into Tk from
+another thread waits for the Tk thread, which can deadlock when the Tk thread
+is waiting for that thread), so the pump checks for events every
+PUMP_INTERVAL ms, which costs next to nothing when there are none.
+"""
+
+import threading
+import traceback
+from enum import Enum
+
+import util
+
+PUMP_INTERVAL = 20  # How often the Tk thread checks for events in ms
+
+
+class Event(Enum):
+    """Things that can happen, and the payload of each."""
+
+    DMC_STATUS = 0  # The DMC status changed (Status)
+    DMC_POSITION = 1  # The DMC position changed (list in cm, or None)
+    DMC_ERROR = 2  # The DMC has errors (None)
+    VNA_STATUS = 3  # The VNA connected or disconnected (bool)
+    VNA_MEASUREMENT = 4  # A sample measurement is done (list of MeasData)
+    SCAN_UPDATE = 5  # The scan status changed or a point was measured (n)
+    EXPORT_PROGRESS = 6  # An export progressed or is done (fraction)
+
+
+class EventBus:
+    """Publishes events from any thread to subscribers on the Tk thread.
+
+    Typical usage example:
+        bus = EventBus()
+        bus.subscribe(Event.SCAN_UPDATE, tab.update_widgets)
+        bus.start(root)
+
+        bus.publish(Event.SCAN_UPDATE, n)  # From any thread
+    """
+
+    def __init__(self):
+        """Init with no subscribers or events."""
+        self.lock = threading.Lock()
+        self.pending = {}  # Latest payload of each event since the last pump
+        self.subscribers = {}  # List of callbacks for each event
+        self.widget = None
+
+    def publish(self, event, payload=None):
+        """Publishes an event (Event). This can be called from any thread."""
+        assert isinstance(event, Event)
+        with self.lock:
+            self.pending.pop(event, None)  # Keep the events in order
+            self.pending[event] = payload
+
+    def subscribe(self, event, callback):
+        """Calls callback(payload) on the Tk thread when event is published."""
+        self.subscribers.setdefault(event, []).append(callback)
+
+    def drain(self):
+        """Calls the subscribers of the events published since the last call.
+
+        Returns the number of events.
+        """
+        with self.lock:
+            pending, self.pending = self.pending, {}
+        for event, payload in pending.items():
+            for callback in self.subscribers.get(event, []):
+                try:
+                    callback(payload)
+                except Exception:
+                    util.dprint(traceback.format_exc())
+        return len(pending)
+
+    def start(self, widget):
+        """Starts delivering events on the Tk thread of widget."""
+        self.widget = widget
+        self.widget.after(PUMP_INTERVAL, self._pump)
+
+    def stop(self):
+        """Stops delivering events."""
+        self.widget = None
+
+    def _pump(self):
+        """Delivers the pending events, and runs again after PUMP_INTERVAL."""
+        if self.widget is None:
+            return
+        self.drain()
+        self.widget.after(PUMP_INTERVAL, self._pump)
@@ -0,0 +1,240 @@
+"""Exporting measured scan data to files.
+
+The data of a scan is a dict where the key is the coordinate (x, y, z) in cm
+and the value is a list of MeasData (one for each S-parameter).
+
+Exports are written in large chunks that are formatted with NumPy and a single
+string formatting operation per block of rows, rather than one call per value.
+They can report their progress and be cancelled, so they can run on a
+background thread while the GUI stays responsive.
+
+Scans can also be exported as one Touchstone file per point (.s1p or .s2p),
+either into a directory or into a single zip archive. The Touchstone files are
+formatted by a pool of processes.
+"""
+
+import os
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from enum import Enum
+
+import numpy as np
+
+import vna
+from store import to_complex
+
+# Header for CSV files
+CSV_HEADER = ["X", "Y", "Z", "S-parameter", "Frequency", "Magnitude", "Phase"]
+CSV_NEWLINE = "\r\n"  # Same line ending as the csv module
+POS_FORMAT = "{:.10f}"  # Formatting of coordinates
+VALUE_FORMAT = ",%.5E,%.5f,%.5f" + CSV_NEWLINE  # Frequency, magnitude, phase
+CHUNK_ROWS = 200000  # Number of rows to format before writing to the file
+BUFFER_SIZE = 1 << 20  # Size of file buffer in bytes
+
+
+def format_block(prefix, freq, mag, phase):
+    """Formats the CSV rows of a single frequency sweep.
+
+    Args:
+        prefix (str): the columns before the frequency (ending with a comma)
+        freq, mag, phase (numpy array): values for each row
+
+    Returns the rows as a string.
+    """
+    values = np.column_stack([freq, mag, phase]).ravel().tolist()
+    return ((prefix[:-1] + VALUE_FORMAT) * len(freq)) % tuple(values)
+
+
+def write_csv(data, filename, progress=None, cancel=None):
+    """Exports the measurement data to a CSV file. This is blocking!
+
+    Args:
+        data (dict): measured data with coordinates as keys
+        filename (str): name and path to file for saving
+        progress (callable): called with the fraction (0 to 1) that is done
+        cancel (callable): returns True if the export should be cancelled
+
+    Returns True if complete, or False if it was cancelled (in which case the
+    partial file is removed).
+    """
+    points = list(data.items())
+
+    with open(filename, mode="w", newline="", buffering=BUFFER_SIZE) as file:
+        if len(points) == 0:
+            return True  # No data to write out
+
+        file.write(",".join(CSV_HEADER) + CSV_NEWLINE)
+
+        chunk = []
+        rows = 0
+        for i, (pos, sp_sweep) in enumerate(points):
+            coord = ",".join([POS_FORMAT.format(p) for p in pos])
+
+            for sp_data in sp_sweep:
+                prefix = "{},{},".format(coord, sp_data.sweep_params.sparams[0].value)
+                chunk.append(
+                    format_block(prefix, sp_data.freq, sp_data.mag, sp_data.phase)
+                )
+                rows += len(sp_data.freq)
+
+            if rows >= CHUNK_ROWS:
+                file.write("".join(chunk))
+                chunk = []
+                rows = 0
+                if cancel is not None and cancel():
+                    break
+                if progress is not None:
+                    progress((i + 1) / len(points))
+        else:
+            file.write("".join(chunk))
+            if progress is not None:
+                progress(1)
+            return True
+
+    os.remove(filename)
+    return False
+
+
+class TouchstoneFormat(Enum):
+    """Format of the values in a Touchstone file."""
+
+    RI = "RI"  # Real and imaginary
+    DB = "DB"  # Magnitude in dB and phase in degrees
+    MA = "MA"  # Linear magnitude and phase in degrees
+
+
+# Order of the S-parameters in a 2-port Touchstone file
+TOUCHSTONE_ORDER = [vna.SParam.S11, vna.SParam.S21, vna.SParam.S12, vna.SParam.S22]
+TOUCHSTONE_VALUE_FORMAT = "%.9E"
+TOUCHSTONE_NAME = "x{:.3f}_y{:.3f}_z{:.3f}"  # Name of the file for each point
+TOUCHSTONE_CHUNK = 16  # Number of points sent to a process at a time
+
+
+def format_touchstone(coord, sweeps, fmt):
+    """Formats the measurement at a point as a Touchstone file.
+
+    If only S11 or only S22 was measured, it is a 1-port (.s1p) file.
+    Otherwise, it is a 2-port (.s2p) file, and any S-parameters that were not
+    measured are set to 0 (and listed in a comment).
+
+    Args:
+        coord (list): coordinate (x, y, z) of the point in cm
+        sweeps (list): (SParam, freq, mag, phase) for each S-parameter
+        fmt (TouchstoneFormat): format of the values
+
+    Returns the file extension and the contents of the file.
+    """
+    measured = {sp: (mag, phase) for sp, freq, mag, phase in sweeps}
+    freq = np.asarray(sweeps[0][1])
+
+    if len(measured) == 1 and sweeps[0][0] in [vna.SParam.S11, vna.SParam.S22]:
+        extension = ".s1p"
+        order = [sweeps[0][0]]
+    else:
+        extension = ".s2p"
+        order = TOUCHSTONE_ORDER
+
+    table = np.zeros((len(freq), 1 + 2 * len(order)))
+    table[:, 0] = freq
+    for i, sp in enumerate(order):
+        if sp not in measured:
+            continue
+        mag, phase = measured[sp]
+        if fmt == TouchstoneFormat.DB:
+            table[:, 1 + 2 * i] = mag
+            table[:, 2 + 2 * i] = phase
+        elif fmt == TouchstoneFormat.MA:
+            table[:, 1 + 2 * i] = 10 ** (np.asarray(mag) / 20)
+            table[:, 2 + 2 * i] = phase
+        else:
+            values = to_complex(mag, phase)
+            table[:, 1 + 2 * i] = values.real
+            table[:, 2 + 2 * i] = values.imag
+
+    header = ["! Near field scan point X={:.5f} Y={:.5f} Z={:.5f} cm".format(*coord)]
+    missing = [sp.value for sp in order if sp not in measured]
+    if len(missing) > 0:
+        header.append("! Not measured (set to 0): " + " ".join(missing))
+    header.append("! Parameters: " + " ".join([sp.value for sp in order]))
+    header.append("# HZ S {} R 50".format(fmt.value))
+
+    row = " ".join([TOUCHSTONE_VALUE_FORMAT] * table.shape[1]) + "\n"
+    body = (row * len(freq)) % tuple(table.ravel().tolist())
+    return extension, "\n".join(header) + "\n" + body
+
+
+def _touchstone_task(task):
+    """Formats a Touchstone file in a worker process.
+
+    Returns the name of the file and its contents.
+    """
+    coord, sweeps, fmt = task
+    extension, text = format_touchstone(coord, sweeps, fmt)
+    return TOUCHSTONE_NAME.format(*coord) + extension, text
+
+
+def write_touchstone(data, path, fmt=TouchstoneFormat.RI, progress=None,
+                     cancel=None, processes=None):
+    """Exports each point of the measurement data as a Touchstone file.
+
+    This is blocking!
+
+    Args:
+        data (dict): measured data with coordinates as keys
+        path (str): directory for the files, or a .zip archive to put them in
+        fmt (TouchstoneFormat): format of the values
+        progress (callable): called with the fraction (0 to 1) that is done
+        cancel (callable): returns True if the export should be cancelled
+        processes (int): number of processes formatting files (default is
+        the number of CPUs)
+
+    Returns True if complete, or False if it was cancelled (in which case the
+    files written so far are removed).
+    """
+    assert isinstance(fmt, TouchstoneFormat)
+    tasks = [
+        (
+            [float(p) for p in pos],
+            [(m.sweep_params.sparams[0], m.freq, m.mag, m.phase) for m in meas],
+            fmt,
+        )
+        for pos, meas in list(data.items())
+        if len(meas) > 0
+    ]
+
+    archive = path.lower().endswith(".zip")
+    if archive:
+        out = zipfile.ZipFile(path, "w", compression=zipfile.ZIP_DEFLATED)
+    else:
+        os.makedirs(path, exist_ok=True)
+    written = []
+    cancelled = False
+
+    pool = ProcessPoolExecutor(processes)
+    try:
+        results = pool.map(_touchstone_task, tasks, chunksize=TOUCHSTONE_CHUNK)
+        for i, (name, text) in enumerate(results):
+            if archive:
+                out.writestr(name, text)
+            else:
+                with open(os.path.join(path, name), "w", newline="") as file:
+                    file.write(text)
+                written.append(os.path.join(path, name))
+
+            if cancel is not None and cancel():
+                cancelled = True
+                break
+            if progress is not None:
+                progress((i + 1) / len(tasks))
+    finally:
+        pool.shutdown(wait=True, cancel_futures=True)
+        if archive:
+            out.close()
+
+    if cancelled:
+        if archive:
+            os.remove(path)
+        for name in written:
+            os.remove(name)
+        return False
+    return True
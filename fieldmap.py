@@ -0,0 +1,246 @@
+"""Live map of the measured field over a plane of the scan."""
+
+import tkinter as tk
+from tkinter import ttk
+
+import numpy as np
+
+import vna
+
+MAG_STEP = 10  # The magnitude colour scale grows in steps of this many dB
+PHASE_LIMITS = (-180, 180)  # Colour scale of the phase in degrees
+MAG_CMAP = "viridis"
+PHASE_CMAP = "twilight"
+FREQ_FORMAT = "{:.4f}"  # Formatting of frequencies in GHz
+POS_FORMAT = "{:.3f}"  # Formatting of Z coordinates in cm
+PADDING = 5  # Padding around widgets
+FIGURE_SIZE = (5, 4)  # Size of the figure in inches
+DPI = 100  # Resolution of the figure
+
+
+class FieldMapPlot(tk.Frame):
+    """A widget that shows the magnitude and phase of an S-parameter over a
+    plane (constant Z) of the scan, at one frequency, as the scan runs.
+
+    Each new point is drawn as a single pixel and blitted, so drawing a point
+    takes the same time however big the plane is. The whole figure is only
+    redrawn when the plane, frequency or S-parameter is changed, or when the
+    magnitude goes outside of the colour scale. The figure is only made when
+    the map is first shown.
+    """
+
+    def __init__(self, parent, engine):
+        """Init with the ScanEngine whose data is shown.
+
+        Args:
+            parent (tk.Widget): parent widget
+            engine (ScanEngine): engine running the scan
+        """
+        tk.Frame.__init__(self, parent)  # do superclass init
+        self.engine = engine
+        self.index = None  # GridIndex of the points shown
+        self.drawn = 0  # Number of points of the results that have been drawn
+        self.freq = None  # Frequency axis in Hz
+        self.ifreq = 0  # Index of the frequency shown
+        self.iz = 0  # Index of the plane shown
+        self.sparam = vna.SParam.S21
+        self.images = []  # Images of the magnitude and phase
+        self.pixels = []  # Rectangles used to draw new points on each image
+        self.canvas = None  # Made by make_figure when first shown
+
+        self.make_widgets()
+        self.bind("<Map>", lambda e: self.make_figure())
+
+    def make_widgets(self):
+        """Sets up widgets."""
+        select_group = tk.Frame(self)
+        select_group.pack(side=tk.TOP, pady=PADDING)
+
+        tk.Label(select_group, text="S-parameter:").pack(side=tk.LEFT)
+        self.sparam_select = ttk.Combobox(select_group, width=5, state="readonly")
+        self.sparam_select.pack(side=tk.LEFT, padx=PADDING)
+        tk.Label(select_group, text="Frequency (GHz):").pack(side=tk.LEFT)
+        self.freq_select = ttk.Combobox(select_group, width=10, state="readonly")
+        self.freq_select.pack(side=tk.LEFT, padx=PADDING)
+        tk.Label(select_group, text="Z:").pack(side=tk.LEFT)
+        self.z_select = ttk.Combobox(select_group, width=8, state="readonly")
+        self.z_select.pack(side=tk.LEFT, padx=PADDING)
+
+        for c in [self.sparam_select, self.freq_select, self.z_select]:
+            c.bind("<<ComboboxSelected>>", lambda e: self.select_callback())
+            c.config(state=tk.DISABLED)
+
+    def make_figure(self):
+        """Makes the figure, the first time the map is shown."""
+        if self.canvas is not None:
+            return
+        from matplotlib.backends.backend_tkagg import FigureCanvasTkAgg, NavigationToolbar2Tk
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=FIGURE_SIZE, dpi=DPI, facecolor=(0.9375, 0.9375, 0.9375))
+        self.canvas = FigureCanvasTkAgg(self.fig, master=self)
+        self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+        toolbar = NavigationToolbar2Tk(self.canvas, self)
+        toolbar.update()
+        toolbar.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        self.redraw()
+
+    def select_callback(self):
+        """Callback when the user selects another S-parameter, frequency or
+        plane."""
+        self.sparam = vna.SParam(self.sparam_select.get())
+        self.ifreq = self.freq_select.current()
+        self.iz = self.z_select.current()
+        self.redraw()
+
+    def get_value(self, meas):
+        """Returns the magnitude and phase shown for a point measured with a
+        list of MeasData, or None if the S-parameter has not been measured."""
+        d = next((d for d in meas if d.sweep_params.sparams[0] == self.sparam), None)
+        if d is None or self.ifreq >= len(d.freq):
+            return None
+        return d.mag[self.ifreq], d.phase[self.ifreq]
+
+    def update_plot(self):
+        """Draws the points that have been measured since the last update.
+
+        This is blocking, and should be called from the Tk thread.
+        """
+        if self.canvas is None:
+            return  # Everything is drawn once the figure is made
+        snapshot = self.engine.data
+        index = None if snapshot is None else snapshot.index
+        if index is not self.index:
+            self.freq = None
+            self.redraw(snapshot)
+            return
+
+        if snapshot is None or len(self.images) == 0:
+            if snapshot is not None and len(snapshot) > 0:
+                self.redraw(snapshot)  # First point of the scan
+            return
+
+        for grid_index, coord, meas in snapshot.points(self.drawn):
+            self.draw_point(grid_index, meas)
+        self.drawn = len(snapshot)
+
+    def draw_point(self, grid_index, meas):
+        """Draws a single new point by blitting."""
+        ix, iy, iz = grid_index
+        value = self.get_value(meas)
+        if iz != self.iz or value is None:
+            return
+
+        for im, pixel, v in zip(self.images, self.pixels, value):
+            im.get_array()[iy, ix] = v
+            im.changed()  # Used the next time the whole figure is redrawn
+
+        mag_min, mag_max = self.images[0].get_clim()
+        if not mag_min <= value[0] <= mag_max:
+            self.images[0].set_clim(*self.mag_limits(self.images[0].get_array()))
+            self.canvas.draw_idle()
+            return
+
+        # Draw the pixel on top of what is already on the canvas
+        x, y = self.index.axes[0][ix], self.index.axes[1][iy]
+        for im, pixel, v in zip(self.images, self.pixels, value):
+            w, h = pixel.get_width(), pixel.get_height()
+            pixel.set_xy((x - w / 2, y - h / 2))
+            pixel.set_facecolor(im.cmap(im.norm(v)))
+            pixel.axes.draw_artist(pixel)
+            self.canvas.blit(pixel.axes.bbox)
+
+    @staticmethod
+    def mag_limits(mag):
+        """Returns the colour scale for the magnitudes in mag, in steps of
+        MAG_STEP dB."""
+        if np.ma.count(mag) == 0:
+            return -MAG_STEP, 0
+        low = np.floor(np.ma.min(mag) / MAG_STEP) * MAG_STEP
+        high = np.ceil(np.ma.max(mag) / MAG_STEP) * MAG_STEP
+        if high <= low:
+            high = low + MAG_STEP
+        return low, high
+
+    def update_selections(self, snapshot):
+        """Updates the choices of S-parameter, frequency and plane for a new
+        scan, keeping the current ones if possible."""
+        first = next(iter(snapshot.values()))
+        sparams = [d.sweep_params.sparams[0] for d in first]
+        if self.sparam not in sparams:
+            self.sparam = vna.SParam.S21 if vna.SParam.S21 in sparams else sparams[0]
+        self.sparam_select.config(values=[sp.value for sp in sparams])
+        self.sparam_select.set(self.sparam.value)
+
+        self.freq = first[0].freq
+        self.ifreq = min(self.ifreq, len(self.freq) - 1)
+        self.freq_select.config(values=[FREQ_FORMAT.format(f / 1e9) for f in self.freq])
+        self.freq_select.current(self.ifreq)
+
+        z = self.index.axes[2]
+        self.iz = min(self.iz, len(z) - 1)
+        self.z_select.config(values=[POS_FORMAT.format(v) for v in z])
+        self.z_select.current(self.iz)
+
+    def redraw(self, snapshot=None):
+        """Redraws the whole figure with all the points of the plane in
+        snapshot (ScanSnapshot), or of the scan so far."""
+        from matplotlib.patches import Rectangle
+
+        if snapshot is None:
+            snapshot = self.engine.data
+        self.fig.clf()
+        self.images = []
+        self.pixels = []
+        self.index = None if snapshot is None else snapshot.index
+
+        if snapshot is None or len(snapshot) == 0:
+            self.drawn = 0
+            for c in [self.sparam_select, self.freq_select, self.z_select]:
+                c.config(values=[], state=tk.DISABLED)
+                c.set("")
+            self.canvas.draw()
+            return
+
+        for c in [self.sparam_select, self.freq_select, self.z_select]:
+            c.config(state="readonly")
+        if self.freq is None:
+            self.update_selections(snapshot)
+
+        x, y = self.index.axes[0], self.index.axes[1]
+        mag = np.full((len(y), len(x)), np.nan)
+        phase = np.full((len(y), len(x)), np.nan)
+        self.drawn = len(snapshot)
+        for grid_index, coord, meas in snapshot.points():
+            value = self.get_value(meas) if grid_index[2] == self.iz else None
+            if value is not None:
+                mag[grid_index[1], grid_index[0]], phase[grid_index[1], grid_index[0]] = value
+
+        dx = x[1] - x[0] if len(x) > 1 else 1
+        dy = y[1] - y[0] if len(y) > 1 else 1
+        extent = [x[0] - dx / 2, x[-1] + dx / 2, y[0] - dy / 2, y[-1] + dy / 2]
+        name = self.sparam.value
+        for i, (values, cmap, label) in enumerate(
+            [
+                (mag, MAG_CMAP, "|{}| (dB)".format(name)),
+                (phase, PHASE_CMAP, u"\N{ANGLE}{} (\N{DEGREE SIGN})".format(name)),
+            ]
+        ):
+            ax = self.fig.add_subplot(1, 2, i + 1)
+            im = ax.imshow(
+                values, origin="lower", extent=extent, cmap=cmap, interpolation="nearest"
+            )
+            im.set_clim(*(self.mag_limits(im.get_array()) if i == 0 else PHASE_LIMITS))
+            self.fig.colorbar(im, ax=ax, orientation="horizontal", label=label)
+            ax.set_xlabel("X (cm)")
+            if i == 0:
+                ax.set_ylabel("Y (cm)")
+
+            pixel = Rectangle((0, 0), dx, dy, linewidth=0, animated=True)
+            ax.add_patch(pixel)
+            self.images.append(im)
+            self.pixels.append(pixel)
+
+        self.fig.tight_layout()
+        self.canvas.draw()
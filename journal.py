@@ -0,0 +1,179 @@
+"""Crash-safe, append-only journal of a scan in progress.
+
+Each point is appended to the journal as soon as it is measured, so a crash,
+power blip, or closing the window does not lose the measurement. The journal
+starts with a header containing the scan recipe, followed by one record per
+measured point:
+
+    header: MAGIC, version, recipe length, recipe (JSON)
+    record: RECORD_HEADER (index, meta length, data length, CRC32), meta
+            (JSON with the coordinate and S-parameters), data (float64 arrays
+            of freq, mag, and phase for each S-parameter)
+
+Records are flushed to the OS as they are written, and synced to disk in
+batches (every FSYNC_POINTS points or FSYNC_INTERVAL seconds). A record that
+was only partly written before a crash fails its CRC check, and is discarded
+when the journal is resumed.
+"""
+
+import json
+import os
+import struct
+import time
+import zlib
+
+import numpy as np
+
+import vna
+
+MAGIC = b"NFSJ"
+VERSION = 1
+FILE_HEADER = struct.Struct("<4sII")  # Magic, version, recipe length
+RECORD_HEADER = struct.Struct("<IIII")  # Index, meta length, data length, CRC32
+FSYNC_POINTS = 10  # Sync to disk after this many points...
+FSYNC_INTERVAL = 5  # ...or after this many seconds, whichever comes first
+EXTENSION = ".nfj"  # File extension for journals
+
+
+class JournalError(Exception):
+    """Simple error exception for a journal that cannot be read."""
+
+    pass
+
+
+class ScanJournal:
+    """Append-only journal of the points measured in a scan.
+
+    Typical usage example:
+        j = ScanJournal.create('scan.nfj', recipe.to_dict())
+        j.append(n, p, meas_data)
+        j.close()
+
+        # After a crash
+        j, recipe, points = ScanJournal.resume('scan.nfj')
+    """
+
+    def __init__(self, filename, file):
+        """Init with an open file (use create() or resume())."""
+        self.filename = filename
+        self.file = file
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    @staticmethod
+    def create(filename, recipe):
+        """Creates a new journal for a scan with recipe (dict)."""
+        file = open(filename, "wb")
+        header = json.dumps(recipe).encode()
+        file.write(FILE_HEADER.pack(MAGIC, VERSION, len(header)) + header)
+        journal = ScanJournal(filename, file)
+        journal.sync()
+        return journal
+
+    @staticmethod
+    def read(filename):
+        """Reads a journal.
+
+        Returns the recipe (dict), a dict of the measured points where the key
+        is the index and the value is (coordinate, list of (SParam, freq, mag,
+        phase)), and the file offset after the last valid record.
+        """
+        points = {}
+        with open(filename, "rb") as file:
+            header = file.read(FILE_HEADER.size)
+            if len(header) < FILE_HEADER.size:
+                raise JournalError("Journal header is incomplete")
+            magic, version, length = FILE_HEADER.unpack(header)
+            if magic != MAGIC or version != VERSION:
+                raise JournalError("Not a scan journal (or unsupported version)")
+            try:
+                recipe = json.loads(file.read(length).decode())
+            except ValueError:
+                raise JournalError("Journal header is corrupted")
+            end = file.tell()
+
+            while True:
+                header = file.read(RECORD_HEADER.size)
+                if len(header) < RECORD_HEADER.size:
+                    break
+                n, meta_len, data_len, crc = RECORD_HEADER.unpack(header)
+                payload = file.read(meta_len + data_len)
+                if len(payload) < meta_len + data_len or zlib.crc32(payload) != crc:
+                    break  # Torn write at the end of the journal
+
+                meta = json.loads(payload[:meta_len].decode())
+                data = np.frombuffer(payload[meta_len:], dtype="<f8")
+                sweeps = []
+                i = 0
+                for sp, points_n in zip(meta["sparams"], meta["points"]):
+                    freq, mag, phase = data[i : i + 3 * points_n].reshape(3, points_n)
+                    sweeps.append((vna.SParam(sp), freq, mag, phase))
+                    i += 3 * points_n
+                points[n] = (meta["coord"], sweeps)
+                end = file.tell()
+
+        return recipe, points, end
+
+    @staticmethod
+    def resume(filename):
+        """Opens an existing journal to continue appending to it.
+
+        Any partly written record at the end is discarded. Returns the journal,
+        the recipe (dict) and the points (see read()).
+        """
+        recipe, points, end = ScanJournal.read(filename)
+        file = open(filename, "r+b")
+        file.truncate(end)
+        file.seek(end)
+        return ScanJournal(filename, file), recipe, points
+
+    def append(self, n, coord, meas):
+        """Appends the nth point at coord, with a list of MeasData."""
+        meta = json.dumps(
+            {
+                "coord": [float(c) for c in coord],
+                "sparams": [m.sweep_params.sparams[0].value for m in meas],
+                "points": [len(m.freq) for m in meas],
+            }
+        ).encode()
+        arrays = []
+        for m in meas:
+            arrays.extend([m.freq, m.mag, m.phase])
+        if len(arrays) > 0:
+            data = np.concatenate(arrays).astype("<f8").tobytes()
+        else:
+            data = b""
+        payload = meta + data
+        self.file.write(
+            RECORD_HEADER.pack(n, len(meta), len(data), zlib.crc32(payload)) + payload
+        )
+        self.file.flush()
+
+        self.unsynced += 1
+        if (
+            self.unsynced >= FSYNC_POINTS
+            or time.time() - self.last_sync >= FSYNC_INTERVAL
+        ):
+            self.sync()
+
+    def sync(self):
+        """Makes sure everything written so far is on disk."""
+        self.file.flush()
+        os.fsync(self.file.fileno())
+        self.unsynced = 0
+        self.last_sync = time.time()
+
+    def close(self):
+        """Syncs and closes the journal."""
+        if self.file is not None:
+            self.sync()
+            self.file.close()
+            self.file = None
+
+
+def first_unmeasured(points, N):
+    """Returns the index of the first point (of N) that is not in points."""
+    for n in range(N):
+        if n not in points:
+            return n
+    return N
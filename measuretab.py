@@ -19,14 +19,17 @@ import pickle
 import traceback
 from motiontab import MotionTab
 from vnatab import VNATab, MeasurementPlot
-import csv
-
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
-from matplotlib.figure import Figure
+from fieldmap import FieldMapPlot
+from settle import SettleMode
+from scan import ScanEngine, ScanRecipe, Status
+import export
+import journal
+import store
+import columnar
+from events import Event
 import numpy as np
 
-SLEEP = 50  # How long to wait between updating widgets
+SCAN_FILE_FORMAT = 'scan_%Y%m%d_%H%M%S'  # Name of scan files (for strftime)
 PADDING = 5  # Padding around widgets
 FREQ_DECIMALS = 2  # Decimal places for frequency values
 POWER_DECIMALS = 1  # Decimal placer for power in mdB
@@ -37,17 +40,6 @@ POINTS_FORMAT = '{:.0f}'
 STEP_FORMAT = '{:8.3f}'
 
 
-class Status(Enum):
-    """Represents the status of a measurement."""
-    NOT_READY = 0  # Needs further configuration
-    READY = 1
-    MEASURING = 2  # Measurement started
-    PAUSED = 3  # User paused the measurement
-    STOPPED = 4  # User stopped the measurement
-    DONE = 5  # Meausrement is done
-    ERROR = 6
-
-
 class Measurement():
     """Represents a complete measurement at a point."""
 
@@ -67,10 +59,10 @@ class Measurement():
 class MeasureTab(tk.Frame):
     """GUI tab for controlling measurement."""
 
-    def __init__(self, parent, dmc_obj, vna_obj, motion_tab, vna_tab, top):
-        """Set up the measurement tab and start the background task."""
+    def __init__(self, parent, dmc_obj, vna_obj, engine, motion_tab, vna_tab, top):
+        """Set up the measurement tab and subscribe to the events that change
+        the widgets."""
         self.top = top
-        self.status = Status.NOT_READY
         self.disable_widgets = False
 
         self.vna = vna_obj
@@ -78,27 +70,27 @@ class MeasureTab(tk.Frame):
         self.vna_tab = vna_tab
         self.motion_tab = motion_tab
 
-        self.freq_sweep = None
-        self.spatial_sweep = None
-        self.data = None
-        self.n = 0
-        self.prev_n = 0
-        self.N = 0
-        self.update = False
-        self.task = None
+        self.update_pending = False  # An update of the widgets is scheduled
+        self.export_task = None  # Thread exporting data, if there is one
+        self.export_fraction = 0  # How much of the export is done
+        self.export_result = None  # Set when the export is done
+        self.export_error = None  # Message if the export failed
+        self.export_cancel = threading.Event()
+        self.index_version = None  # Version of the index in the comboboxes
+        # The scan itself is run by the engine; this tab is just a client
+        self.engine = engine
 
         tk.Frame.__init__(self, parent)             # do superclass init
         self.pack()
         self.make_widgets()                      # attach widgets to self
+        for event in [Event.SCAN_UPDATE, Event.DMC_STATUS, Event.VNA_STATUS]:
+            top.events.subscribe(event, lambda payload: self.update_widgets())
+        top.events.subscribe(Event.EXPORT_PROGRESS, lambda fraction: self._update_export())
         self.update_widgets()
-        self.after(0, self.background_task)
 
     def clean_up(self):
         """End background task."""
-        if self.task is not None:
-            task = self.task
-            self.task = None
-            task.join()
+        self.engine.stop()
 
     def make_widgets(self):
         """Configure widgets for GUI tab."""
@@ -115,6 +107,15 @@ class MeasureTab(tk.Frame):
         self.pause_button.grid(row=1,column=2,padx=PADDING,pady=PADDING)
         self.reset_button = tk.Button(run_group, text="Reset",command=self.reset_btn_callback)
         self.reset_button.grid(row=1,column=3,padx=PADDING,pady=PADDING)
+        self.resume_button = tk.Button(run_group, text="Resume...",command=self.resume_btn_callback)
+        self.resume_button.grid(row=1,column=4,padx=PADDING,pady=PADDING)
+
+        # Selection of how to wait for the frame to settle after moving
+        tk.Label(run_group, text="Settle:").grid(row=2,column=1,padx=PADDING,pady=PADDING)
+        self.settle_select = tk.ttk.Combobox(run_group, width=8, state="readonly",
+                                             values=[m.value for m in SettleMode])
+        self.settle_select.set(SettleMode.NONE.value)
+        self.settle_select.grid(row=2,column=2,columnspan=2,padx=PADDING,pady=PADDING)
 
         info_group = tk.LabelFrame(left_group, text="Info")
         info_group.pack(side=tk.TOP,fill=tk.X,expand=tk.YES,padx=PADDING,pady=PADDING,ipadx=PADDING,ipady=PADDING)
@@ -138,11 +139,37 @@ class MeasureTab(tk.Frame):
         self.export_csv_button = tk.Button(export_group, text="Export CSV", command=self.export_csv_callback)
         self.export_csv_button.pack(side=tk.TOP,padx=PADDING,pady=PADDING)
 
+        touchstone_group = tk.Frame(export_group)
+        touchstone_group.pack(side=tk.TOP)
+        self.export_ts_button = tk.Button(touchstone_group, text="Export Touchstone",
+                                          command=self.export_touchstone_callback)
+        self.export_ts_button.pack(side=tk.LEFT,padx=PADDING,pady=PADDING)
+        self.export_ts_format = tk.ttk.Combobox(touchstone_group, width=4, state="readonly",
+                                                values=[f.value for f in export.TouchstoneFormat])
+        self.export_ts_format.current(0)
+        self.export_ts_format.pack(side=tk.LEFT)
+
+        self.export_progress_val = tk.DoubleVar()
+        self.export_progress_bar = tk.ttk.Progressbar(export_group,
+                                          orient=tk.HORIZONTAL,
+                                          variable=self.export_progress_val,
+                                          length=100)
+        self.export_progress_bar.pack(side=tk.TOP)
+        self.export_cancel_button = tk.Button(export_group, text="Cancel", command=self.export_cancel.set,
+                                              state=tk.DISABLED)
+        self.export_cancel_button.pack(side=tk.TOP,padx=PADDING,pady=PADDING)
+
         right_group = tk.Frame(self)
         right_group.pack(side=tk.LEFT,fill=tk.X,expand=tk.YES,padx=PADDING,pady=PADDING,ipadx=PADDING,ipady=PADDING)
 
+        # Pages for the trace of a single point, and a map of the whole plane
+        plot_notebook = ttk.Notebook(right_group)
+        plot_notebook.pack(side=tk.TOP,fill=tk.BOTH,expand=tk.YES)
+        trace_page = tk.Frame(plot_notebook)
+        plot_notebook.add(trace_page, text="Trace")
+
         # Set of widgets for configuring which S-param to plot
-        plot_sel_group = tk.Frame(right_group)
+        plot_sel_group = tk.Frame(trace_page)
         plot_sel_group.pack(side=tk.TOP,padx=PADDING,pady=PADDING,ipadx=PADDING,ipady=PADDING)
         tk.Label(plot_sel_group,text="Select coordinate for plotting: ").pack(side=tk.LEFT)
 
@@ -155,144 +182,161 @@ class MeasureTab(tk.Frame):
             self.plot_select[-1].bind("<<ComboboxSelected>>", lambda e: self.plot_select_callback())
 
         # Add a plot to preview S-params during measurement
-        self.measurement_plot = MeasurementPlot(right_group,"Title")
+        self.measurement_plot = MeasurementPlot(trace_page,"Title")
         self.measurement_plot.pack(side=tk.TOP,fill=tk.BOTH)
 
+        # Add a live map of the field over a plane of the scan
+        self.field_map = FieldMapPlot(plot_notebook, self.engine)
+        plot_notebook.add(self.field_map, text="Field map")
+
         # Add callback to update widgets when the tab becomes visible
         self.bind('<Visibility>', lambda e: self.update_widgets())
 
     def update_widgets(self):
-        """Updates the widgets depending on measurement status."""
-        if self.dmc.status == dmc.Status.STOP and self.vna.connected:
-            if self.status == Status.NOT_READY:
-                self.status = Status.READY
-        else:
-            if self.status != Status.MEASURING and self.status != Status.PAUSED:
-                self.status = Status.NOT_READY
-        self.update = True
+        """Updates the widgets depending on measurement status.
+
+        The update is done once the Tk thread is idle, so several calls in a
+        row only update the widgets once.
+        """
+        self.engine.check_ready()
+        if not self.update_pending:
+            self.update_pending = True
+            self.after_idle(self._update_widgets)
 
     def _update_widgets(self):
         """Private method to perform update. This is a blocking function called
-        by the background task, in response to update_widgets.
+        when the Tk thread is idle, in response to update_widgets.
         """
-        if self.disable_widgets or self.status == Status.NOT_READY:
+        self.update_pending = False
+        if self.disable_widgets or self.engine.status == Status.NOT_READY:
             self.top.enable_tabs(True)
             self.begin_button.config(state=tk.DISABLED)
             self.pause_button.config(state=tk.DISABLED)
             self.reset_button.config(state=tk.DISABLED)
-            self.export_csv_button.config(state=tk.DISABLED)
+            self.resume_button.config(state=tk.NORMAL)
+            self.settle_select.config(state="readonly")
+            self.set_export_state(tk.DISABLED)
 
             self.progress_val.set(0)
             self.info_label.config(text="Not configured for measurement", fg="red")
-        elif self.status == Status.READY:
+        elif self.engine.status == Status.READY:
             self.top.enable_tabs(True)
             self.begin_button.config(state=tk.NORMAL)
             self.pause_button.config(state=tk.DISABLED)
             self.reset_button.config(state=tk.DISABLED)
-            self.export_csv_button.config(state=tk.DISABLED)
+            self.resume_button.config(state=tk.NORMAL)
+            self.settle_select.config(state="readonly")
+            self.set_export_state(tk.DISABLED)
 
             self.progress_val.set(0)
             self.info_label.config(text="Ready for measurement", fg="black")
-        elif self.status == Status.MEASURING:
+        elif self.engine.status == Status.MEASURING:
             self.top.enable_tabs(False)
             self.begin_button.config(state=tk.DISABLED)
             self.pause_button.config(state=tk.NORMAL)
             self.reset_button.config(state=tk.DISABLED)
-            self.export_csv_button.config(state=tk.DISABLED)
+            self.resume_button.config(state=tk.DISABLED)
+            self.settle_select.config(state=tk.DISABLED)
+            self.set_export_state(tk.DISABLED)
 
-            self.progress_val.set(100*self.n/self.N)
-            p = self.spatial_sweep.get_coordinate(self.n)
+            self.progress_val.set(100*self.engine.n/self.engine.N)
+            p = self.engine.get_coordinate(self.engine.n)
             coord = ", ".join([POS_FORMAT.format(pp) for pp in p])
             self.info_label.config(text="Measuring at\n[{}]".format(coord), fg="black")
 
-        elif self.status == Status.PAUSED:
+        elif self.engine.status == Status.PAUSED:
             self.begin_button.config(state=tk.NORMAL)
             self.pause_button.config(state=tk.DISABLED)
             self.reset_button.config(state=tk.NORMAL)
-            self.export_csv_button.config(state=tk.NORMAL)
+            self.resume_button.config(state=tk.DISABLED)
+            self.settle_select.config(state=tk.DISABLED)
+            self.set_export_state(tk.NORMAL)
+            self.progress_val.set(100*self.engine.n/self.engine.N)
             self.info_label.config(text="Measurement paused", fg="black")
 
-        elif self.status == Status.DONE:
+        elif self.engine.status == Status.DONE:
             self.begin_button.config(state=tk.DISABLED)
             self.pause_button.config(state=tk.DISABLED)
             self.reset_button.config(state=tk.NORMAL)
-            self.export_csv_button.config(state=tk.NORMAL)
+            self.resume_button.config(state=tk.DISABLED)
+            self.settle_select.config(state=tk.DISABLED)
+            self.set_export_state(tk.NORMAL)
             self.progress_val.set(100)
             self.info_label.config(text="Measurement complete!", fg="black")
-        elif self.status == Status.ERROR:
+        elif self.engine.status == Status.ERROR:
             msg = 'An error occured!\n\n' + '\n'.join([str(e) + ':' + str(i) for i,e in enumerate(self.dmc.errors)])
             msg += '\n\n' + '\n'.join([str(s) for s in self.dmc.stop_code])
+            if self.engine.recover() == Status.PAUSED:
+                # Keep the data so the scan can resume after reconnecting
+                msg += '\n\nThe measurement is paused and can be resumed ' \
+                       'from point {} after homing.'.format(self.engine.n + 1)
             tk.messagebox.showerror( message=msg)
-            self.status = Status.NOT_READY
-            self.update = True
-
-        if self.data != None and len(self.data) > 0:
-            for i,ps in enumerate(self.plot_select):
-                vals = [coord[i] for coord in list(self.data.keys())]
-                vals = list(set(vals))
-                vals.sort()
-                vals = [POS_FORMAT.format(v) for v in vals]
-
-                if len(vals) == 1:
-                    current = str(vals[0])
-                else:
-                    current = ps.get()
-
-                ps.config(values=vals)
-                ps.set(current)
-
-                if len(vals) < 2:
-                    ps.config(state=tk.DISABLED)
-                else:
-                    ps.config(state=tk.NORMAL)
+            self.update_widgets()
 
-            if len(self.data) == 1:
-                d = self.data[list(self.data.keys())[0]]
-                self.measurement_plot.set_data(d)
+        if self.export_task is not None:
+            self.set_export_state(tk.DISABLED)
+            self.export_cancel_button.config(state=tk.NORMAL)
+        else:
+            self.export_cancel_button.config(state=tk.DISABLED)
+
+        data = self.engine.data
+        if data is not None and len(data) > 0:
+            index = data.index
+            # Only update the comboboxes when a new coordinate was measured
+            if index.version != self.index_version:
+                self.index_version = index.version
+                for i,ps in enumerate(self.plot_select):
+                    vals = [POS_FORMAT.format(v) for v in index.values(i)]
 
-            else:
-                coord = []
+                    if len(vals) == 1 or ps.get() == '':
+                        current = vals[0]
+                    else:
+                        current = ps.get()
 
-                for i,ps in enumerate(self.plot_select):
-                    # The combobox has a truncated version of the float value
-                    # Find the value that is closest
-                    val = float(ps.get())
-                    vals = [coord[i] for coord in list(self.data.keys())]
-                    n = [abs(v-val) for v in vals]
-                    idx = n.index(min(n))
-                    coord.append(vals[idx])
+                    ps.config(values=vals)
+                    ps.set(current)
 
-                try:
-                    d = self.data[tuple(coord)]
-                except KeyError:
-                    d = None
+                    if len(vals) < 2:
+                        ps.config(state=tk.DISABLED)
+                    else:
+                        ps.config(state=tk.NORMAL)
 
-                self.measurement_plot.set_data(d)
+            self.measurement_plot.set_data(self.get_selected_data(data))
 
         else:
+            self.index_version = None
             for i,ps in enumerate(self.plot_select):
                 ps.config(values=[])
                 ps.config(state=tk.DISABLED)
                 ps.set('')
 
-    def plot_select_callback(self):
-        """Set data of the plot to that requested by the user."""
-        coord = []
+        self.field_map.update_plot()
 
-        for i,ps in enumerate(self.plot_select):
-            # The combobox has a truncated version of the float value
-            # Find the value that is closest
-            val = float(ps.get())
-            vals = [coord[i] for coord in list(self.data.keys())]
-            n = [abs(v-val) for v in vals]
-            idx = n.index(min(n))
-            coord.append(vals[idx])
+    def get_selected_data(self, data=None):
+        """Returns the data of the point selected for plotting, or None if it
+        has not been measured.
 
+        Args:
+            data (ScanSnapshot): the measured points, or None for a new
+            snapshot of the scan
+        """
+        if data is None:
+            data = self.engine.data
+        if data is None:
+            return None
+        # The combobox has a truncated version of the float value, so the
+        # nearest point on the grid is used
         try:
-            d = self.data[tuple(coord)]
-        except KeyError:
+            coord = [float(ps.get()) for ps in self.plot_select]
+        except ValueError:
+            return None
+        return data.get(data.index.lookup(coord))
+
+    def plot_select_callback(self):
+        """Set data of the plot to that requested by the user."""
+        d = self.get_selected_data()
+        if d is None:
             tk.messagebox.showerror(message="Point not yet measured")
-            d = None
 
         self.measurement_plot.set_data(d)
 
@@ -300,96 +344,140 @@ class MeasureTab(tk.Frame):
         """Callback in response to user requesting to begin measurement.
 
         Checks that paremeters are OK and then starts measurment on another
-        thread.
+        thread. A paused measurement continues with the same parameters.
         """
-        self.freq_sweep = self.vna_tab.get_sweep_params()
-        if self.freq_sweep is None:
+        if self.dmc.status != dmc.Status.STOP or not self.vna.connected:
+            tk.messagebox.showerror(title="",message="Not configured for measurement.")
+            return
+
+        if self.engine.status == Status.PAUSED:
+            # The settle mode cannot be changed while paused (see
+            # _update_widgets), so the recipe is continued as it was
+            self.engine.start()
+            return
+
+        freq_sweep = self.vna_tab.get_sweep_params()
+        if freq_sweep is None:
             tk.messagebox.showerror(title="",message="Please check VNA sweep configuration.")
             return
 
-        msgs = self.freq_sweep.validation_messages(check_sparams=True)
+        msgs = freq_sweep.validation_messages(check_sparams=True)
         if msgs is not None:
             tk.messagebox.showerror(message="Please fix sweep parameters.\n\n" + '\n'.join(msgs))
             return
 
-        self.spatial_sweep = self.motion_tab.get_sweep_params()
-        if self.spatial_sweep is None:
+        spatial_sweep = self.motion_tab.get_sweep_params()
+        if spatial_sweep is None:
             tk.messagebox.showerror(title="",message="Please check spatial sweep configuration.")
             return
 
-        if self.status == Status.READY:
-            self.data = {}
-            self.n = 0
-            self.update_widgets()
-        elif self.status != Status.PAUSED:
-            raise Exception('Begin measurement in bad state')
+        # Journal each point so the measurement can be resumed after a crash,
+        # and fill in the data cube (and Parquet file) as the scan runs. They
+        # are named after the store the user selects.
+        my_filetypes = [('scan stores', store.EXTENSION),("all files","*.*")]
+        filename = filedialog.asksaveasfilename(parent=self,
+                                                initialdir=os.getcwd(),
+                                                initialfile=time.strftime(SCAN_FILE_FORMAT),
+                                                title="Select scan output",
+                                                filetypes=my_filetypes,
+                                                defaultextension=store.EXTENSION)
+        if not filename:
+            return # User did not select a file
+        filename = os.path.splitext(filename)[0]
+        parquet = filename + columnar.EXTENSION if columnar.available() else None
+        recipe = ScanRecipe(spatial_sweep, freq_sweep, self.motion_tab.get_speed(),
+                            SettleMode(self.settle_select.get()),
+                            journal=filename + journal.EXTENSION,
+                            store=filename + store.EXTENSION,
+                            parquet=parquet)
+        self.engine.configure(recipe)
+        self.engine.start()
+
+    def resume_btn_callback(self):
+        """Callback in response to user wanting to resume an interrupted
+        measurement from its journal."""
+        my_filetypes = [('scan journals', journal.EXTENSION),("all files","*.*")]
+        filename = filedialog.askopenfilename(parent=self,
+                                              initialdir=os.getcwd(),
+                                              title="Select journal",
+                                              filetypes=my_filetypes)
+        if filename == "":
+            return # User did not select a file
 
-        self.status = Status.MEASURING
-        self.update_widgets()
-        self.task = threading.Thread(target=self.measurement_task)
-        self.task.start()
+        try:
+            self.engine.resume(filename)
+        except (OSError, journal.JournalError) as e:
+            tk.messagebox.showerror(message="Could not resume measurement.\n\n" + str(e))
 
     def pause_btn_callback(self):
         """Callback in response to requesting pausing a measurement."""
-        self.status = Status.PAUSED
-        self.update_widgets()
+        self.engine.pause()
 
     def reset_btn_callback(self):
         """Callback in response to requesting to reset after pausing or
         completing a measurement."""
-        self.status = Status.READY
-        self.data = None
-        self.n = 0
+        self.engine.reset()
         self.measurement_plot.set_data(None)
-        self.update_widgets()
 
-    def background_task(self):
-        """Background task that just updates the widgets."""
-        if self.update:
-            self.update = False
-            self._update_widgets()
-        self.after(SLEEP, self.background_task)
+    def _update_export(self):
+        """Shows the progress of the export, and lets the user know when it
+        is done. Called on Event.EXPORT_PROGRESS."""
+        if self.export_task is None:
+            return
+        self.export_progress_val.set(100*self.export_fraction)
+        if self.export_result is None:
+            return # Still exporting
 
-    def measurement_task(self):
-        """Measurement task that controls the DMC and VNA to perform a
-        measurement."""
-        assert isinstance(self.freq_sweep, vna.FreqSweepParams)
-        assert isinstance(self.spatial_sweep, dmc.SpatialSweepParams)
+        self.export_task.join()
+        self.export_task = None
+        self.config(cursor="") # Set cursor to normal
+        self.export_progress_val.set(0)
+        self.update_widgets()
+        if self.export_error is not None:
+            tk.messagebox.showerror(message="Export failed.\n\n" + self.export_error)
+        elif self.export_result:
+            tk.messagebox.showinfo(message="Export complete")
+        else:
+            tk.messagebox.showinfo(message="Export cancelled")
 
-        util.dprint('Started measurement task {}'.format(threading.current_thread()))
+    def set_export_state(self, state):
+        """Enables or disables the export buttons."""
+        self.export_csv_button.config(state=state)
+        self.export_ts_button.config(state=state)
 
-        self.N = self.spatial_sweep.get_num_points()
+    def start_export(self, write):
+        """Starts exporting the measurement in a thread.
 
+        Args:
+            write (callable): exports the data, given the progress and cancel
+            callables (see export.write_csv)
+        """
+        self.config(cursor="wait") # Set cursor to "busy"
+        self.export_fraction = 0
+        self.export_result = None
+        self.export_error = None
+        self.export_cancel.clear()
+        self.export_task = threading.Thread(target=lambda: self.export_thread(write))
+        self.export_task.start()
         self.update_widgets()
-        while self.n < self.N:
-            # Move DMC to the next point
-            p = self.spatial_sweep.get_coordinate(self.n)
-            util.dprint('Move to {}'.format(p))
-
-            self.dmc.set_speed(self.motion_tab.get_speed())
-            # Wait up to 180 seconds for move, otherwise error
-            if not self.dmc.move_absolute_blocking(p, 180):
-                self.dmc.disable_motors()
-                self.status = Status.ERROR
-
-            sp = self.vna.measure_all(self.freq_sweep)
-
-            try:
-                self.data[tuple(p)] = sp
-            except TypeError:
-                pass # self.data is None after resetting
-
-            if self.status != Status.MEASURING or self.task == None:
-                self.update_widgets()
-                util.dprint('Ending measurement task {}'.format(threading.current_thread()))
-                return
-
-            self.n += 1
-            self.update_widgets()
 
-        self.status = Status.DONE
-        self.update_widgets()
-        util.dprint('Done measuring')
+    def export_thread(self, write):
+        """Runs an export (see start_export). This is blocking!"""
+        def progress(fraction):
+            self.export_fraction = fraction
+            self.top.events.publish(Event.EXPORT_PROGRESS, fraction)
+
+        try:
+            self.export_result = write(progress, self.export_cancel.is_set)
+        except Exception as e:
+            util.dprint(traceback.format_exc())
+            self.export_error = str(e)
+            self.export_result = False
+        finally:
+            if self.export_result is None:
+                self.export_result = False
+            # Lets the Tk thread finish the export and enable the buttons
+            self.top.events.publish(Event.EXPORT_PROGRESS, self.export_fraction)
 
     def export_csv_callback(self):
         """Callback in response to user wanting to export measured data."""
@@ -403,33 +491,24 @@ class MeasureTab(tk.Frame):
             tk.messagebox.showerror(message="No file selected!")
             return # User did not select a file
         else:
-            threading.Thread(target=lambda: self.export_csv_task(filename)).start()
-
-    def export_csv_task(self, filename):
-        """Exports the measurement to a CSV file. This is blocking!
-
-        Args:
-            filename (str): name and path to file for saving
-        """
-        self.config(cursor="wait") # Set cursor to "busy"
-        with open(filename, mode='w+') as file:
-            writer = csv.writer(file, delimiter=',', quotechar='"', quoting=csv.QUOTE_MINIMAL)
-
-            if len(self.data) == 0:
-                return # No data to write out
-
-            # Write header
-            header = ['X', 'Y', 'Z', 'S-parameter', 'Frequency','Magnitude','Phase']
-            writer.writerow(header)
-
-            for pos,sp_sweep in self.data.items():
-                row1 = ['{:.10f}'.format(p) for p in pos]
-
-                for sp_data in sp_sweep:
-                    row2 = row1 + [sp_data.sweep_params.sparams[0].value]
-
-                    for i in range(len(sp_data.freq)):
-                        d = ['{:.5E}'.format(sp_data.freq[i]), '{:.5f}'.format(sp_data.mag[i]), '{:.5f}'.format(sp_data.phase[i])]
-                        writer.writerow(row2 + d)
-        self.config(cursor="") # Set cursor to normal
-        tk.messagebox.showinfo(message="Export complete")
+            data = self.engine.data
+            self.start_export(lambda progress, cancel:
+                              export.write_csv(data, filename, progress, cancel))
+
+    def export_touchstone_callback(self):
+        """Callback in response to user wanting to export measured data as
+        Touchstone files. They are put in a .zip archive, or in a directory if
+        the name has no extension."""
+        my_filetypes = [('Touchstone archive', '.zip'),("directory","*")]
+        filename = filedialog.asksaveasfilename(parent=self,
+                                                initialdir=os.getcwd(),
+                                                title="Select archive or directory",
+                                                filetypes=my_filetypes)
+        if filename == "":
+            tk.messagebox.showerror(message="No file selected!")
+            return # User did not select a file
+        else:
+            data = self.engine.data
+            fmt = export.TouchstoneFormat(self.export_ts_format.get())
+            self.start_export(lambda progress, cancel:
+                              export.write_touchstone(data, filename, fmt, progress, cancel))
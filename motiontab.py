@@ -8,6 +8,7 @@ from enum import Enum
 import util
 import re
 import DMC
+from events import Event
 import threading
 import serial.tools.list_ports
 
@@ -26,24 +27,24 @@ class MotionTab(tk.Frame):
     POINTS_FORMAT = "{:.0f}"
     STEP_FORMAT = "{:8.3f}"
 
-    def __init__(self, parent=None, dmc=None):
-        """Initialize GUI and start thread tot"""
+    def __init__(self, parent=None, dmc=None, events=None):
+        """Initialize GUI and subscribe to the DMC events (EventBus)."""
         self.gui_ready = False
         tk.Frame.__init__(self, parent)  # do superclass init
         self.dmc = dmc
-        self.last_dmc_status = self.dmc.status
         self.pack()
         self.make_widgets()  # attach widgets to self
         self.enable_joystick(False)
         self.enable_connect(True)
-        self.force_update = False
         self.gui_ready = True
         self.die = False
         self.disable_widgets = False
 
-        self.force_update = True
-        # Start running the task in the background on another thread
-        self.after(50, self.background_task)
+        # Update the widgets only when the DMC changes
+        events.subscribe(Event.DMC_STATUS, lambda status: self.update_widgets())
+        events.subscribe(Event.DMC_POSITION, lambda pos: self.update_current_stats())
+        events.subscribe(Event.DMC_ERROR, lambda e: self.show_errors())
+        self.update_widgets()
 
     def clean_up(self):
         pass  # Nothing needs to be done
@@ -200,6 +201,10 @@ class MotionTab(tk.Frame):
             position_group_3, text="Home", command=self.home_callback
         )
         self.home_button.pack(side=tk.LEFT, padx=5, pady=5)
+        self.backlash_button = tk.Button(
+            position_group_3, text="Calibrate backlash", command=self.backlash_callback
+        )
+        self.backlash_button.pack(side=tk.LEFT, padx=5, pady=5)
         self.stop_button = tk.Button(
             position_group_3, text="Stop", fg="Red", command=self.stop_callback
         )
@@ -401,6 +406,10 @@ class MotionTab(tk.Frame):
         """Callback to start homing procedure."""
         self.dmc.home()
 
+    def backlash_callback(self):
+        """Callback to start measuring the backlash."""
+        self.dmc.calibrate_backlash()
+
     def stop_callback(self):
         """Callback to abruptly stop movement."""
         self.dmc.stop()
@@ -460,18 +469,10 @@ class MotionTab(tk.Frame):
     def enable_widgets(self, enabled=True):
         """Enables/disables all the widgets."""
         self.disable_widgets = not enabled
-        self.force_update = True
-
-    def background_task(self):
-        """Task that runs in the background and keeps widgets up to date.
-
-        It keeps running indefinitelly by restarting every 50 ms.
-        """
-        status = self.dmc.status
-
-        if status != DMC.Status.DISCONNECTED:
-            self.update_current_stats()
+        self.update_widgets()
 
+    def show_errors(self):
+        """Tells the user about errors of the DMC (if there are any)."""
         if len(self.dmc.errors) > 0:
             msg = "An error occured!\n\n" + "\n".join(
                 [str(k) + ": " + str(v) for k, v in self.dmc.errors.items()]
@@ -480,40 +481,54 @@ class MotionTab(tk.Frame):
             tk.messagebox.showerror(title="Motor controller error", message=msg)
             self.dmc.clear_errors()
 
-        # Only update if there is a need to update
-        if self.last_dmc_status != status or self.force_update:
-            if status is DMC.Status.DISCONNECTED:
-                self.enable_connect(True)
-                self.enable_joystick(False)
-                self.calibration_label.config(
-                    text="Motor controller is disconnected", fg="red"
-                )
-                self.enable_entries(False)
+    def update_widgets(self):
+        """Updates the widgets depending on the DMC status.
+
+        Called on the Tk thread when the status changes.
+        """
+        status = self.dmc.status
+
+        if status != DMC.Status.DISCONNECTED:
+            self.update_current_stats()
+
+        if status is DMC.Status.DISCONNECTED:
+            self.enable_connect(True)
+            self.enable_joystick(False)
+            self.calibration_label.config(
+                text="Motor controller is disconnected", fg="red"
+            )
+            self.enable_entries(False)
+            self.backlash_button.config(state=tk.DISABLED)
+
+        if status is DMC.Status.MOTORS_DISABLED:
+            self.enable_connect(False)
+            self.enable_joystick(False)
+            text = "Homing needs to be performed"
+            if self.dmc.home_valid:
+                text += "\n(fast re-home available)"
+            self.calibration_label.config(text=text, fg="red")
+            self.enable_entries(False)
+            self.backlash_button.config(state=tk.DISABLED)
+
+        if status is DMC.Status.CALIBRATING:
+            self.enable_joystick(False)
+            self.calibration_label.config(text="Calibrating backlash", fg="black")
+            self.enable_entries(False)
+            self.backlash_button.config(state=tk.DISABLED)
+
+        if status is DMC.Status.STOP:
+            self.enable_connect(False)
+            self.enable_joystick(True)
+            self.calibration_label.config(text="Ready for measurement", fg="black")
+            self.enable_entries(True)
+            self.backlash_button.config(state=tk.NORMAL)
+
+        if self.disable_widgets:
+            self.enable_connect(False)
+            self.enable_joystick(False)
+            self.disconnect_button.config(state=tk.DISABLED)
+            self.home_button.config(state=tk.DISABLED)
+            self.stop_button.config(state=tk.DISABLED)
+            self.enable_entries(False)
+            self.backlash_button.config(state=tk.DISABLED)
 
-            if status is DMC.Status.MOTORS_DISABLED:
-                self.enable_connect(False)
-                self.enable_joystick(False)
-                self.calibration_label.config(
-                    text="Homing needs to be performed", fg="red"
-                )
-                self.enable_entries(False)
-
-            if status is DMC.Status.STOP:
-                self.enable_connect(False)
-                self.enable_joystick(True)
-                self.calibration_label.config(text="Ready for measurement", fg="black")
-                self.enable_entries(True)
-
-            if self.disable_widgets:
-                self.enable_connect(False)
-                self.enable_joystick(False)
-                self.disconnect_button.config(state=tk.DISABLED)
-                self.home_button.config(state=tk.DISABLED)
-                self.stop_button.config(state=tk.DISABLED)
-                self.enable_entries(False)
-
-            self.force_update = False
-            self.last_dmc_status = status
-
-        # Run again after 50 ms
-        self.after(50, self.background_task)
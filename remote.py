@@ -0,0 +1,469 @@
+"""Running the instruments and the scan in a separate process from the GUI.
+
+The InstrumentServer owns the DMC, the VNA and the ScanEngine, so the 20 ms
+DMC loop, the GPIB reads and the scan are not slowed down by drawing the GUI
+(which holds the GIL of its own process). The GUI is a client, which talks to
+the server over a local socket (multiprocessing.connection) with a small
+protocol of pickled tuples:
+
+    client -> server:
+        ("call", id, target, method, args, kwargs)  Call a method of the
+                                                    "dmc", "vna" or "engine"
+        ("close",)                                  The GUI is exiting
+    server -> client:
+        ("reply", id, result, error, state)         Result of a call
+        ("events", [(event, payload), ...], state)  Events since the last ones
+        ("recipe", recipe)                          The engine has a new recipe
+        ("results", new)                            A new scan began (or none)
+        ("points", start, [(grid, coord, meas)])    Points measured from start
+
+Each reply and batch of events carries the state of the instruments (e.g. the
+DMC status and position), which the proxies on the client use to answer
+questions without a round trip. The state is kept small, since it is sent so
+often: the recipe and the measured points are only sent once, and the client
+keeps its own copy of them.
+
+Only processes of the same user can connect, since the connection is
+authenticated with a random key in a file that only the user can read (see
+load_authkey), and only the methods in METHODS can be called.
+
+The server keeps running when the GUI disconnects without closing (e.g. if it
+crashes) or while a scan is running, and a new GUI picks up where the old one
+left off. The server is normally started by the GUI, but it can be run on its
+own:
+
+    python remote.py [--dummy]
+"""
+
+import argparse
+import itertools
+import os
+import secrets
+import subprocess
+import sys
+import threading
+import time
+import traceback
+from multiprocessing.connection import Client, Listener
+
+import util
+import DMC as dmc
+import vna
+from events import Event, EventBus, PUMP_INTERVAL
+from scan import ScanEngine, ScanResults, Status
+
+ADDRESS = ("localhost", 17435)  # Where the server listens
+AUTHKEY_FILE = "authkey"  # File in util.DATA_DIR with the key of this user
+AUTHKEY_BYTES = 32  # Length of the key
+START_TIMEOUT = 10  # How long to wait for a new server to start in seconds
+# Methods of the "dmc", "vna" and "engine" that clients can call
+METHODS = {
+    "dmc": [
+        "connect",
+        "disconnect",
+        "home",
+        "jog",
+        "stop",
+        "set_speed",
+        "clear_errors",
+        "calibrate_backlash",
+    ],
+    "vna": ["connect", "disconnect", "measure"],
+    "engine": ["configure", "start", "pause", "reset", "resume", "recover", "check_ready"],
+}
+POINTS_BATCH = 100  # Most points sent in one message
+
+
+class InstrumentServer:
+    """Runs the DMC, VNA and ScanEngine for one client at a time.
+
+    Typical usage example:
+        s = InstrumentServer(dummy=False)
+        s.serve_forever()
+    """
+
+    def __init__(self, dummy=False, address=ADDRESS):
+        """Init the instruments (without connecting to them)."""
+        self.events = EventBus()
+        self.dmc = dmc.DMC(dummy, events=self.events)
+        self.vna = vna.VNA(dummy)
+        self.engine = ScanEngine(self.dmc, self.vna, events=self.events)
+        self.listener = Listener(address, authkey=load_authkey())
+        self.conn = None  # Connection to the current client
+        self.send_lock = threading.Lock()
+        self.outbox = []  # Events to send with the next batch
+        self.running = True
+        for event in Event:
+            self.events.subscribe(event, lambda payload, e=event: self.outbox.append((e, payload)))
+
+    def state(self):
+        """Returns a dict of the state of each target, as seen by clients.
+        The status of the engine is updated first (see check_ready)."""
+        d, v, e = self.dmc, self.vna, self.engine
+        e.check_ready()
+        return {
+            "dmc": {
+                "status": d.status,
+                "errors": dict(d.errors),
+                "stop_code": list(d.stop_code),
+                "home_valid": d.home_valid,
+                "position": d.get_position(),
+            },
+            "vna": {"connected": v.connected, "cal_ok": v.cal_ok, "cal_type": v.cal_type},
+            "engine": {"status": e.status, "n": e.n, "N": e.N},
+        }
+
+    def send(self, msg):
+        """Sends a message to the client, if there is one."""
+        with self.send_lock:
+            if self.conn is None:
+                return
+            try:
+                self.conn.send(msg)
+            except (OSError, EOFError):
+                self.conn = None
+
+    def serve_forever(self):
+        """Accepts clients one after another until a client closes while no
+        scan is running. This is blocking!"""
+        threading.Thread(target=self.send_task, daemon=True).start()
+        while self.running:
+            conn = self.listener.accept()
+            util.dprint("Client connected")
+            with self.send_lock:
+                self.conn = conn
+            # Resend the recipe and all the results to the new client
+            self.sent_recipe = None
+            self.sent_results = None
+            self.serve(conn)
+            util.dprint("Client disconnected")
+        self.engine.stop()
+        self.engine.close_files()
+        self.dmc.clean_up()
+        self.vna.disconnect()
+        self.listener.close()
+
+    def serve(self, conn):
+        """Handles the calls of a client until it disconnects. Each call is
+        handled on its own thread, so a long measurement does not hold up
+        e.g. stopping the DMC."""
+        while True:
+            try:
+                msg = conn.recv()
+            except (OSError, EOFError):
+                break
+            if msg[0] == "call":
+                threading.Thread(target=lambda m=msg: self.handle(*m[1:]), daemon=True).start()
+            elif msg[0] == "close":
+                self.running = self.engine.status == Status.MEASURING
+                break
+        with self.send_lock:
+            self.conn = None
+        conn.close()
+
+    def handle(self, id, target, method, args, kwargs):
+        """Calls a method of a target and replies with the result."""
+        result = None
+        error = None
+        try:
+            if method not in METHODS.get(target, []):
+                raise AttributeError("{} has no method {} for clients".format(target, method))
+            result = getattr(getattr(self, target), method)(*args, **kwargs)
+        except Exception as e:
+            util.dprint(traceback.format_exc())
+            error = e
+        self.send(("reply", id, result, error, self.state()))
+
+    def send_task(self):
+        """Sends the events and new points to the client every PUMP_INTERVAL
+        ms. Sending from here means the DMC and scan threads never wait for
+        the client."""
+        self.sent_recipe = None  # ScanRecipe the client has
+        self.sent_results = None  # ScanResults the client has
+        sent = 0  # Number of its points the client has
+        while True:
+            time.sleep(PUMP_INTERVAL / 1000)
+            self.outbox = []
+            self.events.drain()
+            if self.conn is None:
+                continue
+
+            recipe = self.engine.recipe
+            if recipe is not self.sent_recipe:
+                self.sent_recipe = recipe
+                self.send(("recipe", recipe))
+            results = self.engine.results
+            if results is not self.sent_results:
+                self.sent_results = results
+                sent = 0
+                self.send(("results", results is not None))
+            if results is not None:
+                points = list(results.snapshot().points(sent))
+                for i in range(0, len(points), POINTS_BATCH):
+                    self.send(("points", sent + i, points[i : i + POINTS_BATCH]))
+                sent += len(points)
+
+            if len(self.outbox) > 0:
+                self.send(("events", self.outbox, self.state()))
+
+
+class RemoteInstruments:
+    """Connection of a client (the GUI) to the InstrumentServer.
+
+    It has proxies for the DMC, VNA and ScanEngine of the server, which can be
+    used in place of them. Events from the server are published to the events
+    (EventBus) of the client.
+
+    The connection is made in the background, so the GUI does not wait for the
+    server to start. Until then, the proxies have the state of a new server,
+    and calls wait for the connection. The tabs are told to update once the
+    actual state is known.
+
+    Typical usage example:
+        r = RemoteInstruments(bus)
+        r.dmc.home()
+        print(r.dmc.status)
+    """
+
+    def __init__(self, events, address=ADDRESS, dummy=False):
+        """Starts connecting to the server, starting it if it is not
+        running."""
+        self.events = events
+        self.conn = None
+        self.connected = threading.Event()  # Set once connecting is done
+        self.send_lock = threading.Lock()
+        self.ids = itertools.count()
+        self.replies = {}  # Reply to each call, by id
+        self.reply_ready = threading.Condition()
+        self.state = initial_state()
+        self.results = None  # Copy of the ScanResults of the server
+        self.recipe = None
+
+        self.dmc = RemoteDMC(self, "dmc")
+        self.vna = Proxy(self, "vna")
+        self.engine = RemoteEngine(self, "engine")
+
+        threading.Thread(target=lambda: self.connect_task(address, dummy), daemon=True).start()
+
+    def connect_task(self, address, dummy):
+        """Connects to the server and gets its state. This is blocking!"""
+        try:
+            conn = connect(address, dummy)
+        except OSError as e:
+            util.dprint("Could not connect to the instrument server: {}".format(e))
+            self.connected.set()
+            return
+        self.conn = conn
+        threading.Thread(target=self.receive_task, daemon=True).start()
+        self.connected.set()
+
+        self.call("engine", "check_ready")  # Get the state of the server
+        self.events.publish(Event.DMC_STATUS, self.dmc.status)
+        self.events.publish(Event.VNA_STATUS, self.vna.connected)
+        self.events.publish(Event.SCAN_UPDATE, self.engine.n)
+
+    def call(self, target, method, *args, **kwargs):
+        """Calls a method of a target on the server and returns the result
+        (or raises its exception). This is blocking!"""
+        self.connected.wait(START_TIMEOUT)
+        conn = self.conn
+        if conn is None:
+            raise ConnectionError("Not connected to the instrument server")
+        id = next(self.ids)
+        with self.send_lock:
+            conn.send(("call", id, target, method, args, kwargs))
+        with self.reply_ready:
+            while id not in self.replies:
+                if self.conn is None:
+                    raise ConnectionError("Lost connection to the instrument server")
+                self.reply_ready.wait()
+            result, error = self.replies.pop(id)
+        if error is not None:
+            raise error
+        return result
+
+    def receive_task(self):
+        """Receives messages from the server. This is blocking!"""
+        while True:
+            try:
+                msg = self.conn.recv()
+            except (OSError, EOFError):
+                break
+            kind = msg[0]
+            if kind == "reply":
+                self.state = msg[4]
+                with self.reply_ready:
+                    self.replies[msg[1]] = (msg[2], msg[3])
+                    self.reply_ready.notify_all()
+            elif kind == "events":
+                self.state = msg[2]
+                for event, payload in msg[1]:
+                    self.events.publish(event, payload)
+            elif kind == "recipe":
+                self.recipe = msg[1]
+            elif kind == "results":
+                self.results = ScanResults(self.recipe.spatial_sweep) if msg[1] else None
+                self.events.publish(Event.SCAN_UPDATE, 0)
+            elif kind == "points":
+                results = self.results
+                for grid_index, coord, meas in msg[2]:
+                    results.append(grid_index, coord, meas)
+                self.events.publish(Event.SCAN_UPDATE, results.count)
+
+        util.dprint("Lost connection to the instrument server")
+        with self.reply_ready:
+            self.conn = None
+            self.reply_ready.notify_all()
+
+    def close(self):
+        """Tells the server that the client is exiting (the server keeps
+        running if a scan is). The server then closes the connection."""
+        conn = self.conn
+        if conn is None:
+            return
+        try:
+            with self.send_lock:
+                conn.send(("close",))
+        except OSError:
+            pass
+
+
+class Proxy:
+    """Stands in for an object on the server.
+
+    Attributes in the state of the target are read from the last state sent by
+    the server, and the methods in METHODS are called on the server.
+    """
+
+    def __init__(self, remote, target):
+        self._remote = remote
+        self._target = target
+
+    def __getattr__(self, name):
+        state = self._remote.state[self._target]
+        if name in state:
+            return state[name]
+        if name not in METHODS[self._target]:
+            raise AttributeError("Remote {} has no attribute {}".format(self._target, name))
+        return lambda *args, **kwargs: self._remote.call(self._target, name, *args, **kwargs)
+
+
+class RemoteDMC(Proxy):
+    """Proxy of the DMC of the server."""
+
+    def get_position(self):
+        """Returns the last position (in cm) sent by the server."""
+        return self._remote.state["dmc"]["position"]
+
+    def clean_up(self):
+        """Nothing to do, the server keeps the DMC."""
+        pass
+
+
+class RemoteEngine(Proxy):
+    """Proxy of the ScanEngine of the server."""
+
+    @property
+    def recipe(self):
+        """Copy of the ScanRecipe of the server, or None."""
+        return self._remote.recipe
+
+    @property
+    def results(self):
+        """Copy of the ScanResults of the server."""
+        return self._remote.results
+
+    @property
+    def data(self):
+        """ScanSnapshot of the points received so far, or None."""
+        results = self._remote.results
+        return None if results is None else results.snapshot()
+
+    @property
+    def index(self):
+        """GridIndex of the points received so far, or None."""
+        results = self._remote.results
+        return None if results is None else results.index
+
+    def check_ready(self):
+        """Returns the last status sent by the server (which updates it
+        before sending it), without waiting for the server."""
+        return self.status
+
+    def get_coordinate(self, n):
+        """Returns the coordinate of the nth point of the scan."""
+        return self.recipe.spatial_sweep.get_coordinate(n)
+
+    def stop(self):
+        """Does nothing, so the scan goes on after the GUI exits."""
+        pass
+
+
+def initial_state():
+    """Returns the state of a server that has just started."""
+    return {
+        "dmc": {
+            "status": dmc.Status.DISCONNECTED,
+            "errors": {},
+            "stop_code": [],
+            "home_valid": False,
+            "position": None,
+        },
+        "vna": {"connected": False, "cal_ok": False, "cal_type": None},
+        "engine": {"status": Status.NOT_READY, "n": 0, "N": 0},
+    }
+
+
+def load_authkey():
+    """Returns the key that authenticates clients of this user, making a
+    random one (in a file only the user can read) the first time."""
+    filename = util.data_path(AUTHKEY_FILE)
+    try:
+        fd = os.open(filename, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        for i in range(100):  # Another process may still be writing it
+            with open(filename, "rb") as f:
+                key = f.read()
+            if len(key) == AUTHKEY_BYTES:
+                return key
+            time.sleep(0.01)
+        raise ValueError("Bad key in {}".format(filename))
+    key = secrets.token_bytes(AUTHKEY_BYTES)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def connect(address=ADDRESS, dummy=False):
+    """Returns a connection to the server, starting it if it is not running."""
+    authkey = load_authkey()
+    try:
+        return Client(address, authkey=authkey)
+    except ConnectionRefusedError:
+        pass
+
+    args = [sys.executable, __file__] + (["--dummy"] if dummy else [])
+    util.dprint("Starting instrument server")
+    subprocess.Popen(args)
+    deadline = time.time() + START_TIMEOUT
+    while True:
+        try:
+            return Client(address, authkey=authkey)
+        except ConnectionRefusedError:
+            if time.time() > deadline:
+                raise
+            time.sleep(0.1)
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Run the instrument server.")
+    parser.add_argument("--dummy", action="store_true", help="use dummy instruments")
+    parser.add_argument("-v", "--verbose", action="store_true", help="print debugging info")
+    args = parser.parse_args()
+    util.debug_messages = args.verbose
+    InstrumentServer(args.dummy).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
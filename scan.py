@@ -0,0 +1,775 @@
+"""Headless scan engine that controls the DMC and VNA to perform a measurement.
+
+The ScanEngine moves the DMC to each point of a SpatialSweepParams grid and
+measures the S-parameters with the VNA. It does not depend on the GUI, so a
+scan can be run from the GUI (MeasureTab is just one client), from a script,
+or from the command line with a scan recipe file:
+
+    python scan.py recipe.json
+
+The recipe file is JSON, e.g.:
+    {
+        "spatial": [[1, 37, 18], [2, 38, 18], [0, 0, 1]],
+        "sweep": {"start": 20e9, "stop": 30e9, "points": 801, "power": -10,
+                  "averaging": 1, "sparams": ["S21"]},
+        "speed": 1.0,
+        "settle": "None",
+        "output": "scan.csv",
+        "dmc": "COM4",
+        "vna": 16,
+        "journal": "scan.nfj",
+        "store": "scan.nfs",
+        "parquet": "scan.parquet",
+        "encoding": "complex64",
+        "compression": null
+    }
+
+Each measured point is appended to the journal file (see journal.py) as soon
+as it is measured. If the scan is interrupted, it can be resumed with:
+
+    python scan.py --resume scan.nfj
+
+The results are also filled into a dense, memory-mapped data cube in the store
+directory (see store.py), and streamed into a Parquet file (see columnar.py),
+if they are given. The store keeps complex64 values, or scaled int16 I/Q with
+"encoding": "int16", and is packed with a lossless compressor (e.g. "zstd")
+when the scan is done if "compression" is given.
+"""
+
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+from collections.abc import Mapping
+from enum import Enum
+
+import numpy as np
+
+import util
+import DMC as dmc
+import vna
+import export
+import journal
+import store
+from journal import ScanJournal
+from store import ScanCube
+import columnar
+from columnar import ScanTable
+from settle import Settler, SettleMode
+from events import Event
+
+MOVE_TIMEOUT = 180  # How long to wait for a move before giving up in seconds
+MOVE_RETRIES = 3  # Retry a move this many times if the DMC recovers
+CONNECT_TIMEOUT = 30  # How long to wait for the DMC to connect in seconds
+HOMING_TIMEOUT = 600  # How long to wait for homing in seconds
+SWEEP_TIMEOUT = 60  # How long to wait for each (averaged) VNA sweep in seconds
+DEFAULT_VNA_ADDRESS = 16  # Default GPIB address for VNA
+
+
+class Status(Enum):
+    """Represents the status of a measurement."""
+
+    NOT_READY = 0  # Needs further configuration
+    READY = 1
+    MEASURING = 2  # Measurement started
+    PAUSED = 3  # User paused the measurement
+    STOPPED = 4  # User stopped the measurement
+    DONE = 5  # Meausrement is done
+    ERROR = 6
+
+
+class ScanRecipe:
+    """Everything needed to run a scan: where, what to measure, and how."""
+
+    def __init__(
+        self,
+        spatial_sweep,
+        freq_sweep,
+        speed=dmc.MIN_SPEED,
+        settle=SettleMode.NONE,
+        output=None,
+        dmc_address=dmc.DEFAULT_IP,
+        vna_address=DEFAULT_VNA_ADDRESS,
+        journal=None,
+        store=None,
+        parquet=None,
+        encoding="complex64",
+        compression=None,
+    ):
+        """Init recipe.
+
+        Args:
+            spatial_sweep (SpatialSweepParams): grid of points to measure
+            freq_sweep (FreqSweepParams): what to measure at each point
+            speed (float): speed of the moves in cm/sec
+            settle (SettleMode): how to wait for the frame to settle
+            output (str): file to export the results to (or None)
+            dmc_address (str): IP address or COM port of the DMC
+            vna_address (int): GPIB address of the VNA
+            journal (str): file to journal the measured points to (or None)
+            store (str): directory to store the data cube in (or None)
+            parquet (str): Parquet file to stream the results to (or None)
+            encoding (str): how the store keeps the values (see store.ENCODINGS)
+            compression (str): compressor to pack the store with when the scan
+            is done (see store.COMPRESSORS), or None
+        """
+        assert isinstance(spatial_sweep, dmc.SpatialSweepParams)
+        assert isinstance(freq_sweep, vna.FreqSweepParams)
+        assert isinstance(settle, SettleMode)
+        self.spatial_sweep = spatial_sweep
+        self.freq_sweep = freq_sweep
+        self.speed = speed
+        self.settle = settle
+        self.output = output
+        self.dmc_address = dmc_address
+        self.vna_address = vna_address
+        self.journal = journal
+        self.store = store
+        self.parquet = parquet
+        self.encoding = encoding
+        self.compression = compression
+
+    @staticmethod
+    def from_dict(d):
+        """Returns a ScanRecipe from a dict (e.g. read from JSON)."""
+        sw = d["sweep"]
+        averaging = int(sw.get("averaging", vna.AVERAGING_MIN))
+        sparams = [vna.SParam(sp) for sp in sw["sparams"]]
+        if sw.get("segments") is not None:
+            freq_sweep = vna.FreqSweepParams.from_segments(
+                sw["segments"], float(sw["power"]), averaging, sparams
+            )
+            if "points" in sw and int(sw["points"]) != freq_sweep.points:
+                raise ValueError("The points of the sweep do not add up to those of its segments")
+        else:
+            freq_sweep = vna.FreqSweepParams(
+                float(sw["start"]),
+                float(sw["stop"]),
+                int(sw["points"]),
+                float(sw["power"]),
+                averaging,
+                sparams,
+            )
+        return ScanRecipe(
+            dmc.SpatialSweepParams([list(p) for p in d["spatial"]]),
+            freq_sweep,
+            float(d.get("speed", dmc.MIN_SPEED)),
+            SettleMode(d.get("settle", SettleMode.NONE.value)),
+            d.get("output"),
+            d.get("dmc", dmc.DEFAULT_IP),
+            int(d.get("vna", DEFAULT_VNA_ADDRESS)),
+            d.get("journal"),
+            d.get("store"),
+            d.get("parquet"),
+            d.get("encoding", "complex64"),
+            d.get("compression"),
+        )
+
+    def to_dict(self):
+        """Returns the recipe as a dict that can be written as JSON."""
+        fs = self.freq_sweep
+        return {
+            "spatial": self.spatial_sweep.params,
+            "sweep": {
+                "start": fs.start,
+                "stop": fs.stop,
+                "points": fs.points,
+                "power": fs.power,
+                "averaging": fs.averaging,
+                "sparams": [sp.value for sp in fs.sparams],
+                "segments": fs.segments,
+            },
+            "speed": self.speed,
+            "settle": self.settle.value,
+            "output": self.output,
+            "dmc": self.dmc_address,
+            "vna": self.vna_address,
+            "journal": self.journal,
+            "store": self.store,
+            "parquet": self.parquet,
+            "encoding": self.encoding,
+            "compression": self.compression,
+        }
+
+    @staticmethod
+    def load(filename):
+        """Reads a ScanRecipe from a JSON file."""
+        with open(filename) as f:
+            return ScanRecipe.from_dict(json.load(f))
+
+    def save(self, filename):
+        """Writes the recipe to a JSON file."""
+        with open(filename, "w") as f:
+            json.dump(self.to_dict(), f, indent=4)
+
+    def validation_messages(self):
+        """Checks if the recipe is valid and returns a list of errors (strings)
+        if not.
+
+        Returns None if valid.
+        """
+        errors = self.freq_sweep.validation_messages(check_sparams=True) or []
+        if self.speed < dmc.MIN_SPEED or self.speed > dmc.MAX_SPEED:
+            errors.append(
+                "Speed should be between {} cm/s and {} cm/s".format(
+                    dmc.MIN_SPEED, dmc.MAX_SPEED
+                )
+            )
+        if self.parquet is not None and not columnar.available():
+            errors.append("pyarrow is needed to write Parquet files")
+        if self.encoding not in store.ENCODINGS:
+            errors.append("Encoding should be one of " + ", ".join(store.ENCODINGS))
+        if self.compression is not None:
+            if self.compression not in store.COMPRESSORS:
+                errors.append("Compression should be one of " + ", ".join(store.COMPRESSORS))
+            elif not store.compressor_available(self.compression):
+                errors.append("Compressor {} is not installed".format(self.compression))
+        if len(errors) > 0:
+            return errors
+        else:
+            return None
+
+
+class GridIndex:
+    """Index of the points of a scan that have been measured, by their
+    position on the grid.
+
+    It is updated as each point is measured, and finding a point or the
+    coordinates measured along an axis takes the same time however many points
+    have been measured.
+    """
+
+    def __init__(self, spatial_sweep):
+        """Init with an empty index of the grid of spatial_sweep
+        (SpatialSweepParams)."""
+        self.params = spatial_sweep.params
+        self.axes = spatial_sweep.get_axes()
+        self.measured = [np.zeros(len(a), dtype=bool) for a in self.axes]
+        self.points = {}  # Coordinate (key of the data) at each grid index
+        self.version = 0  # Changes when a coordinate is measured for the first time
+
+    def add(self, index, coord):
+        """Adds the point at grid index [ix, iy, iz] with coordinate coord."""
+        self.points[tuple(index)] = tuple(coord)
+        for measured, i in zip(self.measured, index):
+            if not measured[i]:
+                measured[i] = True
+                self.version += 1
+
+    def values(self, axis):
+        """Returns the coordinates that have been measured along axis (0 to 2)."""
+        return self.axes[axis][self.measured[axis]]
+
+    def nearest(self, axis, value):
+        """Returns the index of the grid point nearest to value along axis."""
+        start, stop, points = self.params[axis]
+        if points == 1:
+            return 0
+        i = int(round((value - start) / (stop - start) * (points - 1)))
+        return min(max(i, 0), points - 1)
+
+    def lookup(self, coord):
+        """Returns the coordinate (key of the data) of the measured point
+        nearest to coord, or None if it has not been measured."""
+        return self.points.get(tuple(self.nearest(i, c) for i, c in enumerate(coord)))
+
+
+class ScanResults:
+    """The points measured in a scan, in the order they were measured.
+
+    The results are written by the scan thread only, and read from any thread
+    through snapshots, without locks. The lists are only ever appended to, and
+    a point is published by incrementing count once all of it has been stored,
+    so the first count points of a snapshot never change. A point that is
+    measured again (e.g. after resuming) replaces its list of MeasData as a
+    whole.
+    """
+
+    def __init__(self, spatial_sweep):
+        """Init with no points of a scan over spatial_sweep
+        (SpatialSweepParams)."""
+        self.index = GridIndex(spatial_sweep)
+        self.grid = []  # Grid index of each point
+        self.coords = []  # Coordinate of each point
+        self.meas = []  # List of MeasData of each point
+        self.positions = {}  # Position of each coordinate in the lists
+        self.count = 0  # Number of points that have been published
+
+    def append(self, grid_index, coord, meas):
+        """Adds (or replaces) the point at grid_index, with coordinate coord
+        and a list of MeasData. Only the scan thread may call this."""
+        coord = tuple(coord)
+        position = self.positions.get(coord)
+        if position is not None:
+            self.meas[position] = meas
+            return
+        self.grid.append(tuple(grid_index))
+        self.coords.append(coord)
+        self.meas.append(meas)
+        self.positions[coord] = len(self.coords) - 1
+        self.index.add(grid_index, coord)
+        self.count += 1  # Publish the point
+
+    def snapshot(self):
+        """Returns a ScanSnapshot of the points measured so far."""
+        return ScanSnapshot(self, self.count)
+
+
+class ScanSnapshot(Mapping):
+    """A read only view of the first points of ScanResults.
+
+    It is a dict-like mapping where the key is the coordinate and the value is
+    a list of MeasData, in the order measured. Nothing is copied, and points
+    measured after the snapshot was taken are not part of it, so the snapshot
+    can be read (e.g. exported) while the scan goes on.
+    """
+
+    def __init__(self, results, count):
+        """Init with the first count points of results (ScanResults)."""
+        self.results = results
+        self.count = count
+
+    @property
+    def index(self):
+        """GridIndex of the scan. It may include points measured after the
+        snapshot was taken, which are not in the snapshot."""
+        return self.results.index
+
+    def __getitem__(self, coord):
+        position = self.results.positions.get(coord)
+        if position is None or position >= self.count:
+            raise KeyError(coord)
+        return self.results.meas[position]
+
+    def __iter__(self):
+        return itertools.islice(self.results.coords, self.count)
+
+    def __len__(self):
+        return self.count
+
+    def points(self, start=0):
+        """Yields the grid index, coordinate and list of MeasData of each
+        point from position start onwards (e.g. the points that are new since
+        an earlier snapshot)."""
+        r = self.results
+        for i in range(start, self.count):
+            yield r.grid[i], r.coords[i], r.meas[i]
+
+
+class ScanEngine:
+    """Runs a scan with a DMC and VNA, without any GUI.
+
+    The scan runs on its own thread after start(), or blocking with run().
+    Clients can follow the progress with status, n and N, and the results are
+    in results (ScanResults). The data property is a snapshot of the results
+    so far, a dict-like ScanSnapshot where the key is the coordinate and the
+    value is a list of MeasData, and index has the points by grid position.
+    Whenever something changes, the optional on_update callback is called (from
+    the scan thread), and Event.SCAN_UPDATE is published to the optional
+    EventBus.
+
+    Typical usage example:
+        e = ScanEngine(d, v)
+        e.configure(recipe)
+        e.start()
+    """
+
+    def __init__(self, dmc_obj, vna_obj, on_update=None, events=None):
+        """Init engine using the given DMC and VNA objects."""
+        self.dmc = dmc_obj
+        self.vna = vna_obj
+        self.on_update = on_update
+        self.events = events
+        self.status = Status.NOT_READY
+        self.recipe = None
+        self.settler = Settler()
+        self.results = None  # ScanResults, appended to by the scan thread
+        self.n = 0  # Index of the next point to measure
+        self.N = 0  # Total number of points
+        self.task = None
+        self.journal = None
+        self.cube = None
+        self.table = None
+
+    def _notify(self):
+        """Lets the client know that something changed."""
+        if self.on_update is not None:
+            self.on_update()
+        if self.events is not None:
+            self.events.publish(Event.SCAN_UPDATE, self.n)
+
+    @property
+    def data(self):
+        """ScanSnapshot of the points measured so far, or None."""
+        results = self.results
+        return None if results is None else results.snapshot()
+
+    @property
+    def index(self):
+        """GridIndex of the points measured so far, or None."""
+        results = self.results
+        return None if results is None else results.index
+
+    def check_ready(self):
+        """Updates the status depending on if the DMC and VNA are ready.
+
+        Returns the status.
+        """
+        if self.dmc.status == dmc.Status.STOP and self.vna.connected:
+            if self.status == Status.NOT_READY:
+                self.status = Status.READY
+        else:
+            if self.status not in [Status.MEASURING, Status.PAUSED, Status.ERROR]:
+                self.status = Status.NOT_READY
+        return self.status
+
+    def recover(self):
+        """Leaves the ERROR status once the client has dealt with the error.
+
+        The scan is paused if some points have been measured, so it can be
+        resumed after homing. Returns the new status.
+        """
+        if self.status == Status.ERROR:
+            if self.results is not None and self.n > 0:
+                self.status = Status.PAUSED
+            else:
+                self.status = Status.NOT_READY
+            self._notify()
+        return self.status
+
+    def configure(self, recipe):
+        """Sets the ScanRecipe for the next scan (or for resuming a scan)."""
+        assert isinstance(recipe, ScanRecipe)
+        self.recipe = recipe
+        self.settler.mode = recipe.settle
+        self.N = recipe.spatial_sweep.get_num_points()
+
+    def get_coordinate(self, n):
+        """Returns the coordinate of the nth point of the scan."""
+        return self.recipe.spatial_sweep.get_coordinate(n)
+
+    def resume(self, filename):
+        """Rebuilds the state of an interrupted scan from its journal.
+
+        The scan is then paused, and start() or run() continues from the first
+        unmeasured point.
+        """
+        self.close_files()
+        self.journal, recipe, points = ScanJournal.resume(filename)
+        recipe = ScanRecipe.from_dict(recipe)
+        recipe.journal = filename
+        self.configure(recipe)
+
+        results = ScanResults(recipe.spatial_sweep)
+        for n in sorted(points):
+            coord, sweeps = points[n]
+            meas = [
+                vna.MeasData(recipe.freq_sweep.for_sparams([sp]), freq, mag, phase)
+                for sp, freq, mag, phase in sweeps
+            ]
+            results.append(recipe.spatial_sweep.get_index(n), coord, meas)
+        self.results = results
+        data = results.snapshot()
+        self.n = journal.first_unmeasured(points, self.N)
+
+        # Points may not have been flushed to the store before the crash, and
+        # a Parquet file that was not closed cannot be read, so it is rewritten
+        self.open_store()
+        if self.cube is not None:
+            for n, (coord, sweeps) in points.items():
+                index = recipe.spatial_sweep.get_index(n)
+                self.cube.set_point(index, data[tuple(coord)])
+            self.cube.flush()
+        self.open_table()
+        if self.table is not None:
+            for n in sorted(points):
+                coord = points[n][0]
+                self.table.append(n, coord, data[tuple(coord)])
+
+        self.status = Status.PAUSED
+        util.dprint("Resuming {} from point {}".format(filename, self.n))
+        self._notify()
+
+    def close_files(self):
+        """Closes the journal, store and Parquet file (if there are any)."""
+        if self.journal is not None:
+            self.journal.close()
+            self.journal = None
+        if self.cube is not None:
+            self.cube.close()
+            self.cube = None
+        if self.table is not None:
+            self.table.close()
+            self.table = None
+
+    def open_store(self, fresh=False):
+        """Opens the data cube of the recipe, if it has one, to resume the
+        scan, or creates it (replacing any earlier store) if fresh."""
+        if self.cube is None and self.recipe.store is not None:
+            args = [self.recipe.store, self.recipe.spatial_sweep, self.recipe.freq_sweep]
+            if fresh:
+                self.cube = ScanCube.create(*args, encoding=self.recipe.encoding)
+            else:
+                self.cube = ScanCube.open_or_create(*args, self.recipe.encoding)
+
+    def open_table(self):
+        """Creates the Parquet file of the recipe, if it has one."""
+        if self.table is None and self.recipe.parquet is not None:
+            self.table = ScanTable(self.recipe.parquet, self.recipe.spatial_sweep)
+
+    def start(self):
+        """Starts (or resumes after pausing) the scan on another thread.
+
+        Raises ValueError if the sweep cannot be measured with the calibration
+        of the VNA.
+        """
+        msgs = self.vna.calibration_messages(self.recipe.freq_sweep)
+        if len(msgs) > 0:
+            raise ValueError("\n".join(msgs))
+        if self.status == Status.READY:
+            self.results = ScanResults(self.recipe.spatial_sweep)
+            self.n = 0
+        elif self.status != Status.PAUSED:
+            raise Exception("Begin measurement in bad state")
+
+        self.status = Status.MEASURING
+        self._notify()
+        self.task = threading.Thread(target=self.run)
+        self.task.start()
+
+    def pause(self):
+        """Pauses the scan after the current point."""
+        self.status = Status.PAUSED
+        self._notify()
+
+    def reset(self):
+        """Discards the results after pausing or completing a scan."""
+        self.close_files()
+        self.status = Status.READY
+        self.results = None
+        self.n = 0
+        self._notify()
+
+    def stop(self):
+        """Ends the scan thread (if it is running) and waits for it."""
+        if self.status == Status.MEASURING:
+            self.status = Status.STOPPED
+        if self.task is not None:
+            task = self.task
+            self.task = None
+            if task is not threading.current_thread():
+                task.join()
+
+    def run(self):
+        """Performs the scan from point n onwards. This is blocking!"""
+        assert isinstance(self.recipe, ScanRecipe)
+
+        util.dprint("Started measurement task {}".format(threading.current_thread()))
+        if self.results is None:
+            self.results = ScanResults(self.recipe.spatial_sweep)
+        # Kept even if the engine is reset while the last point is measured
+        results = self.results
+        if self.journal is None and self.recipe.journal is not None:
+            self.journal = ScanJournal.create(self.recipe.journal, self.recipe.to_dict())
+        self.open_store(fresh=self.n == 0)
+        self.open_table()
+        self.status = Status.MEASURING
+        freq_sweep = self.recipe.freq_sweep
+        self._notify()
+
+        while self.n < self.N:
+            # Move DMC to the next point
+            p = self.get_coordinate(self.n)
+            util.dprint("Move to {}".format(p))
+
+            speed = self.recipe.speed
+            start = self.dmc.get_position()
+            self.dmc.set_speed(speed)
+            if not self.move_to(p):
+                if self.dmc.status != dmc.Status.DISCONNECTED:
+                    self.dmc.disable_motors()
+                self.fail()
+                return
+
+            self.settler.wait(start, p, speed, lambda: self.vna.probe(freq_sweep))
+            sp = self.vna.measure_all(freq_sweep, SWEEP_TIMEOUT * freq_sweep.averaging)
+            if sp is None:
+                util.dprint("VNA sweep at {} did not finish".format(p))
+                self.fail()
+                return
+
+            results.append(self.recipe.spatial_sweep.get_index(self.n), p, sp)
+            if self.journal is not None:
+                self.journal.append(self.n, p, sp)
+            if self.cube is not None:
+                self.cube.set_point(self.recipe.spatial_sweep.get_index(self.n), sp)
+            if self.table is not None:
+                self.table.append(self.n, p, sp)
+            self.n += 1  # The point is stored, so it is not measured again
+
+            if self.status != Status.MEASURING:
+                self.sync_files()
+                self._notify()
+                util.dprint("Ending measurement task {}".format(threading.current_thread()))
+                return
+
+            self._notify()
+
+        self.settler.model.save()
+        if self.cube is not None and self.recipe.compression is not None:
+            ratio = self.cube.pack(self.recipe.compression)
+            util.dprint("Packed store to {:.1%} of its size".format(ratio))
+        self.close_files()
+        self.status = Status.DONE
+        self._notify()
+        util.dprint("Done measuring")
+
+    def fail(self):
+        """Ends the measurement task with an error (the scan can be resumed
+        from the current point)."""
+        self.status = Status.ERROR
+        self.sync_files()
+        self._notify()
+        util.dprint("Ending measurement task {}".format(threading.current_thread()))
+
+    def sync_files(self):
+        """Makes sure the journal and store are on disk (if there are any)."""
+        if self.journal is not None:
+            self.journal.sync()
+        if self.cube is not None:
+            self.cube.flush()
+
+    def move_to(self, p):
+        """Moves the DMC to p, retrying if the connection to the DMC was
+        recovered during the move. Returns True if successful.
+
+        This is blocking!
+        """
+        for i in range(MOVE_RETRIES):
+            recoveries = self.dmc.recoveries
+            if self.dmc.move_absolute_blocking(p, MOVE_TIMEOUT):
+                return True
+            if self.dmc.recoveries == recoveries or self.dmc.status != dmc.Status.STOP:
+                return False
+            util.dprint("Retrying move to {} after DMC recovery".format(p))
+        return False
+
+
+def wait_for_status(dmc_obj, status, timeout):
+    """Waits until the DMC reaches status. Returns False if it times out."""
+    t0 = time.time()
+    while dmc_obj.status != status:
+        if time.time() - t0 > timeout or len(dmc_obj.errors) > 0:
+            return False
+        time.sleep(dmc.RETRY_SLEEP)
+    return True
+
+
+def run_recipe(recipe, dummy=False, resume=None):
+    """Connects to the instruments, homes the DMC, runs the scan in recipe and
+    exports the results. This is blocking!
+
+    If resume is the filename of a journal, the scan in the journal is
+    continued instead, from the first unmeasured point.
+
+    Returns the ScanEngine used for the scan.
+    """
+    msgs = recipe.validation_messages()
+    if msgs is not None:
+        raise ValueError("Invalid recipe:\n" + "\n".join(msgs))
+
+    d = dmc.DMC(dummy)
+    v = vna.VNA(dummy)
+    engine = ScanEngine(d, v)
+    try:
+        v.connect(recipe.vna_address)
+        if not v.connected:
+            raise vna.VNAError("Could not connect to VNA")
+        msgs = v.calibration_messages(recipe.freq_sweep)
+        if len(msgs) > 0:
+            raise ValueError("\n".join(msgs))
+
+        d.connect(recipe.dmc_address)
+        if not wait_for_status(d, dmc.Status.MOTORS_DISABLED, CONNECT_TIMEOUT):
+            raise Exception("Could not connect to DMC")
+        d.home()
+        if not wait_for_status(d, dmc.Status.STOP, HOMING_TIMEOUT):
+            raise Exception("Homing failed")
+
+        if resume is not None:
+            engine.resume(resume)
+            engine.recipe.output = recipe.output
+        else:
+            engine.configure(recipe)
+            engine.check_ready()
+        engine.run()
+
+        if engine.status != Status.DONE:
+            raise Exception("Measurement failed at point {}".format(engine.n))
+        if recipe.output is not None and recipe.output.lower().endswith(".zip"):
+            export.write_touchstone(engine.data, recipe.output)
+        elif recipe.output is not None:
+            export.write_csv(engine.data, recipe.output)
+    finally:
+        engine.close_files()
+        d.clean_up()
+        v.disconnect()
+    return engine
+
+
+def main():
+    """Command line entry point."""
+    parser = argparse.ArgumentParser(description="Run a near field scan.")
+    parser.add_argument("recipe", nargs="?", help="scan recipe file (JSON)")
+    parser.add_argument("-o", "--output", help="export results to this file (CSV, or Touchstone if .zip)")
+    parser.add_argument("-j", "--journal", help="journal points to this file")
+    parser.add_argument("--resume", help="resume the scan in this journal")
+    parser.add_argument("-s", "--store", help="store the data cube in this directory")
+    parser.add_argument("-p", "--parquet", help="stream the results to this Parquet file")
+    parser.add_argument("--encoding", choices=store.ENCODINGS, help="how the store keeps values")
+    parser.add_argument(
+        "--compress", choices=store.COMPRESSORS, help="pack the store when done"
+    )
+    parser.add_argument("--dmc", help="IP address or COM port of the DMC")
+    parser.add_argument("--vna", type=int, help="GPIB address of the VNA")
+    parser.add_argument(
+        "--dummy", action="store_true", help="use dummy instruments for testing"
+    )
+    parser.add_argument("-v", "--verbose", action="store_true", help="debug output")
+    args = parser.parse_args()
+
+    util.debug_messages = args.verbose
+    if args.resume is not None:
+        recipe = ScanRecipe.from_dict(ScanJournal.read(args.resume)[0])
+    elif args.recipe is not None:
+        recipe = ScanRecipe.load(args.recipe)
+    else:
+        parser.error("either a recipe or --resume is required")
+
+    if args.journal is not None:
+        recipe.journal = args.journal
+    if args.store is not None:
+        recipe.store = args.store
+    if args.parquet is not None:
+        recipe.parquet = args.parquet
+    if args.encoding is not None:
+        recipe.encoding = args.encoding
+    if args.compress is not None:
+        recipe.compression = args.compress
+    if args.output is not None:
+        recipe.output = args.output
+    if recipe.journal is None and recipe.output is not None:
+        recipe.journal = os.path.splitext(recipe.output)[0] + journal.EXTENSION
+    if args.dmc is not None:
+        recipe.dmc_address = args.dmc
+    if args.vna is not None:
+        recipe.vna_address = args.vna
+
+    engine = run_recipe(recipe, args.dummy, args.resume)
+    print("Measured {} points".format(engine.n))
+
+
+if __name__ == "__main__":
+    main()
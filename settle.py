@@ -0,0 +1,166 @@
+"""Adaptive settling of the CNC frame after a move, before a sweep is triggered.
+
+After a move, the frame vibrates for a while, and this is worse at higher
+speeds. Rather than always running at low speed, the measurement waits for the
+frame to settle. This can either be done with a model of how long each type of
+move takes to settle (based on the move length and speed), or by taking quick
+VNA probes with few points until S21 is stable. The settle times found with
+probes are learned for each type of move, so later moves of the same type can
+start probing (or sweep, if using the model) at the right time.
+"""
+
+import json
+import math
+import time
+from enum import Enum
+
+import numpy as np
+
+import util
+
+SETTLE_BASE = 0.05  # Settle time of a slow move in seconds
+SETTLE_PER_SPEED = 0.1  # Additional settle time per cm/sec of speed
+SETTLE_MAX = 5  # Never wait longer than this to settle in seconds
+SETTLE_TOLERANCE_DB = 0.05  # Maximum change in magnitude between probes
+SETTLE_TOLERANCE_DEG = 0.5  # Maximum change in phase between probes
+SETTLE_STABLE_PROBES = 2  # Number of consecutive probes within tolerance
+PROBE_HEADSTART = 0.8  # Start probing at this fraction of predicted time
+LEARNING_RATE = 0.3  # Weight of a new settle time in the learned average
+MIN_MOVE = 1e-3  # Moves shorter than this (in cm) are ignored
+SETTLE_FILE = "settle.json"  # File in util.DATA_DIR with the learned settle times
+
+
+class SettleMode(Enum):
+    """How to wait for the frame to settle after a move."""
+
+    NONE = "None"  # Sweep immediately
+    MODEL = "Model"  # Wait for the predicted settle time
+    PROBE = "Probe"  # Probe with the VNA until S21 is stable
+
+
+class SettleModel:
+    """Predicts how long it takes to settle after a move.
+
+    Until a type of move has been learned, the settle time is predicted from
+    the speed of the move.
+    """
+
+    def __init__(self):
+        """Init with the settle times learned previously, if there are any."""
+        self.times = {}
+        try:
+            with open(util.data_path(SETTLE_FILE)) as f:
+                self.times = json.load(f)
+        except (OSError, ValueError):
+            pass
+
+    @staticmethod
+    def move_type(start, stop, speed):
+        """Returns a key for the type of move from start to stop at speed.
+
+        The key is made of which axes move, the length of the move rounded to
+        a power of 2, and the speed.
+        """
+        delta = [abs(b - a) for a, b in zip(start, stop)]
+        axes = "".join(["XYZ"[i] for i, d in enumerate(delta) if d > MIN_MOVE])
+        length = max(delta)
+        if length <= MIN_MOVE:
+            return "none"
+        return "{}:{:d}:{:.1f}".format(axes, math.ceil(math.log2(length)), speed)
+
+    def predict(self, move_type, speed):
+        """Returns the predicted settle time in seconds."""
+        if move_type == "none":
+            return 0
+        if move_type in self.times:
+            return self.times[move_type]
+        return SETTLE_BASE + SETTLE_PER_SPEED * speed
+
+    def learn(self, move_type, settle_time):
+        """Updates the settle time of move_type with a new measurement."""
+        if move_type in self.times:
+            old = self.times[move_type]
+            settle_time = old + LEARNING_RATE * (settle_time - old)
+        self.times[move_type] = settle_time
+
+    def save(self):
+        """Stores the learned settle times."""
+        try:
+            with open(util.data_path(SETTLE_FILE), "w") as f:
+                json.dump(self.times, f)
+        except OSError:
+            util.dprint("Could not store settle times")
+
+
+class Settler:
+    """Waits for the frame to settle after each move.
+
+    Typical usage example:
+        s = Settler(SettleMode.PROBE)
+        d.move_absolute_blocking(p, 180)
+        s.wait(previous_p, p, speed, lambda: v.probe(sweep_params))
+    """
+
+    def __init__(self, mode=SettleMode.NONE):
+        """Init with the given SettleMode."""
+        assert isinstance(mode, SettleMode)
+        self.mode = mode
+        self.model = SettleModel()
+
+    def wait(self, start, stop, speed, probe):
+        """Waits for the frame to settle after moving from start to stop.
+
+        Args:
+            start, stop (list): coordinates before and after the move in cm
+            speed (float): speed of the move in cm/sec
+            probe (callable): returns a complex numpy array with a quick S21
+            measurement (only used with SettleMode.PROBE)
+
+        Returns how long it waited in seconds.
+        """
+        if self.mode == SettleMode.NONE or start is None:
+            return 0
+
+        t0 = time.time()
+        move_type = SettleModel.move_type(start, stop, speed)
+        predicted = min(self.model.predict(move_type, speed), SETTLE_MAX)
+
+        if self.mode == SettleMode.MODEL or move_type == "none":
+            time.sleep(predicted)
+            return predicted
+
+        time.sleep(predicted * PROBE_HEADSTART)
+        t_previous = time.time() - t0  # When the previous probe was taken
+        previous = probe()
+        settled = None  # Time when the probes started being stable
+        stable = 0
+
+        while time.time() - t0 < SETTLE_MAX:
+            t = time.time() - t0
+            current = probe()
+            if self.stable(previous, current):
+                if stable == 0:
+                    settled = t_previous  # It was already stable then
+                stable += 1
+                if stable >= SETTLE_STABLE_PROBES:
+                    break
+            else:
+                stable = 0
+            previous, t_previous = current, t
+        else:
+            util.dprint("Did not settle within {} s".format(SETTLE_MAX))
+            settled = SETTLE_MAX
+
+        self.model.learn(move_type, settled)
+        util.dprint("Settled after {:.3f} s ({})".format(settled, move_type))
+        return time.time() - t0
+
+    @staticmethod
+    def stable(previous, current):
+        """Checks if two complex S21 probes are equal within tolerance."""
+        if previous is None or current is None or len(previous) != len(current):
+            return False
+        ratio = current / previous
+        mag = np.abs(20 * np.log10(np.abs(ratio)))
+        phase = np.abs(np.angle(ratio, deg=True))
+        return np.max(mag) <= SETTLE_TOLERANCE_DB and np.max(phase) <= SETTLE_TOLERANCE_DEG
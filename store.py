@@ -0,0 +1,525 @@
+"""Dense, memory-mapped storage of the data of a scan.
+
+A scan is stored as a directory with a data cube of complex S-parameters,
+shaped [nz, ny, nx, nsparam, nfreq], along with a single frequency axis that is
+shared by all points, and metadata describing the scan:
+
+    meta.json   - grid axes, S-parameters, sweep parameters
+    data.npy    - complex64 data cube (memory mapped)
+    filled.npy  - bool array [nz, ny, nx] of which points are measured
+    freq.npy    - frequency axis in Hz (not uniform for list frequency sweeps)
+
+The .npy files are memory mapped, so the cube is filled in place by grid index
+as the scan runs, and only the parts of it that are used are ever in memory.
+Since the spatial axes come first, the S-parameters of a point (and of a line
+along X) are contiguous on disk.
+
+To make large scans smaller, the cube can use the "int16" encoding instead of
+"complex64": I and Q are stored as int16, scaled by a factor for each trace
+(scale.npy, [nz, ny, nx, nsparam]), which halves the size with an error of at
+most 1/65534 of the peak of each trace (about -96 dB). A complete scan can also
+be packed with a lossless compressor (zstd or blosc if installed, otherwise
+zlib), which replaces data.npy with one compressed chunk per scan line along X:
+
+    data.chunks - compressed chunks, in the order of [nz, ny]
+    chunks.npy  - offset of each chunk in data.chunks (and the end)
+
+Packed stores are read only, and chunks are decompressed when they are read.
+
+Other processes (e.g. viewers or analysis) can open the store read only while
+the scan is still filling it. The memory maps share the same pages, so new
+points can be seen without copying or serializing them, using a small header:
+
+    header.npy  - int64 [sequence, count]
+    order.npy   - flat grid index of each point, in the order measured
+
+The writer makes the sequence odd while it writes a point, and even again once
+it is done, so a reader that sees the same even sequence before and after
+reading has a consistent view (see read_consistent). The first count entries
+of order are the points that have been measured (see new_points).
+"""
+
+import json
+import os
+import time
+import zlib
+
+import numpy as np
+
+import util
+import vna
+
+VERSION = 1
+META_FILE = "meta.json"
+DATA_FILE = "data.npy"
+FILLED_FILE = "filled.npy"
+FREQ_FILE = "freq.npy"
+SCALE_FILE = "scale.npy"
+CHUNKS_FILE = "data.chunks"
+OFFSETS_FILE = "chunks.npy"
+HEADER_FILE = "header.npy"
+ORDER_FILE = "order.npy"
+SEQUENCE = 0  # Index of the sequence counter in the header
+COUNT = 1  # Index of the number of measured points in the header
+EXTENSION = ".nfs"  # Extension for scan store directories
+DTYPE = np.complex64
+ENCODINGS = ["complex64", "int16"]  # Ways of storing the complex values
+INT16_MAX = 32767  # Full scale of the int16 encoding
+COMPRESSORS = ["zstd", "blosc", "zlib"]  # Lossless compressors for packing
+COMPRESSION_LEVEL = 3
+CONSISTENT_TIMEOUT = 1.0  # Longest wait for a point to be written in s
+
+
+def to_complex(mag, phase):
+    """Converts magnitude in dB and phase in degrees to complex values."""
+    return 10 ** (np.asarray(mag) / 20) * np.exp(1j * np.deg2rad(phase))
+
+
+def to_mag_phase(values):
+    """Converts complex values to magnitude in dB and phase in degrees."""
+    values = np.asarray(values)
+    with np.errstate(divide="ignore"):
+        mag = 20 * np.log10(np.abs(values))
+    return mag, np.angle(values, deg=True)
+
+
+def get_compressor(name):
+    """Returns the compress and decompress functions of a compressor.
+
+    Raises ImportError if the module it needs is not installed.
+    """
+    if name == "zstd":
+        import zstandard
+
+        return (
+            zstandard.ZstdCompressor(level=COMPRESSION_LEVEL).compress,
+            zstandard.ZstdDecompressor().decompress,
+        )
+    elif name == "blosc":
+        import blosc
+
+        return (
+            lambda b: blosc.compress(b, typesize=2, clevel=COMPRESSION_LEVEL),
+            blosc.decompress,
+        )
+    elif name == "zlib":
+        return lambda b: zlib.compress(b, COMPRESSION_LEVEL), zlib.decompress
+    raise ValueError("Unknown compressor " + str(name))
+
+
+def compressor_available(name):
+    """Returns True if the compressor can be used."""
+    try:
+        get_compressor(name)
+        return True
+    except ImportError:
+        return False
+
+
+class ChunkedArray:
+    """Read only array of a packed store, with one compressed chunk for each
+    [iz, iy]. It supports indexing with ints and slices like a numpy array."""
+
+    def __init__(self, path, shape, dtype, compression):
+        """Opens the chunks of the store at path."""
+        self.shape = tuple(shape)
+        self.dtype = np.dtype(dtype)
+        self.decompress = get_compressor(compression)[1]
+        self.offsets = np.load(os.path.join(path, OFFSETS_FILE))
+        self.file = open(os.path.join(path, CHUNKS_FILE), "rb")
+
+    def chunk(self, iz, iy):
+        """Reads and decompresses the chunk at [iz, iy]."""
+        i = iz * self.shape[1] + iy
+        self.file.seek(int(self.offsets[i]))
+        b = self.decompress(self.file.read(int(self.offsets[i + 1] - self.offsets[i])))
+        return np.frombuffer(b, dtype=self.dtype).reshape(self.shape[2:])
+
+    def __getitem__(self, index):
+        if not isinstance(index, tuple):
+            index = (index,)
+        index = index + (slice(None),) * (len(self.shape) - len(index))
+        z = np.arange(self.shape[0])[index[0]]
+        y = np.arange(self.shape[1])[index[1]]
+
+        lines = [
+            [self.chunk(iz, iy)[index[2:]] for iy in np.atleast_1d(y)]
+            for iz in np.atleast_1d(z)
+        ]
+        result = np.array(lines, dtype=self.dtype)
+        if np.ndim(y) == 0:
+            result = result[:, 0]
+        if np.ndim(z) == 0:
+            result = result[0]
+        return result
+
+    def close(self):
+        self.file.close()
+
+
+class ScanCube:
+    """A data cube with the S-parameters of a scan over a grid.
+
+    Typical usage example:
+        c = ScanCube.create('scan.nfs', spatial_sweep, freq_sweep)
+        c.set_point(spatial_sweep.get_index(n), meas_data)
+        c.close()
+
+        c = ScanCube('scan.nfs')
+        s21 = c.data[:, :, :, c.sparam_index(vna.SParam.S21), :]
+    """
+
+    def __init__(self, path, mode="r"):
+        """Opens an existing store at path.
+
+        Args:
+            path (str): directory of the store
+            mode (str): "r" for read only, or "r+" to fill in more points
+        """
+        self.path = path
+        with open(os.path.join(path, META_FILE)) as f:
+            self.meta = json.load(f)
+        if self.meta.get("version") != VERSION:
+            raise ValueError("Unsupported scan store version")
+
+        self.axes = [np.asarray(a) for a in self.meta["axes"]]
+        self.sparams = [vna.SParam(sp) for sp in self.meta["sparams"]]
+        self.encoding = self.meta.get("encoding", "complex64")
+        self.compression = self.meta.get("compression")
+        self.filled = np.load(os.path.join(path, FILLED_FILE), mmap_mode=mode)
+        self.freq = np.load(os.path.join(path, FREQ_FILE), mmap_mode=mode)
+        if os.path.exists(os.path.join(path, HEADER_FILE)):
+            self.header = np.load(os.path.join(path, HEADER_FILE), mmap_mode=mode)
+            self.order = np.load(os.path.join(path, ORDER_FILE), mmap_mode=mode)
+            if mode == "r+" and self.header[SEQUENCE] % 2 == 1:
+                # The last writer died while writing a point
+                self.header[SEQUENCE] += 1
+        else:
+            self.header = None  # Stores made before the header was added
+            self.order = None
+
+        if self.encoding == "int16":
+            self.scale = np.load(os.path.join(path, SCALE_FILE), mmap_mode=mode)
+            dtype, shape = np.int16, self.filled.shape + self.scale.shape[3:] + (len(self.freq), 2)
+        else:
+            self.scale = None
+            dtype, shape = DTYPE, self.filled.shape + (len(self.sparams), len(self.freq))
+
+        if self.compression is not None:
+            if mode != "r":
+                raise ValueError("Packed scan stores are read only")
+            self.data = ChunkedArray(path, shape, dtype, self.compression)
+        else:
+            self.data = np.load(os.path.join(path, DATA_FILE), mmap_mode=mode)
+
+    @staticmethod
+    def create(path, spatial_sweep, freq_sweep, freq=None, encoding="complex64"):
+        """Creates a new (empty) store at path and returns it opened for
+        writing.
+
+        Args:
+            path (str): directory of the store
+            spatial_sweep (SpatialSweepParams): grid of the scan
+            freq_sweep (FreqSweepParams): sweep at each point
+            freq (numpy array): frequency axis in Hz, if it is already known
+            encoding (str): how to store the complex values (see ENCODINGS)
+        """
+        assert encoding in ENCODINGS
+        axes = spatial_sweep.get_axes()
+        nx, ny, nz = [len(a) for a in axes]
+        if freq is None:
+            freq = freq_sweep.get_freq()
+
+        os.makedirs(path, exist_ok=True)
+        # Replace any earlier store at path (e.g. of a scan that is run again)
+        for name in [SCALE_FILE, CHUNKS_FILE, OFFSETS_FILE]:
+            if os.path.exists(os.path.join(path, name)):
+                os.remove(os.path.join(path, name))
+        meta = {
+            "version": VERSION,
+            "axes": [a.tolist() for a in axes],
+            "sparams": [sp.value for sp in freq_sweep.sparams],
+            "sweep": {
+                "start": freq_sweep.start,
+                "stop": freq_sweep.stop,
+                "points": freq_sweep.points,
+                "power": freq_sweep.power,
+                "averaging": freq_sweep.averaging,
+                "segments": freq_sweep.segments,
+            },
+            "spatial": spatial_sweep.params,
+            "encoding": encoding,
+        }
+        with open(os.path.join(path, META_FILE), "w") as f:
+            json.dump(meta, f, indent=4)
+
+        shape = (nz, ny, nx, len(freq_sweep.sparams), len(freq))
+        if encoding == "int16":
+            data = np.lib.format.open_memmap(
+                os.path.join(path, DATA_FILE), mode="w+", dtype=np.int16, shape=shape + (2,)
+            )
+            scale = np.lib.format.open_memmap(
+                os.path.join(path, SCALE_FILE), mode="w+", dtype=np.float32, shape=shape[:4]
+            )
+            del scale
+        else:
+            data = np.lib.format.open_memmap(
+                os.path.join(path, DATA_FILE), mode="w+", dtype=DTYPE, shape=shape
+            )
+        filled = np.lib.format.open_memmap(
+            os.path.join(path, FILLED_FILE), mode="w+", dtype=bool, shape=shape[:3]
+        )
+        np.save(os.path.join(path, FREQ_FILE), np.asarray(freq, dtype=np.float64))
+        np.save(os.path.join(path, HEADER_FILE), np.zeros(2, dtype=np.int64))
+        np.save(os.path.join(path, ORDER_FILE), np.full(nz * ny * nx, -1, dtype=np.int64))
+        del data, filled  # Flush the new files before opening them again
+
+        return ScanCube(path, "r+")
+
+    @staticmethod
+    def open_or_create(path, spatial_sweep, freq_sweep, encoding="complex64"):
+        """Opens the store at path for writing (e.g. to resume a scan),
+        creating it if it does not exist yet.
+
+        Raises ValueError if the existing store is of another grid or sweep.
+        """
+        if not os.path.exists(os.path.join(path, META_FILE)):
+            return ScanCube.create(path, spatial_sweep, freq_sweep, encoding=encoding)
+        cube = ScanCube(path, "r+")
+        if not cube.matches(spatial_sweep, freq_sweep):
+            cube.close()
+            raise ValueError("The scan store {} is of another grid or sweep".format(path))
+        return cube
+
+    def matches(self, spatial_sweep, freq_sweep):
+        """Returns True if the store has the grid (SpatialSweepParams) and
+        sweep (FreqSweepParams) of a scan."""
+        sw = self.meta["sweep"]
+        axes = spatial_sweep.get_axes()
+        return (
+            len(axes) == len(self.axes)
+            and all(len(a) == len(b) and np.allclose(a, b) for a, b in zip(axes, self.axes))
+            and self.sparams == freq_sweep.sparams
+            and len(self.freq) == len(freq_sweep.get_freq())
+            and [sw["start"], sw["stop"], sw.get("segments")]
+            == [freq_sweep.start, freq_sweep.stop, freq_sweep.segments]
+        )
+
+    @property
+    def shape(self):
+        """Number of points along each axis, as [nx, ny, nz]."""
+        return [len(a) for a in self.axes]
+
+    def sparam_index(self, sparam):
+        """Returns the index of sparam (SParam) in the data cube."""
+        return self.sparams.index(sparam)
+
+    def get_sweep_params(self):
+        """Returns the FreqSweepParams of the scan."""
+        sw = self.meta["sweep"]
+        return vna.FreqSweepParams(
+            sw["start"],
+            sw["stop"],
+            sw["points"],
+            sw["power"],
+            sw["averaging"],
+            self.sparams,
+            sw.get("segments"),
+        )
+
+    def read(self, index):
+        """Returns the complex values of the cube at index (a tuple of ints and
+        slices along [z, y, x, sparam, freq]), whatever the encoding."""
+        if not isinstance(index, tuple):
+            index = (index,)
+        index = index + (slice(None),) * (5 - len(index))
+        if self.encoding == "complex64":
+            return np.asarray(self.data[index])
+
+        iq = np.asarray(self.data[index]).astype(np.float32)
+        scale = np.asarray(self.scale[index[:4]])
+        if not isinstance(index[4], (int, np.integer)):
+            scale = scale[..., np.newaxis]  # Same scale for each frequency
+        return ((iq[..., 0] + 1j * iq[..., 1]) * scale).astype(DTYPE)
+
+    def read_consistent(self, index):
+        """Like read, but waits if a point is being written (by this or another
+        process), so the values are never partly from an old point.
+
+        If no consistent read is possible for CONSISTENT_TIMEOUT (e.g. the
+        writer died while writing a point), the values are read as they are.
+        """
+        if self.header is None:
+            return self.read(index)
+        t0 = time.time()
+        while time.time() - t0 < CONSISTENT_TIMEOUT:
+            sequence = self.header[SEQUENCE]
+            if sequence % 2 == 0:
+                values = self.read(index)
+                if self.header[SEQUENCE] == sequence:
+                    return values
+            time.sleep(0)  # Let the writer finish
+        return self.read(index)
+
+    def progress(self):
+        """Returns the sequence and the number of measured points from the
+        header (the sequence changes whenever a point is written), or None if
+        the store has no header."""
+        if self.header is None:
+            return None
+        return int(self.header[SEQUENCE]), int(self.header[COUNT])
+
+    def new_points(self, start=0):
+        """Returns the grid indices [ix, iy, iz] (an array of rows) of the
+        points measured from position start onwards, in the order measured."""
+        if self.header is None:
+            return np.empty((0, 3), dtype=np.intp)
+        count = int(self.header[COUNT])
+        iz, iy, ix = np.unravel_index(np.asarray(self.order[start:count]), self.filled.shape)
+        return np.stack([ix, iy, iz], axis=1)
+
+    def write_trace(self, index, values):
+        """Stores the complex values of a trace at index [iz, iy, ix, isparam]."""
+        if self.encoding == "complex64":
+            self.data[index] = values
+            return
+
+        values = np.asarray(values)
+        peak = max(np.max(np.abs(values.real)), np.max(np.abs(values.imag)))
+        scale = peak / INT16_MAX if peak > 0 else 1
+        self.scale[index] = scale
+        self.data[index + (slice(None), 0)] = np.round(values.real / scale)
+        self.data[index + (slice(None), 1)] = np.round(values.imag / scale)
+
+    def error_bound(self):
+        """Returns the largest error of the I and Q values as stored, relative
+        to the peak of the trace, and in dB."""
+        eps = float(np.finfo(np.float32).eps)
+        if self.encoding == "int16":
+            # Rounding to the nearest step, and then to float32 when read
+            relative = 0.5 / INT16_MAX + eps
+        else:
+            relative = eps / 2
+        return relative, 20 * np.log10(relative)
+
+    def set_point(self, index, meas):
+        """Stores a list of MeasData at grid index [ix, iy, iz]."""
+        ix, iy, iz = index
+        new = not self.filled[iz, iy, ix]
+        if self.header is not None:
+            self.header[SEQUENCE] += 1  # Odd while writing
+        for m in meas:
+            i = self.sparam_index(m.sweep_params.sparams[0])
+            self.write_trace((iz, iy, ix, i), to_complex(m.mag, m.phase))
+
+        # The frequency axis reported by the VNA is used for all points
+        if not self.filled.any() and len(meas) > 0:
+            if len(meas[0].freq) == len(self.freq):
+                self.freq[:] = meas[0].freq
+        self.filled[iz, iy, ix] = True
+
+        if self.header is not None:
+            if new:
+                count = self.header[COUNT]
+                self.order[count] = np.ravel_multi_index((iz, iy, ix), self.filled.shape)
+                self.header[COUNT] = count + 1
+            self.header[SEQUENCE] += 1  # Even again, the point is complete
+
+    def set_values(self, iz, iy, ix, isp, ifreq, values):
+        """Stores complex values at arrays of indices into the cube (e.g. when
+        importing), and marks their points as measured, like set_point."""
+        assert self.encoding == "complex64"
+        if self.header is not None:
+            self.header[SEQUENCE] += 1  # Odd while writing
+        self.data[iz, iy, ix, isp, ifreq] = values
+        flat = np.unique(np.ravel_multi_index((iz, iy, ix), self.filled.shape))
+        new = flat[~self.filled.reshape(-1)[flat]]
+        self.filled[iz, iy, ix] = True
+
+        if self.header is not None:
+            count = self.header[COUNT]
+            self.order[count : count + len(new)] = new
+            self.header[COUNT] = count + len(new)
+            self.header[SEQUENCE] += 1  # Even again
+
+    def get_point(self, index):
+        """Returns a list of MeasData at grid index [ix, iy, iz], or None if
+        the point was not measured."""
+        ix, iy, iz = index
+        if not self.filled[iz, iy, ix]:
+            return None
+        params = self.get_sweep_params()
+        meas = []
+        for i, sp in enumerate(self.sparams):
+            mag, phase = to_mag_phase(self.read((iz, iy, ix, i)))
+            meas.append(vna.MeasData(params.for_sparams([sp]), self.freq, mag, phase))
+        return meas
+
+    def get_coordinate(self, index):
+        """Returns the coordinate (x, y, z) in cm of grid index [ix, iy, iz]."""
+        return [a[i] for a, i in zip(self.axes, index)]
+
+    def flush(self):
+        """Writes any changes to disk."""
+        for a in [self.data, self.filled, self.freq, self.scale, self.header, self.order]:
+            if isinstance(a, np.memmap):
+                a.flush()
+
+    def pack(self, compression):
+        """Compresses the data cube with a lossless compressor (see
+        COMPRESSORS), one chunk per scan line. The store is read only after
+        this. This is blocking!
+
+        The uncompressed data file is removed, which fails on Windows while it
+        is mapped elsewhere, so any ScanDataset (or other ScanCube) of the
+        store must be closed first. If it cannot be removed, it is left behind
+        (it is not used by the packed store).
+
+        Returns the ratio of the size of the chunks to the uncompressed size.
+        """
+        if self.compression is not None:
+            return 1
+        compress = get_compressor(compression)[0]
+        self.flush()
+
+        nz, ny = self.data.shape[:2]
+        offsets = [0]
+        with open(os.path.join(self.path, CHUNKS_FILE), "wb") as f:
+            for iz in range(nz):
+                for iy in range(ny):
+                    b = compress(np.ascontiguousarray(self.data[iz, iy]).tobytes())
+                    f.write(b)
+                    offsets.append(offsets[-1] + len(b))
+        np.save(os.path.join(self.path, OFFSETS_FILE), np.array(offsets, dtype=np.int64))
+        ratio = offsets[-1] / self.data.nbytes
+
+        self.meta["compression"] = compression
+        with open(os.path.join(self.path, META_FILE), "w") as f:
+            json.dump(self.meta, f, indent=4)
+        shape, dtype = self.data.shape, self.data.dtype
+        mm = getattr(self.data, "_mmap", None)
+        self.data = None
+        if mm is not None:
+            try:
+                mm.close()  # Unmaps now, not when garbage collected
+            except BufferError:
+                pass  # Views of the data are still alive
+        try:
+            os.remove(os.path.join(self.path, DATA_FILE))
+        except OSError as e:
+            util.dprint("Could not remove the uncompressed data: {}".format(e))
+        self.data = ChunkedArray(self.path, shape, dtype, compression)
+        self.compression = compression
+        return ratio
+
+    def close(self):
+        """Flushes and closes the store."""
+        self.flush()
+        if isinstance(self.data, ChunkedArray):
+            self.data.close()
+        self.data = None
+        self.filled = None
+        self.freq = None
+        self.scale = None
+        self.header = None
+        self.order = None
@@ -2,6 +2,7 @@
 
 Written by Ville Tiukuvaara
 """
+import os
 import threading
 
 debug_messages = False  # By default, do not print debuging info
@@ -10,6 +11,11 @@ previous_messages = []
 suppressed_messages = []
 # Suppress output for messages that are repeated within the last 100 messages
 N_MESSAGE_IGNORE = 100
+# Directory for files kept between runs for each user (e.g. learned settings)
+DATA_DIR = os.path.join(
+    os.environ.get("APPDATA") or os.path.expanduser("~"),
+    "NearFieldSystem" if "APPDATA" in os.environ else ".nearfield",
+)
 
 
 def dprint(string):
@@ -38,3 +44,10 @@ def dprint(string):
 
         finally:
             print_lock.release()
+
+
+def data_path(name):
+    """Returns the path of a file in DATA_DIR, creating the directory (only
+    readable by the user) if needed."""
+    os.makedirs(DATA_DIR, mode=0o700, exist_ok=True)
+    return os.path.join(DATA_DIR, name)
@@ -7,8 +7,6 @@ Manual.
 
 Written by Ville Tiukuvaara
 """
-import pyvisa as visa
-from pyvisa.resources import MessageBasedResource
 import myNumbers
 from enum import Enum
 import time
@@ -29,8 +27,30 @@ POWER_MIN = -15  # in dBm
 POWER_MAX = -5
 AVERAGING_MIN = 1
 AVERAGING_MAX = 999
+PROBE_POINTS = 11  # Number of points for a quick probe measurement
+SEGMENTS_MAX = 30  # Number of segments of a list frequency sweep
 FREQ_DECIMALS = 2
 POWER_DECIMALS = 1
+# Shows just S21 on channel 1 (OPC? replies once the display is split)
+DISPLAY_1_CHANNEL = "DUACOFF;SPLID1;OPC?;WAIT;CHAN1;AUTO;S21;AUXCOFF;LOGM;"
+SWEEP_QUERIES = ["STAR?;", "STOP?;", "POIN?;", "POWE?;"]  # Sweep settings
+# Clears the status, and requests service (SRQ) when the event status
+# register has an operation complete (ESE bit 0, SRE bit 5)
+ENABLE_SRQ = "CLES;ESE1;SRE32;"
+
+
+visa = None  # pyvisa, imported when first connecting (see load_visa)
+
+
+def load_visa():
+    """Imports pyvisa, which takes a while, so it is only done when a VNA is
+    connected."""
+    global visa
+    if visa is None:
+        import pyvisa
+
+        visa = pyvisa
+    return visa
 
 
 class VNAError(Exception):
@@ -75,12 +95,28 @@ CHANNELS = {
     SParam.S21: "CHAN1",
     SParam.S22: "CHAN4",
 }
+# Shows each S-param on its channel in a 2x2 grid (dual and auxiliary
+# channels on), so that a single sweep measures all of them. OPC? replies once
+# the display is set up.
+DISPLAY_4_CHANNELS = (
+    "DUACON;SPLID4;CHAN1;AUXCON;CHAN2;AUXCON;"
+    + "".join("{};AUTO;{};LOGM;".format(CHANNELS[sp], sp.value) for sp in SParam)
+    + "CHAN1;OPC?;WAIT;"
+)
 
 
 class FreqSweepParams:
-    """Paremeters for a frequency sweep, not the measured data itself."""
+    """Paremeters for a frequency sweep, not the measured data itself.
+
+    The sweep is either linear from start to stop, or a list frequency sweep
+    made of segments that each have their own start, stop and points (and
+    optionally power), e.g. to only measure a few sub-bands:
 
-    def __init__(self, start, stop, points, power, averaging, sparams):
+        FreqSweepParams.from_segments([[24e9, 25e9, 51], [28e9, 29e9, 51, -10]],
+                                      -5, 1, [SParam.S21])
+    """
+
+    def __init__(self, start, stop, points, power, averaging, sparams, segments=None):
         """Initializes with given params.
 
         Args:
@@ -90,6 +126,9 @@ class FreqSweepParams:
             power (float): power level in mdB
             averging (int): number of samples for averaging
             sparams (list): list of SParam objects for which ones to measure
+            segments (list): for a list frequency sweep, [start, stop, points]
+                or [start, stop, points, power] of each segment (or None for
+                a linear sweep)
         """
         self.start = start  # Start freq in GHz
         self.stop = stop  # Stop freq in GHz
@@ -98,19 +137,42 @@ class FreqSweepParams:
         self.averaging = averaging  # Averaging factor
         assert isinstance(sparams, list)
         self.sparams = sparams
+        self.segments = segments
+
+    @staticmethod
+    def from_segments(segments, power, averaging, sparams):
+        """Returns FreqSweepParams for a list frequency sweep of segments (see
+        __init__), from the lowest to the highest frequency of the segments."""
+        segments = [list(s) for s in segments]
+        return FreqSweepParams(
+            min(s[0] for s in segments),
+            max(s[1] for s in segments),
+            sum(int(s[2]) for s in segments),
+            power,
+            averaging,
+            sparams,
+            segments,
+        )
+
+    def get_freq(self):
+        """Returns a numpy array of the frequencies of the sweep in Hz."""
+        if self.segments is None:
+            return np.linspace(self.start, self.stop, self.points)
+        return np.concatenate([np.linspace(s[0], s[1], int(s[2])) for s in self.segments])
 
     def for_sparams(self, sp):
         """Returns new FreqSweepParams with sparams changed to sp."""
         assert isinstance(sp, list)
         return FreqSweepParams(
-            self.start, self.stop, self.points, self.power, self.averaging, sp
+            self.start, self.stop, self.points, self.power, self.averaging, sp, self.segments
         )
 
     def __str__(self):
         """Return string representation."""
         sp = " ".join([s.value for s in self.sparams])
-        return "<FreqSweepParams start:{:.3E} stop:{:.3E} points:{:d} power:{:.2f} averaging:{:.0f} sp: [{}]".format(
-            self.start, self.stop, self.points, self.power, self.averaging, sp
+        segments = "" if self.segments is None else " segments:{:d}".format(len(self.segments))
+        return "<FreqSweepParams start:{:.3E} stop:{:.3E} points:{:d} power:{:.2f} averaging:{:.0f}{} sp: [{}]".format(
+            self.start, self.stop, self.points, self.power, self.averaging, segments, sp
         )
 
     def validation_messages(self, check_sparams=False):
@@ -131,7 +193,9 @@ class FreqSweepParams:
                     FREQ_MIN / 1e9, FREQ_MAX / 1e9
                 )
             )
-        if self.start >= self.stop:
+        if self.segments is not None:
+            errors.extend(self.segment_messages())
+        elif self.start >= self.stop:
             errors.append("Stop frequency should be greater than start frequency")
         if self.points < POINTS_MIN or self.points > POINTS_MAX:
             errors.append(
@@ -158,6 +222,31 @@ class FreqSweepParams:
         else:
             return None
 
+    def segment_messages(self):
+        """Returns a list of errors (strings) in the segments."""
+        errors = []
+        if len(self.segments) == 0 or len(self.segments) > SEGMENTS_MAX:
+            errors.append("There should be 1 to {} segments".format(SEGMENTS_MAX))
+        previous = None
+        for i, s in enumerate(self.segments):
+            if len(s) not in [3, 4]:
+                errors.append("Segment {} should have a start, stop and points".format(i + 1))
+                continue
+            if s[2] < 1 or s[0] > s[1] or (s[0] == s[1] and s[2] > 1):
+                errors.append(
+                    "Stop frequency of segment {} should be greater than its start".format(i + 1)
+                )
+            if previous is not None and s[0] <= previous:
+                errors.append("Segment {} should start above the previous one".format(i + 1))
+            if len(s) == 4 and (s[3] < POWER_MIN or s[3] > POWER_MAX):
+                errors.append(
+                    "Power level of segment {} should be between {} dBm and {} dBm".format(
+                        i + 1, POWER_MIN, POWER_MAX
+                    )
+                )
+            previous = s[1]
+        return errors
+
 
 class CalStep(Enum):
     """Steps required in calibration sequence."""
@@ -216,9 +305,17 @@ class VNA:
         self.cal_params = None
         self.averaging_factor = 1
 
-        self.rm = None
+        self.rm = None  # Kept after disconnecting, to reconnect quickly
         self.vna = None
 
+        # Cached state of the instrument while connected, read when connecting
+        # (see refresh_state) and kept up to date as it is changed
+        self.identity = None  # Reply to IDN?
+        self.sweep_state = None  # FreqSweepParams on the VNA, if known
+        self.sweep_commands = {}  # Last command written for each sweep setting
+        self.display = None  # DISPLAY_1_CHANNEL or DISPLAY_4_CHANNELS, if known
+        self.sweeping = False  # Whether a sweep was started and not waited for
+
     def __del__(self):
         """Disconnect from VNA if object deleted."""
         try:
@@ -229,13 +326,21 @@ class VNA:
     def connect(self, address):
         """Establish a connection with the VNA.
 
+        The display is set up and the state of the VNA is read and cached
+        (see refresh_state), since it may have changed (e.g. on the front
+        panel) while disconnected.
+
         Returns true after successful connection.
         """
         if self.dummy:
             self.connected = True
         else:
+            load_visa()
+            from pyvisa.resources import MessageBasedResource
+
             try:
-                self.rm = visa.ResourceManager()
+                if self.rm is None:
+                    self.rm = visa.ResourceManager()
                 self.vna = self.rm.open_resource(
                     "GPIB0::{}::INSTR".format(address),
                     resource_pyclass=MessageBasedResource,
@@ -243,20 +348,56 @@ class VNA:
                 self.vna.timeout = (
                     None  # Avoid timing out for time consuming measurements.
                 )
+                # Sweeps signal that they are done with a service request
+                self.vna.enable_event(
+                    visa.constants.EventType.service_request,
+                    visa.constants.EventMechanism.queue,
+                )
                 self.connected = True
                 util.dprint("Opened connection to VNA")
             except visa.VisaIOError:
                 self.connected = False
                 return False
 
-        # Configure display immediately upon connecting
-        self.display_1_channel()
+        self.invalidate()
+        self.refresh_state()
+        self.cal_ok = self.cal_type is not None
+        return True
 
+    def refresh_state(self):
+        """Sets up the display, and reads the identity, calibration and sweep
+        settings of the VNA and caches them."""
+        self.display_1_channel()
+        self.identity = self.query("IDN?;").strip()
         self.cal_type = self.get_cal_type()
-        self.cal_ok = self.cal_type is not None
+        self.set_sweep_state(self.query_all(SWEEP_QUERIES))
+        util.dprint("Connected to {}".format(self.identity))
+
+    def invalidate(self):
+        """Forgets the cached state (e.g. when disconnecting). The sweep
+        settings are read again when needed, and the rest when connecting."""
+        self.identity = None
+        self.sweep_state = None
+        self.sweep_commands = {}
+        self.display = None
+
+    def set_sweep_state(self, replies):
+        """Caches the sweep settings from the replies to SWEEP_QUERIES."""
+        start, stop, points, power = replies
+        self.sweep_state = FreqSweepParams(
+            float(start),
+            float(stop),
+            int(float(points)),
+            float(power),
+            self.averaging_factor,
+            [],
+        )
+        self.sweep_commands = sweep_commands(self.sweep_state)
+        del self.sweep_commands["MODE"]  # Linear or list sweep is not known
 
     def disconnect(self):
         """Disconnect from VNA."""
+        self.invalidate()
         if self.dummy:
             self.connected = False
             self.cal_ok = False
@@ -268,7 +409,6 @@ class VNA:
             except visa.VisaIOError:
                 pass
             self.vna = None
-            self.rm = None
 
         self.connected = False
         self.cal_ok = False
@@ -291,6 +431,12 @@ class VNA:
         else:
             return self.vna.read()
 
+    def query_all(self, queries):
+        """Sends several queries (each ending with ;) and returns the replies
+        (strings). The VNA only holds the reply to one query at a time, so
+        each reply is read before the next query is sent."""
+        return [self.query(q).strip() for q in queries]
+
     def query(self, msg):
         """Query (write and read) with VNA."""
         if len(msg) < 200:
@@ -303,46 +449,23 @@ class VNA:
             return self.vna.query(msg)
 
     def display_4_channels(self):
-        """Displays the 4 channels in a 2x2 grid with one slot for each.
-        Assigns S11 to CHAN1, S12 to CHAN3, S21 to CHAN2, and S22 to CHAN4."""
-        self.write("DUACON;")
-        self.write("SPLID4;")
-        self.write("OPC?;WAIT;")
-        self.write("{};AUTO;".format(CHANNELS[SParam.S21]))
-        self.write("S11;")
-        self.write("AUXCON;")
-        self.write("LOGM;")
-        self.write("{};AUTO;".format(CHANNELS[SParam.S21]))
-        self.write("S21;")
-        self.write("AUXCON;")
-        self.write("LOGM;")
-        self.write("{};AUTO;".format(CHANNELS[SParam.S12]))
-        self.write("S12;")
-        self.write("LOGM;")
-        self.write("{};AUTO;".format(CHANNELS[SParam.S22]))
-        self.write("S22;")
-        self.write("LOGM;")
-        
+        """Displays the 4 channels in a 2x2 grid with one slot for each, with
+        each S-param on its channel (see CHANNELS)."""
+        self.query(DISPLAY_4_CHANNELS)
+        self.display = DISPLAY_4_CHANNELS
+
     def display_1_channel(self):
         """Display just S21 on channel 1."""
-        self.write("DUACOFF;")
-        self.write("SPLID1;")
-        self.write("OPC?;WAIT;")
-        self.write("{};AUTO;".format(CHANNELS[SParam.S21]))
-        self.write("S21;")
-        self.write("AUXCOFF;")
-        self.write("LOGM;")
+        self.query(DISPLAY_1_CHANNEL)
+        self.display = DISPLAY_1_CHANNEL
 
     def get_cal_type(self):
         """Checks what kind of calibration is present in VNA.
 
         Returns the first kind of calibration that is detected
         """
-        for t in CalType:
-            name = t.name
-            if bool(int(self.query(name + "?;"))):
-                return t
-        return None
+        flags = self.query_all([t.name + "?;" for t in CalType])
+        return next((t for t, f in zip(CalType, flags) if bool(int(f))), None)
 
     def get_calibration_data(self):
         """Reads calibration data from VNA and returns as list."""
@@ -563,48 +686,104 @@ class VNA:
         return self.cal_params
 
     def set_sweep_params(self, sweep_params):
-        """Set the FreqSweepParams for measurement."""
+        """Set the FreqSweepParams for measurement.
+
+        Only the settings that differ from those already on the VNA are
+        written, in one message.
+        """
         assert isinstance(sweep_params, FreqSweepParams)
-        # self.measurement_params = sweep_params
-        self.write(
-            "STAR {a:.{b}f}GHz;".format(a=sweep_params.start / 1e9, b=FREQ_DECIMALS)
-        )
-        self.write(
-            "STOP {a:.{b}f}GHz;".format(a=sweep_params.stop / 1e9, b=FREQ_DECIMALS)
-        )
-        self.write("POIN {a:d};".format(a=sweep_params.points))
-        self.write("POWE {a:.{b}f};".format(a=sweep_params.power, b=POWER_DECIMALS))
+        commands = sweep_commands(sweep_params)
+        if commands["MODE"] != self.sweep_commands.get("MODE"):
+            changed = list(commands.values())  # Everything, in the new mode
+        else:
+            changed = [c for k, c in commands.items() if self.sweep_commands.get(k) != c]
+        if len(changed) > 0:
+            self.write("".join(changed))
+            self.sweep_commands = commands
+            self.sweep_state = None  # The VNA may round the values
         self.averaging_factor = sweep_params.averaging
 
     def get_sweep_params(self):
-        """Get the FreqSweepParams for measurement."""
-        start = float(self.query("STAR?;"))
-        stop = float(self.query("STOP?;"))
-        points = int(float(self.query("POIN?;")))
-        power = float(self.query("POWE?;"))
+        """Get the FreqSweepParams for measurement (read from the VNA, unless
+        they are cached)."""
+        if self.sweep_state is None:
+            self.set_sweep_state(self.query_all(SWEEP_QUERIES))
 
         if self.dummy and isinstance(self.cal_params, FreqSweepParams):
             return self.cal_params
 
-        return FreqSweepParams(start, stop, points, power, self.averaging_factor, [])
+        s = self.sweep_state
+        return FreqSweepParams(s.start, s.stop, s.points, s.power, self.averaging_factor, [])
+
+    def sweep(self, timeout=None, averaging=None):
+        """Triggers a sweep (with averging if selected) and waits for it.
+        This is blocking!
 
-    def sweep(self):
-        """Triggers a sweep (with averging if selected)."""
-        self.write("CONT;")    
-        i = "CHAN1"
-        self.write(i + ";AUTO;")
-        if self.averaging_factor < 2:
-            self.write("AVEROOFF;")
+        Returns True if the sweep is done, or False if it timed out.
+        """
+        self.start_sweep(averaging)
+        return self.wait_sweep(timeout)
+
+    def start_sweep(self, averaging=None):
+        """Triggers a sweep (with averging if selected), without waiting for
+        it. The VNA requests service when the sweep is done (see wait_sweep).
+
+        Args:
+            averaging (int): averaging factor of this sweep, or None to use
+                the one of the sweep settings
+        """
+        if averaging is None:
+            averaging = self.averaging_factor
+        msg = "CONT;CHAN1;AUTO;"
+        if averaging < 2:
+            msg += "AVEROOFF;"
         else:
-            self.write("AVERFACT{};".format(self.averaging_factor))
-            self.write("AVEROON;")
+            msg += "AVERFACT{};AVEROON;".format(averaging)
 
         if not self.dummy:
-            # self.vna.query_ascii_values("OPC?;SING;")
-            if self.averaging_factor < 2:
-                self.query("OPC?;SING;")
-            else:
-                self.query("OPC?;NUMG{};".format(self.averaging_factor))
+            # Forget any service request left from an earlier sweep
+            self.vna.discard_events(
+                visa.constants.EventType.service_request,
+                visa.constants.EventMechanism.queue,
+            )
+        # OPC sets the operation complete bit once the sweep is done
+        if averaging < 2:
+            msg += ENABLE_SRQ + "OPC;SING;"
+        else:
+            msg += ENABLE_SRQ + "OPC;NUMG{};".format(averaging)
+        self.write(msg)
+        self.sweeping = True
+
+    def wait_sweep(self, timeout=None):
+        """Waits for the sweep started by start_sweep to be done. Nothing
+        serializes access to the VNA, so it must not be used by other threads
+        until the sweep is done. This is blocking!
+
+        Args:
+            timeout (float): how long to wait in s, or None to wait forever
+
+        Returns True if the sweep is done, or False if it timed out (in which
+        case it can be waited for again).
+        """
+        if not self.sweeping or self.dummy:
+            self.sweeping = False
+            return True
+
+        if timeout is None:
+            ms = visa.constants.VI_TMO_INFINITE
+        else:
+            ms = int(timeout * 1000)
+        response = self.vna.wait_on_event(
+            visa.constants.EventType.service_request, ms, capture_timeout=True
+        )
+        if response.timed_out:
+            util.dprint("Timed out waiting for sweep")
+            return False
+
+        self.vna.read_stb()  # Serial poll to clear the service request
+        self.write("CLES;")
+        self.sweeping = False
+        return True
 
     def get_freq(self):
         """Returns a numpy array with the values of frequency
@@ -675,10 +854,53 @@ class VNA:
             res.append(aux[i])
         return np.asarray(res)
 
-    def measure(self, sweep_params):
+    def calibration_messages(self, sweep_params):
+        """Returns a list of errors (strings) if sweep_params (FreqSweepParams)
+        cannot be measured with the calibration of the VNA.
+
+        The calibration is for a linear sweep, so it does not apply to a list
+        frequency sweep (the dummy VNA has no real calibration).
+        """
+        if sweep_params.segments is not None and self.cal_ok and not self.dummy:
+            return ["List frequency sweeps cannot be used with the (linear) calibration"]
+        return []
+
+    def get_data(self, chan="CHAN1"):
+        """Returns numpy arrays with the logarithmic magnitude and phase
+        values on the channel specified, as measured by the last sweep.
+
+        The error corrected data is read as real and imaginary parts, so the
+        display format of the channel is not changed (which would take a while).
+
+        Args:
+            chan (str): String specifying the channel to get the values from
+        """
+        if self.dummy:
+            self.write("{};OUTPDATA;".format(chan))
+            return np.empty(0), np.empty(0)
+
+        # Binary format was selected with FORM5 by the caller
+        aux = self.vna.query_binary_values(
+            "{};OUTPDATA;".format(chan), container=np.array, header_fmt="hp"
+        )
+        values = aux[0::2] + 1j * aux[1::2]
+        with np.errstate(divide="ignore"):
+            mag = 20 * np.log10(np.abs(values))
+        return mag, np.rad2deg(np.angle(values))
+
+    def measure(self, sweep_params, timeout=None):
         """Perform a measurement of the given sweep_params.
 
-        Returns a list of MeasData objects.
+        All the S-params are measured by a single sweep: if there are more
+        than one, all the channels are displayed (once), so that the sweep
+        updates all of them, and then the data of each channel is read.
+
+        Args:
+            sweep_params (FreqSweepParams): what to measure
+            timeout (float): how long to wait for the sweep in s, or None to
+                wait forever
+
+        Returns a list of MeasData objects, or None if the sweep timed out.
         """
         assert isinstance(sweep_params, FreqSweepParams)
 
@@ -689,20 +911,24 @@ class VNA:
         # if not self.dummy:
         #    sweep_params_read = self.get_sweep_params()
 
-        self.sweep()
+        if len(sweep_params.sparams) > 1 and self.display != DISPLAY_4_CHANNELS:
+            self.display_4_channels()
+
+        if not self.sweep(timeout):
+            self.write("HOLD;")  # Stop the sweep, so it can be measured again
+            self.sweeping = False
+            return None
         freq = self.get_freq()
 
         if self.dummy:
-            freq = np.linspace(
-                sweep_params.start, sweep_params.stop, sweep_params.points
-            )
+            freq = sweep_params.get_freq()
 
         data = []
 
+        self.write("FORM5;")  # Use binary format to output data
         for sp in sweep_params.sparams:
-            phase = self.get_phase(CHANNELS[sp])
-            mag = self.get_mag(CHANNELS[sp])
-            
+            mag, phase = self.get_data(CHANNELS[sp])
+
             # For a dummy object, generate random data
             if self.dummy:
                 diff = max(freq) - min(freq)
@@ -721,10 +947,42 @@ class VNA:
 
         return data
 
-    def measure_all(self, sweep_params):
+    def probe(self, sweep_params):
+        """Quickly measures S21 with few points and no averaging.
+
+        This is used e.g. to check if the frame has settled after a move, which
+        only compares probes with each other, so the error correction is turned
+        off while probing (the number of points differs from the calibration).
+        Only the number of points is changed, and it is set back (with the
+        correction) right after the probe, so the calibrated sweep is ready for
+        the measurement. List frequency sweeps are probed with all their
+        points, so that the list does not have to be programmed again.
+        Returns a numpy array of complex S21 values.
+        """
+        assert isinstance(sweep_params, FreqSweepParams)
+
+        self.set_sweep_params(sweep_params)
+        points = sweep_params.points
+        if sweep_params.segments is None:
+            points = PROBE_POINTS
+            self.write("CORROFF;POIN {:d};".format(points))
+        self.sweep(averaging=1)
+        self.write("FORM5;")
+        mag, phase = self.get_data(CHANNELS[SParam.S21])
+        if sweep_params.segments is None:
+            restore = self.sweep_commands["POIN"]
+            self.write(restore + ("CORRON;" if self.cal_ok else ""))
+
+        if self.dummy:
+            return np.ones(points, dtype=complex)
+
+        return 10 ** (mag / 20) * np.exp(1j * np.deg2rad(phase))
+
+    def measure_all(self, sweep_params, timeout=None):
         """Perform a measurement of all S-parameters for current calibration.
 
-        Returns a list of MeasData objects.
+        Returns a list of MeasData objects, or None if the sweep timed out
+        (see measure).
         """
         assert isinstance(sweep_params, FreqSweepParams)
 
@@ -735,7 +993,40 @@ class VNA:
         elif self.cal_type == CalType.CALIS221:
             sweep_params = sweep_params.for_sparams([SParam.S22])
 
-        return self.measure(sweep_params)
+        return self.measure(sweep_params, timeout)
+
+
+def sweep_commands(sweep_params):
+    """Returns a dict of the command that sets each setting of sweep_params
+    (FreqSweepParams) on the VNA, in the order they should be written.
+
+    A list frequency sweep is programmed as a list of segments, each with its
+    own start, stop and points (and power, in list power mode).
+    """
+    power = "POWE {a:.{b}f};".format(a=sweep_params.power, b=POWER_DECIMALS)
+    if sweep_params.segments is None:
+        return {
+            "MODE": "LINFREQ;",
+            "STAR": "STAR {a:.{b}f}GHz;".format(a=sweep_params.start / 1e9, b=FREQ_DECIMALS),
+            "STOP": "STOP {a:.{b}f}GHz;".format(a=sweep_params.stop / 1e9, b=FREQ_DECIMALS),
+            "POIN": "POIN {a:d};".format(a=sweep_params.points),
+            "POWE": power,
+        }
+
+    segments = ""
+    for s in sweep_params.segments:
+        segments += "SADD;STAR {a:.{d}f}GHz;STOP {b:.{d}f}GHz;POIN {n:d};".format(
+            a=s[0] / 1e9, b=s[1] / 1e9, n=int(s[2]), d=FREQ_DECIMALS
+        )
+        if len(s) > 3:
+            segments += "POWE {a:.{b}f};".format(a=s[3], b=POWER_DECIMALS)
+        segments += "SDON;"
+    list_power = any(len(s) > 3 for s in sweep_params.segments)
+    return {
+        "POWE": power,
+        "LIST": "EDITLIST;CLEL;" + segments + "EDITDONE;",
+        "MODE": ("LISPWRON;" if list_power else "LISPWROFF;") + "LISFREQ;",
+    }
 
 
 class MeasData:
@@ -16,13 +16,10 @@ import os
 import time
 import pickle
 import traceback
+from events import Event
 
-from matplotlib.backends.backend_tkagg import (
-    FigureCanvasTkAgg, NavigationToolbar2Tk)
-from matplotlib.figure import Figure
 import numpy as np
 
-SLEEP = 100  # How long to wait between updating widgets
 PADDING = 5  # Padding around widgets
 FREQ_DECIMALS = 2  # Decimal places for frequency values
 POWER_DECIMALS = 1  # Decimal placer for power in mdB
@@ -31,6 +28,10 @@ DEFAULT_PARAMS = "{start:.{s1}f} {stop:.{s1}f} {points:.0f} {power:.{s2}f} {aver
                 start=vna.FREQ_MIN/1e9, stop=vna.FREQ_MAX/1e9, points=vna.POINTS_MAX, power=vna.POWER_MIN,
                 averaging=vna.AVERAGING_MIN,s1=FREQ_DECIMALS,s2=POWER_DECIMALS).split(" ")
 DEFAULT_ADDRESS = 16  # Default GPIB address for VNA
+MAG_STEP = 5  # Steps of the magnitude axis limits in dB
+PHASE_LIMITS = (-180, 180)  # Limits of the phase axis in degrees
+FIGURE_SIZE = (5, 4)  # Size of the plots in inches
+DPI = 100  # Resolution of the plots
 
 
 class VNATab(tk.Frame):
@@ -47,10 +48,13 @@ class VNATab(tk.Frame):
         self.top = top
         self.gui_ready = False
         self.disable_widgets = False
+        self.connecting = False  # Waiting for connect_task
         tk.Frame.__init__(self, parent)             # do superclass init
         self.vna = vna_obj
         self.pack()
         self.make_widgets()                      # attach widgets to self
+        top.events.subscribe(Event.VNA_STATUS, self.vna_status_callback)
+        top.events.subscribe(Event.VNA_MEASUREMENT, self.measurement_callback)
 
     def make_widgets(self):
         """Sets up the widgets."""
@@ -212,10 +216,12 @@ class VNATab(tk.Frame):
             except ValueError:
                 tk.messagebox.showerror(title="VNA Error",message="Invalid GPIB Address")
                 return
+            self.config(cursor="wait")  # Show busy cursor
+            self.connecting = True
             threading.Thread(target=lambda: self.connect_task(address)).start()
         else:
             self.vna.disconnect()
-            self.update_widgets()
+            self.top.events.publish(Event.VNA_STATUS, self.vna.connected)
 
     def connect_task(self, address):
         """Performs a connection over GPIB. This is blocking!
@@ -223,12 +229,17 @@ class VNATab(tk.Frame):
         Args:
             address (str): GBIB address
         """
-        self.config(cursor="wait")  # Show busy cursor
         self.vna.connect(address)
-        if not self.vna.connected:
-            tk.messagebox.showerror(title="VNA Error",message="Could not connect to VNA")
-        self.config(cursor="")  # Show normal cursor
-
+        self.top.events.publish(Event.VNA_STATUS, self.vna.connected)
+
+    def vna_status_callback(self, connected):
+        """Callback (on Event.VNA_STATUS) when the VNA connects or
+        disconnects."""
+        if self.connecting:
+            self.connecting = False
+            self.config(cursor="")  # Show normal cursor
+            if not connected:
+                tk.messagebox.showerror(title="VNA Error",message="Could not connect to VNA")
         self.update_widgets()
 
     def measure_btn_callback(self):
@@ -243,12 +254,17 @@ class VNATab(tk.Frame):
         if msgs is not None:
             tk.messagebox.showerror(message="Please fix sweep parameters.\n\n" + '\n'.join(msgs))
         else:
+            self.config(cursor="wait")  # Show busy cursor
             threading.Thread(target=lambda: self.measure_task(p)).start()
 
     def measure_task(self, params):
-        """Performs a sample measurement."""
-        self.config(cursor="wait")  # Show busy cursor
+        """Performs a sample measurement. This is blocking!"""
         data = self.vna.measure(params)
+        self.top.events.publish(Event.VNA_MEASUREMENT, data)
+
+    def measurement_callback(self, data):
+        """Callback (on Event.VNA_MEASUREMENT) to plot a sample
+        measurement."""
         self.measurement_plot.set_data(data)
         self.config(cursor="")
 
@@ -272,7 +288,7 @@ class VNATab(tk.Frame):
     def update_widgets(self):
         """Updates widgets.
 
-        This is blocking, so best to call on a background thread.
+        This must be called from the Tk thread.
         """
         if self.disable_widgets:
             self.connect_button.config(state=tk.DISABLED)
@@ -317,11 +333,37 @@ class VNATab(tk.Frame):
             self.measure_btn.config(state=tk.NORMAL)
             self.enable_entries(True)
 
+def decimate(x, y, width):
+    """Reduces a trace to a min/max envelope with two points per pixel.
+
+    Args:
+        x, y (numpy array): the trace
+        width (int): width of the plot in pixels
+
+    Returns x and y, unchanged if the trace has less than two points per pixel.
+    """
+    width = max(int(width), 1)
+    if len(x) <= 2*width:
+        return x, y
+    starts = np.linspace(0, len(x), width, endpoint=False).astype(int)
+    y_min = np.minimum.reduceat(y, starts)
+    y_max = np.maximum.reduceat(y, starts)
+    return np.repeat(x[starts], 2), np.column_stack([y_min, y_max]).ravel()
+
+
 class MeasurementPlot(tk.Frame):
-    """A widget that displays measured S-parameters."""
+    """A widget that displays measured S-parameters.
+
+    The axes and lines are made once, and only their data is changed. Unless
+    the axis limits change, a new trace is drawn by restoring the background
+    of the axes and blitting the lines, rather than redrawing the figure.
+
+    The figure (and matplotlib) is only loaded when the plot is first shown,
+    which keeps the start up of the GUI fast.
+    """
 
     def __init__(self, parent, name):
-        """Basic init. Starts a background monitor thread.
+        """Basic init.
 
         Args:
             parent (tk.Widget): parent widget
@@ -332,10 +374,13 @@ class MeasurementPlot(tk.Frame):
         self.pack()
         self.data = None
         self.current_sparam = None
+        self.background = None  # Axes without the lines, for blitting
+        self.update_pending = False  # A replot is scheduled
+        self.canvas = None  # Made by make_figure when first shown
 
         self.make_widgets() # attach widgets to self
+        self.bind('<Map>', lambda e: self.make_figure())
         self.update_widgets()
-        self.background_task()
 
     def set_data(self, data):
         """Set plot data.
@@ -354,15 +399,13 @@ class MeasurementPlot(tk.Frame):
         else:
             sp = [d.sweep_params.sparams[0].value for d in self.data]
             self.plot_select.config(values=sp)
-            self.plot_select.set(sp[0])
-            self.current_sparam = self.data[0].sweep_params.sparams[0]
+            if self.current_sparam is None or self.current_sparam.value not in sp:
+                self.current_sparam = self.data[0].sweep_params.sparams[0]
+            self.plot_select.set(self.current_sparam.value)
         self.update_widgets()
 
     def make_widgets(self):
-        """Sets up widgets."""
-        self.fig = Figure(figsize=(5, 4), dpi=100,facecolor=(.9375,.9375,.9375))
-        self.ax = self.fig.add_subplot(111)
-
+        """Sets up widgets, with a placeholder for the figure."""
         title_group = tk.Frame(self)
         title_group.pack(side=tk.TOP,pady=5)
         tk.Label(title_group, text='Choose parameter to plot: ').pack(side=tk.LEFT)
@@ -372,13 +415,53 @@ class MeasurementPlot(tk.Frame):
         self.plot_select.bind("<<ComboboxSelected>>", lambda e: self.plot_select_callback())
         self.plot_select.pack(side=tk.LEFT,padx=5)
 
+        self.placeholder = tk.Frame(self, width=FIGURE_SIZE[0]*DPI, height=FIGURE_SIZE[1]*DPI)
+        self.placeholder.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+
+    def make_figure(self):
+        """Makes the figure, the first time the plot is shown."""
+        if self.canvas is not None:
+            return
+        from matplotlib.backends.backend_tkagg import (
+            FigureCanvasTkAgg, NavigationToolbar2Tk)
+        from matplotlib.figure import Figure
+
+        self.fig = Figure(figsize=FIGURE_SIZE, dpi=DPI,facecolor=(.9375,.9375,.9375))
+        self.ax = self.fig.add_subplot(111)
+
+        # Magnitude
+        colour = 'tab:red'
+        self.mag_line, = self.ax.plot([], [], label='Magnitude', color=colour, animated=True)
+        self.ax.set_xlabel('Frequency (GHz)')
+        self.ax.set_ylabel('Magnitude (dB)',color=colour)
+        self.ax.tick_params(axis='y', labelcolor=colour)
+
+        # Phase
+        colour = 'tab:blue'
+        self.ax2 = self.ax.twinx()
+        self.phase_line, = self.ax2.plot([], [], label='Phase', color=colour, animated=True)
+        self.ax2.set_ylabel(u'Phase (\N{DEGREE SIGN})',color=colour)
+        self.ax2.tick_params(axis='y', labelcolor=colour)
+        self.ax2.set_ylim(*PHASE_LIMITS)
+        self.fig.tight_layout()
+
+        self.placeholder.destroy()
         self.canvas = FigureCanvasTkAgg(self.fig, master=self)  # A tk.DrawingArea.
+        self.canvas.mpl_connect('draw_event', self.draw_callback)
         self.canvas.draw()
         self.canvas.get_tk_widget().pack(side=tk.TOP, fill=tk.BOTH, expand=1)
 
         toolbar = NavigationToolbar2Tk(self.canvas, self)
         toolbar.update()
         toolbar.pack(side=tk.TOP, fill=tk.BOTH, expand=1)
+        self.update_widgets()
+
+    def draw_callback(self, event):
+        """Called after the whole figure is drawn (e.g. after resizing), to
+        keep the background for blitting and draw the lines on it."""
+        self.background = self.canvas.copy_from_bbox(self.fig.bbox)
+        self.ax.draw_artist(self.mag_line)
+        self.ax2.draw_artist(self.phase_line)
 
     def plot_select_callback(self):
         """Callback when user chooses to plot new S-param."""
@@ -386,51 +469,75 @@ class MeasurementPlot(tk.Frame):
         self.update_widgets()
 
     def update_widgets(self):
-        """Forces widget to update."""
-        self.request_update = True
-
-    def background_task(self):
-        """Tasks that runs in background to take care of replotting."""
-        if self.request_update:
-            self.request_update = False
-            self._update_widgets()
-        self.after(SLEEP, self.background_task)
+        """Replots once the Tk thread is idle (once for several calls in a
+        row)."""
+        if not self.update_pending:
+            self.update_pending = True
+            self.after_idle(self._update_widgets)
+
+    @staticmethod
+    def mag_limits(mag, current):
+        """Returns the limits for the magnitude axis, in steps of MAG_STEP dB.
+
+        The current limits (tuple) are kept if they still fit the data well,
+        so that the figure does not need to be redrawn.
+        """
+        mag = mag[np.isfinite(mag)]
+        if len(mag) == 0:
+            return current
+        low = np.floor(np.min(mag)/MAG_STEP)*MAG_STEP
+        high = np.ceil(np.max(mag)/MAG_STEP)*MAG_STEP
+        if high <= low:
+            high = low + MAG_STEP
+        if current[0] <= low and high <= current[1] and \
+                current[1] - current[0] <= 2*(high - low):
+            return current
+        return low, high
 
     def _update_widgets(self):
-        """Private function called by background task to actually perform
-        replotting.
+        """Private function called when the Tk thread is idle to actually
+        perform replotting.
 
         This is blocking."""
-        self.fig.clf()  # Clear plot
-        self.ax = self.fig.add_subplot(111)
-        self.fig.subplots_adjust(top=0.97)  # Change space at the top
-
+        self.update_pending = False
+        # Get MeasData for the requested S-parameter
+        data = None
         if self.data is None:
             self.plot_select.config(state=tk.DISABLED)
-            self.canvas.draw()
-            return
         else:
             self.plot_select.config(state=tk.NORMAL)
+            data = next((d for d in self.data if d.sweep_params.sparams[0] == self.current_sparam), None)
 
-        # Get MeasData for the requested S-parameter
-        data = next((d for d in self.data if d.sweep_params.sparams[0] == self.current_sparam), None)
+        if self.canvas is None:
+            return  # Plotted once the figure is made
 
-        if data == None:
-            self.canvas.draw()
+        if data is None:
+            self.mag_line.set_data([], [])
+            self.phase_line.set_data([], [])
+            self.blit()
             return
 
-        # Plot magnitude
-        colour = 'tab:red'
-        self.ax.plot(data.freq/1e9, data.mag, 'r-',label='Magnitude',color=colour)
-        self.ax.set_xlabel('Frequency (GHz)')
-        self.ax.set_ylabel('Magnitude (dB)',color=colour)
-        self.ax.tick_params(axis='y', labelcolor=colour)
+        freq = np.asarray(data.freq)/1e9
+        width = self.ax.bbox.width
+        self.mag_line.set_data(*decimate(freq, np.asarray(data.mag), width))
+        self.phase_line.set_data(*decimate(freq, np.asarray(data.phase), width))
+
+        # Only redraw the whole figure if the axes change
+        xlim = (freq[0], freq[-1]) if freq[-1] > freq[0] else (freq[0] - 1, freq[0] + 1)
+        ylim = self.mag_limits(np.asarray(data.mag), self.ax.get_ylim())
+        if tuple(self.ax.get_xlim()) != xlim or tuple(self.ax.get_ylim()) != ylim:
+            self.ax.set_xlim(*xlim)
+            self.ax.set_ylim(*ylim)
+            self.canvas.draw()
+        else:
+            self.blit()
 
-        # Plot phase
-        colour = 'tab:blue'
-        ax2 = self.ax.twinx()
-        ax2.plot(data.freq/1e9, data.phase, label='Phase',color=colour)
-        ax2.set_ylabel(u'Phase (\N{DEGREE SIGN})',color=colour)
-        ax2.tick_params(axis='y', labelcolor=colour)
-        self.fig.tight_layout()
-        self.canvas.draw()
+    def blit(self):
+        """Draws the lines on the background of the axes."""
+        if self.background is None:
+            self.canvas.draw()
+            return
+        self.canvas.restore_region(self.background)
+        self.ax.draw_artist(self.mag_line)
+        self.ax2.draw_artist(self.phase_line)
+        self.canvas.blit(self.fig.bbox)